@@ -1,39 +1,70 @@
-from .unit_handling import (
-    DimensionalityError,
-    UnitStrippedWarning,
-    ureg,
-    Quantity,
-    convert_units,
-    magnitude,
-    dimensionless_magnitude,
-)
+"""Plasma radiated power calculated using OpenADAS.
+
+The public names are imported lazily (when they are first used), so that importing radas is fast, and
+programs which only use part of radas (i.e. the unit helpers or RateTable) do not load the command line,
+the plotting or SciPy.
+"""
+import importlib
+from typing import TYPE_CHECKING
 
-from .cli import (
-    run_radas_cli,
-    run_radas,
-    run_radas_computation,
-    write_config_template,
+# The module which defines each public name
+_public_modules = dict(
+    DimensionalityError="unit_handling",
+    UnitStrippedWarning="unit_handling",
+    ureg="unit_handling",
+    Quantity="unit_handling",
+    convert_units="unit_handling",
+    magnitude="unit_handling",
+    dimensionless_magnitude="unit_handling",
+    run_radas_cli="cli",
+    run_radas="pipeline",
+    run_radas_computation="pipeline",
+    required_rate_coefficients="pipeline",
+    read_rate_coeff="read_rate_coeffs",
+    calculate_coronal_fractional_abundances="coronal_equilibrium",
+    calculate_Lz="radiated_power",
+    calculate_time_evolution="time_evolution",
+    calculate_steady_state_fractional_abundances="steady_state",
+    RateTable="rate_table",
+    bundle_charge_states="superstaging",
+    unbundle_charge_states="superstaging",
+    compare_bundled_to_resolved="superstaging",
+    write_config_template="cli",
 )
 
-from .read_rate_coeffs import read_rate_coeff
-from .coronal_equilibrium import calculate_coronal_fractional_abundances
-from .radiated_power import calculate_Lz
-from .time_evolution import calculate_time_evolution
-
-__all__ = [
-    "DimensionalityError",
-    "UnitStrippedWarning",
-    "ureg",
-    "Quantity",
-    "convert_units",
-    "magnitude",
-    "dimensionless_magnitude",
-    "run_radas_cli",
-    "run_radas",
-    "run_radas_computation",
-    "read_rate_coeff",
-    "calculate_coronal_fractional_abundances",
-    "calculate_Lz",
-    "calculate_time_evolution",
-    "write_config_template",
-]
+if TYPE_CHECKING:
+    from .unit_handling import (
+        DimensionalityError,
+        UnitStrippedWarning,
+        ureg,
+        Quantity,
+        convert_units,
+        magnitude,
+        dimensionless_magnitude,
+    )
+    from .cli import run_radas_cli, write_config_template
+    from .pipeline import run_radas, run_radas_computation, required_rate_coefficients
+    from .read_rate_coeffs import read_rate_coeff
+    from .coronal_equilibrium import calculate_coronal_fractional_abundances
+    from .radiated_power import calculate_Lz
+    from .time_evolution import calculate_time_evolution
+    from .steady_state import calculate_steady_state_fractional_abundances
+    from .rate_table import RateTable
+    from .superstaging import bundle_charge_states, unbundle_charge_states, compare_bundled_to_resolved
+
+
+def __getattr__(name: str):
+    if name not in _public_modules:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{_public_modules[name]}", __name__), name)
+    # Cache the value, so that __getattr__ is only called on first use
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+__all__ = list(_public_modules)
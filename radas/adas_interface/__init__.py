@@ -1,9 +1,28 @@
-from .determine_adas_dataset_type import determine_reader_class_and_config
-from .download_adas_datasets import download_species_data
-from .read_adf11_file import read_adf11_file
+from .determine_adas_dataset_type import (
+    determine_reader_class_and_config,
+    determine_data_file_key,
+    data_file_name,
+)
+from .download_adas_datasets import download_species_data, download_all_species_data
+from .read_adf11_file import (
+    read_adf11_file,
+    read_adf11_data_file,
+    legacy_data_file_name,
+    index_adf11_file,
+    read_adf11_file_selection,
+)
+from .adf11_cache import read_adf11_file_cached
 
 __all__ = [
     "determine_reader_class_and_config",
+    "determine_data_file_key",
+    "data_file_name",
     "download_species_data",
+    "download_all_species_data",
     "read_adf11_file",
+    "read_adf11_data_file",
+    "legacy_data_file_name",
+    "index_adf11_file",
+    "read_adf11_file_selection",
+    "read_adf11_file_cached",
 ]
@@ -0,0 +1,62 @@
+"""Persistent binary cache of parsed ADF11 files.
+
+The parsed arrays are stored in a .npz file beside each .dat file, tagged with the SHA-256 hash of the
+source file and the parser version. The cache is rebuilt transparently if either of these change.
+"""
+from pathlib import Path
+import hashlib
+import numpy as np
+from .read_adf11_file import read_adf11_data_file, adf11_parser_version
+from ..shared import write_atomically
+
+integer_keys = ["IZMAX", "IDMAXD", "ITMAXD", "IZ1MIN", "IZ1MAX"]
+array_keys = ["DDENSD", "DTEVD", "DRCOFD"]
+
+
+def hash_file(filename) -> str:
+    """Return the SHA-256 hex digest of a file."""
+    with open(filename, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+def read_adf11_file_cached(filename: Path, use_cache: bool = True) -> dict:
+    """Read an ADF11 file, reusing the parsed arrays from the cache if the source file is unchanged."""
+    if not use_cache:
+        return read_adf11_data_file(filename)
+
+    if not filename.exists():
+        raise FileNotFoundError(f"{filename} does not exist.")
+
+    cache_file = filename.with_suffix(".npz")
+    source_hash = hash_file(filename)
+
+    data = read_cache_file(cache_file, source_hash)
+    if data is None:
+        data = read_adf11_data_file(filename)
+        write_cache_file(cache_file, source_hash, data)
+
+    return data
+
+
+def read_cache_file(cache_file, source_hash: str):
+    """Return the cached data, or None if the cache is missing, stale or unreadable."""
+    if not cache_file.exists():
+        return None
+
+    try:
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if cached["source_hash"].item() != source_hash or cached["parser_version"].item() != adf11_parser_version:
+                return None
+
+            data = {key: int(cached[key]) for key in integer_keys}
+            data.update({key: cached[key] for key in array_keys})
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return data
+
+
+def write_cache_file(cache_file, source_hash: str, data: dict):
+    """Write the cache atomically, so that concurrent readers never see a partially-written file."""
+    with write_atomically(cache_file) as file:
+        np.savez(file, source_hash=source_hash, parser_version=adf11_parser_version, **data)
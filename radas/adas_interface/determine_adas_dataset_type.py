@@ -6,3 +6,34 @@ def determine_reader_class_and_config(data_file_config, dataset_type):
                 return reader_key, dataset_config
 
     raise NotImplementedError(f"Cannot identify reader for {dataset_type}.")
+
+
+def determine_data_file_key(species_name, species_config, data_file_config, dataset_type):
+    """Return the (reader class, prefix, year, element) which uniquely identifies the data file for a dataset_type.
+
+    Species which reuse the data of another species (i.e. deuterium and tritium using the hydrogen data)
+    have the same key as that species, so that the data file only needs to be downloaded and parsed once.
+    """
+    reader_class, dataset_config = determine_reader_class_and_config(
+        data_file_config, dataset_type
+    )
+    file_to_download = species_config["data_files"][dataset_type]
+
+    # Entries can be a simple int (year) or a [element, year] list
+    if isinstance(file_to_download, int):
+        element = species_config["atomic_symbol"].lower()
+        year = file_to_download
+    elif isinstance(file_to_download, list) and len(file_to_download) == 2:
+        element = file_to_download[0].lower()
+        year = file_to_download[1]
+    else:
+        raise NotImplementedError(f"Could not process entry: {file_to_download} for {species_name} {dataset_type}")
+
+    return reader_class, dataset_config["prefix"].lower(), year, element
+
+
+def data_file_name(data_file_key) -> str:
+    """Return the OpenADAS filename for a data file key, which is also used to store the file locally."""
+    _, dataset_prefix, year, element = data_file_key
+    year_key = f"{year}"[-2:]
+    return f"{dataset_prefix}{year_key}_{element}.dat"
@@ -1,6 +1,21 @@
 from pathlib import Path
-import urllib.request
-from .determine_adas_dataset_type import determine_reader_class_and_config
+from typing import Callable, Optional
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urljoin
+import functools
+import http.client
+import shutil
+import threading
+from .determine_adas_dataset_type import determine_data_file_key, data_file_name
+from .read_adf11_file import legacy_data_file_name
+from ..shared import default_url_base, write_atomically
+
+# OpenADAS returns an HTML page containing this marker (with status 200) if a file does not exist.
+error_page_marker = b"OPEN-ADAS Error"
+
+# Prevent messages from different download threads from being interleaved.
+print_lock = threading.Lock()
 
 
 def download_species_data(
@@ -9,43 +24,255 @@ def download_species_data(
     species_config: dict,
     data_file_config: dict,
     verbose: int,
-    url_base: str = "https://open.adas.ac.uk",
+    url_base: str = default_url_base,
+    max_workers: int = 8,
+    dataset_types: Optional[list[str]] = None,
 ):
     """Downloads all of the data files for a specific species."""
+    download_all_species_data(
+        data_file_dir,
+        {species_name: species_config},
+        data_file_config,
+        verbose=verbose,
+        url_base=url_base,
+        max_workers=max_workers,
+        dataset_types=dataset_types,
+    )
+
+
+def download_all_species_data(
+    data_file_dir: Path,
+    species_configs: dict,
+    data_file_config: dict,
+    verbose: int,
+    url_base: str = default_url_base,
+    max_workers: int = 8,
+    dataset_types: Optional[list[str]] = None,
+    on_species_downloaded: Optional[Callable[[str], None]] = None,
+):
+    """Downloads all of the data files for several species concurrently.
+
+    The files are fetched by a bounded pool of threads, which share persistent HTTP connections.
+    If dataset_types is given, only the data files for those datasets are downloaded. If
+    on_species_downloaded is given, it is called (from a download thread) with the name of each
+    species as soon as all of its data files are on disk, so that the species can be processed
+    while the other downloads are still running.
+    """
     data_file_dir.mkdir(exist_ok=True, parents=True)
 
-    for dataset_type, file_to_download in species_config["data_files"].items():
+    # Key the downloads on the data file, so that files shared between species are only downloaded once
+    downloads = dict()
+    remaining_files = dict()
+    for species_name, species_config in species_configs.items():
+        species_downloads = list_species_downloads(
+            data_file_dir, species_name, species_config, data_file_config, url_base, dataset_types
+        )
+        for data_file_key, download in species_downloads.items():
+            downloads.setdefault(data_file_key, download)
+            if downloads[data_file_key] is not download:
+                downloads[data_file_key]["legacy_filenames"].extend(download["legacy_filenames"])
+        remaining_files[species_name] = set(species_downloads.keys())
+
+    remaining_files_lock = threading.Lock()
+
+    def file_downloaded(data_file_key, future):
+        if future.exception() is not None:
+            return
+        with remaining_files_lock:
+            ready_species = []
+            for species_name, data_file_keys in remaining_files.items():
+                if data_file_key in data_file_keys:
+                    data_file_keys.remove(data_file_key)
+                    if not data_file_keys:
+                        ready_species.append(species_name)
+        for species_name in ready_species:
+            on_species_downloaded(species_name)
+
+    if on_species_downloaded is not None:
+        for species_name, data_file_keys in remaining_files.items():
+            if not data_file_keys:
+                on_species_downloaded(species_name)
+
+    connection_pool = ConnectionPool()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            for data_file_key, download in downloads.items():
+                future = executor.submit(download_file, connection_pool, verbose=verbose, **download)
+                if on_species_downloaded is not None:
+                    future.add_done_callback(functools.partial(file_downloaded, data_file_key))
+                futures.append(future)
+        # Re-raise the first exception from the workers (if any)
+        for future in futures:
+            future.result()
+    finally:
+        connection_pool.close()
+
+
+def list_species_downloads(
+    data_file_dir: Path,
+    species_name: str,
+    species_config: dict,
+    data_file_config: dict,
+    url_base: str,
+    dataset_types: Optional[list[str]] = None,
+) -> dict:
+    """Lists the URL and output filename of each data file for a specific species, keyed by data file."""
+    downloads = dict()
+
+    for dataset_type in species_config["data_files"].keys():
+        if dataset_types is not None and dataset_type not in dataset_types:
+            continue
+
+        data_file_key = determine_data_file_key(
+            species_name, species_config, data_file_config, dataset_type
+        )
+        reader_class, dataset_prefix, year, _ = data_file_key
+        year_key = f"{year}"[-2:]
+        filename = data_file_name(data_file_key)
 
-        reader_class, dataset_config = determine_reader_class_and_config(
-            data_file_config, dataset_type
+        downloads[data_file_key] = dict(
+            query_path=f"{url_base}/download/{reader_class}/{dataset_prefix}{year_key}/{filename}",
+            output_filename=data_file_dir / filename,
+            description=f"the {year} {dataset_prefix} for {species_name}",
+            # Where older versions of radas stored the file, so that existing data_files are not downloaded again
+            legacy_filenames=[data_file_dir / legacy_data_file_name(species_name, dataset_type, year)],
         )
 
-        if isinstance(file_to_download, int):
-            species_key = species_config["atomic_symbol"].lower()
-            year = file_to_download
-        elif isinstance(file_to_download, list) and len(file_to_download) == 2:
-            species_key = file_to_download[0].lower()
-            year = file_to_download[1]
+    return downloads
+
+
+def download_file(
+    connection_pool: "ConnectionPool",
+    query_path: str,
+    output_filename: Path,
+    description: str,
+    verbose: int,
+    max_redirects: int = 5,
+    legacy_filenames: tuple[Path, ...] = (),
+):
+    """Stream a single file to disk, unless it already exists.
+
+    The file is written to a temporary file which is renamed once the download completes, so
+    that an interrupted download never leaves a partial file behind. If the OpenADAS error page
+    is detected in the stream, the download is abandoned. If the file was stored under one of
+    the legacy_filenames by an older version of radas, it is copied instead of downloaded.
+    """
+    if output_filename.exists():
+        if verbose >= 2:
+            with print_lock:
+                print(f"Reusing {query_path} ({output_filename} already exists)")
+        return
+
+    legacy_filename = next((filename for filename in legacy_filenames if filename.exists()), None)
+    if legacy_filename is not None:
+        if verbose >= 2:
+            with print_lock:
+                print(f"Reusing {query_path} (copying {legacy_filename} to {output_filename})")
+        with open(legacy_filename, "rb") as source, write_atomically(output_filename) as file:
+            shutil.copyfileobj(source, file)
+        return
+
+    if verbose >= 2:
+        with print_lock:
+            print(f"Downloading {query_path} to {output_filename}")
+
+    url = query_path
+    for _ in range(max_redirects + 1):
+        scheme, netloc, connection, response = connection_pool.request(url)
+        if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+            response.read()
+            connection_pool.release(scheme, netloc, connection)
+            url = urljoin(url, response.getheader("Location"))
+            continue
+        break
+
+    try:
+        if response.status == 404:
+            # A mirror will usually return 'not found' instead of the OpenADAS error page
+            found_error_page = True
+        elif response.status != 200:
+            raise OSError(f"Failed to download {query_path}: HTTP {response.status} {response.reason}")
         else:
-            raise NotImplementedError(f"Could not process entry: {file_to_download} for {species_name} {dataset_type}")
+            found_error_page = write_response_atomically(response, output_filename)
+    except BaseException:
+        connection.close()
+        raise
+
+    if found_error_page:
+        # The rest of the response was not read, so the connection cannot be reused
+        connection.close()
+        if verbose:
+            with print_lock:
+                print(f"Failed to download {description}")
+    else:
+        connection_pool.release(scheme, netloc, connection)
 
-        year_key = f"{year}"[-2:]
-        dataset_prefix = dataset_config["prefix"].lower()
 
-        output_filename = data_file_dir / f"{species_name}_{dataset_type}_{year_key}.dat"
-        query_path = f"{url_base}/download/{reader_class}/{dataset_prefix}{year_key}/{dataset_prefix}{year_key}_{species_key}.dat"
+class ErrorPageFound(Exception):
+    """Raised to abandon a download when the OpenADAS error page is found in the response."""
 
-        if not output_filename.exists():
-            if verbose >= 2:
-                print(f"Downloading {query_path} to {output_filename}")
-            urllib.request.urlretrieve(query_path, output_filename)
+
+def write_response_atomically(response: http.client.HTTPResponse, output_filename: Path, chunk_size: int = 65536) -> bool:
+    """Write a response to output_filename via a temporary file, returning True if the error page was found instead."""
+    try:
+        previous_chunk_tail = b""
+        with write_atomically(output_filename) as file:
+            while chunk := response.read(chunk_size):
+                if error_page_marker in previous_chunk_tail + chunk:
+                    raise ErrorPageFound
+                previous_chunk_tail = chunk[-len(error_page_marker):]
+                file.write(chunk)
+    except ErrorPageFound:
+        return True
+
+    return False
+
+
+class ConnectionPool:
+    """A thread-safe pool of persistent HTTP(S) connections, keyed by scheme and host."""
+
+    def __init__(self, timeout: float = 60.0):
+        self.timeout = timeout
+        self.idle_connections = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def acquire(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        """Return an idle connection to netloc, or open a new one."""
+        with self.lock:
+            if self.idle_connections[(scheme, netloc)]:
+                return self.idle_connections[(scheme, netloc)].pop()
+
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        elif scheme == "http":
+            return http.client.HTTPConnection(netloc, timeout=self.timeout)
         else:
-            if verbose >= 2:
-                print(f"Reusing {query_path} ({output_filename} already exists)")
+            raise NotImplementedError(f"Cannot download from {scheme} URLs.")
+
+    def release(self, scheme: str, netloc: str, connection: http.client.HTTPConnection):
+        """Return a connection to the pool once its response has been fully read."""
+        with self.lock:
+            self.idle_connections[(scheme, netloc)].append(connection)
+
+    def request(self, url: str):
+        """Send a GET request for url, retrying once on a fresh connection if a pooled connection was closed by the server."""
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+
+        connection = self.acquire(parts.scheme, parts.netloc)
+        for attempt in range(2):
+            try:
+                connection.request("GET", path)
+                return parts.scheme, parts.netloc, connection, connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if attempt:
+                    raise
 
-        if "OPEN-ADAS Error" in output_filename.read_text():
-            output_filename.unlink()
-            if verbose:
-                print(
-                    f"Failed to download the {year} {dataset_prefix} for {species_name}"
-                )
+    def close(self):
+        with self.lock:
+            for connections in self.idle_connections.values():
+                for connection in connections:
+                    connection.close()
+            self.idle_connections.clear()
@@ -65,3 +65,38 @@ def read_2d_array(generator, rows, columns, fortran_order_arrays=False):
         array = array.reshape((columns, rows))
 
     return array, line_number, value_position
+
+def read_fixed_width_array(list_of_lines, number_of_values, start_at_line, field_width=10, fields_per_line=8):
+    """
+    Read number_of_values fixed-width fields into a 1D array in a single vectorised pass.
+
+    This is a fast equivalent of read_1d_array(read_single_values(list_of_lines, "8f10.5", start_at_line), number_of_values)
+    for blocks where every line except the last holds fields_per_line values. Rather than parsing line-by-line, the lines
+    of the block are joined into a single buffer which is sliced into field_width-character columns by NumPy.
+
+    A ValueError is raised if the block does not have this layout (i.e. a line is short, a field is blank or a field
+    relies on an implied decimal point), so that the caller can fall back to the fortranformat reader.
+
+    Returns the array, and the line number and position of the last value (matching read_1d_array).
+    """
+    number_of_lines = -(-number_of_values // fields_per_line)
+    line_width = field_width * fields_per_line
+
+    block_lines = list_of_lines[start_at_line:start_at_line + number_of_lines]
+    if len(block_lines) < number_of_lines:
+        raise ValueError(
+            f"Expected {number_of_lines} lines starting at line {start_at_line}, but only {len(block_lines)} remain."
+        )
+
+    block = "".join(line.rstrip("\r")[:line_width].ljust(line_width) for line in block_lines)
+    fields = np.frombuffer(block.encode("ascii"), dtype=f"S{field_width}")
+
+    values, trailing_fields = fields[:number_of_values], fields[number_of_values:]
+    if np.any(np.char.strip(trailing_fields) != b""):
+        raise ValueError(f"Found unexpected values after the end of the block starting at line {start_at_line}.")
+    if not np.all(np.char.find(values, b".") >= 0):
+        raise ValueError(f"Found blank or implied-decimal fields in the block starting at line {start_at_line}.")
+
+    array = values.astype(np.float64)
+
+    return array, start_at_line + number_of_lines - 1, (number_of_values - 1) % fields_per_line
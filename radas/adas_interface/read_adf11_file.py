@@ -1,8 +1,14 @@
 from pathlib import Path
+from typing import Optional
 import importlib.util
-from .fortran_reader import FReader, read_single_values, read_1d_array, read_2d_array
+import mmap
+import re
+from .fortran_reader import FReader, read_single_values, read_1d_array, read_2d_array, read_fixed_width_array
 import numpy as np
 
+# Increment this whenever a change to the reader would change its output, to invalidate cached data.
+adf11_parser_version = 1
+
 
 def load_library(library_name: str, filepath: Path):
     spec = importlib.util.spec_from_file_location(library_name, filepath)
@@ -13,16 +19,30 @@ def load_library(library_name: str, filepath: Path):
     return library
 
 
-def read_adf11_file(
-    data_file_dir, species_name, year, dataset_type
-) -> dict:
+def read_adf11_file(data_file_dir: Path, species_name: str, year, dataset_type: str) -> dict:
+    """Open and read an ADF11 file stored under its name from older versions of radas.
+
+    Data files used to be stored as {species_name}_{dataset_type}_{yy}.dat, which is the file read here. They
+    are now stored under their OpenADAS names (see data_file_name), which are read with read_adf11_data_file.
+    """
+    return read_adf11_data_file(data_file_dir / legacy_data_file_name(species_name, dataset_type, year))
+
+
+def legacy_data_file_name(species_name: str, dataset_type: str, year) -> str:
+    """Return the name which older versions of radas stored a data file under."""
+    return f"{species_name}_{dataset_type}_{f'{year}'[-2:]}.dat"
+
+
+def read_adf11_data_file(filename: Path, use_fortranformat: bool = False) -> dict:
     """Open and read an ADF11 OpenADAS file.
     
     Uses the format specification from https://www.adas.ac.uk/man/appxa-11.pdf
+
+    By default, the data blocks are sliced into fixed-width columns in a single vectorised pass. If the file
+    does not have the expected layout (or if use_fortranformat is True), the blocks are instead read value-by-value
+    using fortranformat.
     """
 
-    year_key = f"{year}"[-2:]
-    filename = data_file_dir / f"{species_name}_{dataset_type}_{year_key}.dat"
     if not filename.exists():
         raise FileNotFoundError(f"{filename} does not exist.")
 
@@ -30,6 +50,46 @@ def read_adf11_file(
 
     IZMAX, IDMAXD, ITMAXD, IZ1MIN, IZ1MAX = FReader("5i5").read(f[0])
 
+    if not use_fortranformat:
+        try:
+            DDENSD, DTEVD, DRCOFD = read_adf11_blocks(f, IZMAX, IDMAXD, ITMAXD)
+        except ValueError:
+            use_fortranformat = True
+
+    if use_fortranformat:
+        DDENSD, DTEVD, DRCOFD = read_adf11_blocks_with_fortranformat(f, IZMAX, IDMAXD, ITMAXD)
+
+    data = dict(
+        IZMAX = IZMAX,
+        IDMAXD = IDMAXD,
+        ITMAXD = ITMAXD,
+        IZ1MIN = IZ1MIN,
+        IZ1MAX = IZ1MAX,
+        DDENSD = DDENSD,
+        DTEVD = DTEVD,
+        DRCOFD = DRCOFD,
+    )
+
+    return data
+
+
+def read_adf11_blocks(f, IZMAX, IDMAXD, ITMAXD):
+    """Read the density, temperature and coefficient blocks of an ADF11 file by slicing fixed-width columns."""
+    DDENSD, line_number, _ = read_fixed_width_array(f, number_of_values=IDMAXD, start_at_line=2)
+    DTEVD, line_number, _ = read_fixed_width_array(f, number_of_values=ITMAXD, start_at_line=line_number + 1)
+
+    DRCOFD = np.zeros((IZMAX, ITMAXD, IDMAXD))
+
+    for IZ1 in range(IZMAX):
+        # Skip the separator line at the start of each block
+        block, line_number, _ = read_fixed_width_array(f, number_of_values=ITMAXD * IDMAXD, start_at_line=line_number + 2)
+        DRCOFD[IZ1, :, :] = block.reshape((ITMAXD, IDMAXD))
+
+    return DDENSD, DTEVD, DRCOFD
+
+
+def read_adf11_blocks_with_fortranformat(f, IZMAX, IDMAXD, ITMAXD):
+    """Read the density, temperature and coefficient blocks of an ADF11 file value-by-value using fortranformat."""
     # Initialise the value reader
     
     # IMPORTANT: do not reinitialise the reader, since otherwise we'll loose the position of the reader
@@ -45,7 +105,39 @@ def read_adf11_file(
         value_reader = read_single_values(f, start_at_line=line_number + 2, format_spec="8f10.5")
         DRCOFD[IZ1, :, :], line_number, _ = read_2d_array(value_reader, rows=IDMAXD, columns=ITMAXD, fortran_order_arrays=False)
 
-    data = dict(
+    return DDENSD, DTEVD, DRCOFD
+
+
+def index_adf11_file(filename: Path) -> dict:
+    """Scan an ADF11 file once, reading the header and grids and recording where each charge-state block starts.
+
+    The coefficient blocks are not parsed. Instead, the byte offset of the separator line before each block
+    is stored in block_offsets, so that individual blocks can be read with read_adf11_file_selection.
+    """
+    if not filename.exists():
+        raise FileNotFoundError(f"{filename} does not exist.")
+
+    with open(filename, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        header_end = mapped.find(b"\n")
+        IZMAX, IDMAXD, ITMAXD, IZ1MIN, IZ1MAX = FReader("5i5").read(mapped[:header_end].decode("ascii"))
+
+        # Separator lines start with '--', which no f10.5 value can. The first separator is the
+        # line after the header, so the grids are between it and the next separator.
+        separators = [match.start() for match in re.finditer(rb"^--", mapped, flags=re.MULTILINE)]
+        if len(separators) != IZMAX + 1:
+            raise ValueError(f"Expected {IZMAX + 1} separator lines in {filename}, but found {len(separators)}.")
+
+        grid_lines = mapped[:separators[1]].decode("ascii").split("\n")
+
+    try:
+        DDENSD, line_number, _ = read_fixed_width_array(grid_lines, number_of_values=IDMAXD, start_at_line=2)
+        DTEVD, _, _ = read_fixed_width_array(grid_lines, number_of_values=ITMAXD, start_at_line=line_number + 1)
+    except ValueError:
+        value_reader = read_single_values(grid_lines, start_at_line=2, format_spec="8f10.5")
+        DDENSD, _, _ = read_1d_array(value_reader, number_of_values=IDMAXD)
+        DTEVD, _, _ = read_1d_array(value_reader, number_of_values=ITMAXD)
+
+    return dict(
         IZMAX = IZMAX,
         IDMAXD = IDMAXD,
         ITMAXD = ITMAXD,
@@ -53,7 +145,59 @@ def read_adf11_file(
         IZ1MAX = IZ1MAX,
         DDENSD = DDENSD,
         DTEVD = DTEVD,
-        DRCOFD = DRCOFD,
+        block_offsets = separators[1:],
     )
 
-    return data
+
+def read_adf11_file_selection(
+    filename: Path,
+    dim_charge_state=None,
+    dim_electron_temp=None,
+    dim_electron_density=None,
+    index: Optional[dict] = None,
+) -> dict:
+    """Read a subset of the charge states, temperatures and densities of an ADF11 file.
+
+    The selections are integer indices (a slice, list or array), using the dimension names of the rate
+    coefficient DataArrays. The file is indexed with index_adf11_file (unless an index is passed), and
+    then only the blocks of the selected charge states are memory-mapped and parsed.
+
+    Returns the same keys as read_adf11_data_file with the arrays restricted to the selection, and with
+    the selected (0-based) charge states in charge_states.
+    """
+    if index is None:
+        index = index_adf11_file(filename)
+
+    charge_states = np.arange(index["IZMAX"])[dim_charge_state if dim_charge_state is not None else slice(None)]
+    temp_indices = np.arange(index["ITMAXD"])[dim_electron_temp if dim_electron_temp is not None else slice(None)]
+    density_indices = np.arange(index["IDMAXD"])[dim_electron_density if dim_electron_density is not None else slice(None)]
+    charge_states, temp_indices, density_indices = np.atleast_1d(charge_states, temp_indices, density_indices)
+
+    number_of_values = index["ITMAXD"] * index["IDMAXD"]
+    DRCOFD = np.zeros((charge_states.size, temp_indices.size, density_indices.size))
+
+    with open(filename, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for i, IZ1 in enumerate(charge_states):
+            block_start = index["block_offsets"][IZ1]
+            block_end = index["block_offsets"][IZ1 + 1] if IZ1 + 1 < index["IZMAX"] else len(mapped)
+            block_lines = mapped[block_start:block_end].decode("ascii").split("\n")
+
+            try:
+                block, _, _ = read_fixed_width_array(block_lines, number_of_values=number_of_values, start_at_line=1)
+            except ValueError:
+                value_reader = read_single_values(block_lines, start_at_line=1, format_spec="8f10.5")
+                block, _, _ = read_1d_array(value_reader, number_of_values=number_of_values)
+
+            DRCOFD[i] = block.reshape((index["ITMAXD"], index["IDMAXD"]))[np.ix_(temp_indices, density_indices)]
+
+    return dict(
+        IZMAX = index["IZMAX"],
+        IDMAXD = index["IDMAXD"],
+        ITMAXD = index["ITMAXD"],
+        IZ1MIN = index["IZ1MIN"],
+        IZ1MAX = index["IZ1MAX"],
+        DDENSD = index["DDENSD"][density_indices],
+        DTEVD = index["DTEVD"][temp_indices],
+        DRCOFD = DRCOFD,
+        charge_states = charge_states,
+    )
@@ -1,21 +1,14 @@
+"""The radas command line.
+
+Only click and the standard library are imported when this module is loaded, so that the command line
+starts (and prints --help) quickly. The computation itself is in pipeline.py.
+"""
 import click
-import xarray as xr
-import multiprocessing as mp
+import contextlib
 from pathlib import Path
-from functools import partial
 from typing import Optional
-import contextlib
-
-from .shared import open_yaml_file, default_config_file
-from .adas_interface.download_adas_datasets import download_species_data
-from .read_rate_coeffs import read_rate_coeff
-
-from .coronal_equilibrium import calculate_coronal_fractional_abundances
-from .radiated_power import calculate_Lz
-from .time_evolution import calculate_time_evolution
-from .unit_handling import convert_units, ureg
-from .mavrin_reference import compare_radas_to_mavrin
 
+from .shared import default_config_file, default_url_base
 
 @click.command()
 @click.option(
@@ -47,12 +40,57 @@ from .mavrin_reference import compare_radas_to_mavrin
     is_flag=True,
     help="Flag to enable debug mode (disables multiprocessing).",
 )
+@click.option(
+    "--url-base",
+    default=None,
+    help=f"Base URL of the OpenADAS server or a local mirror. DEFAULT: url_base in the config file, or {default_url_base}",
+)
+@click.option(
+    "--all-rate-coefficients",
+    is_flag=True,
+    help="Flag to download and process every dataset in data_files, not just those needed for the computation.",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Flag to re-parse the ADAS data files instead of reusing the cached parsed data.",
+)
+@click.option(
+    "-j",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of worker processes to use for the computation. DEFAULT: the number of CPUs",
+)
+@click.option(
+    "--max-memory",
+    default=None,
+    callback=lambda ctx, param, value: None if value is None else parse_memory(value),
+    help="Memory budget for the computation (i.e. '16GB' or '500MiB', or a number in GB), which limits the number of tasks run at the same time. DEFAULT: no limit",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Flag to recompute every species (and remake every plot), even if its output is up to date.",
+)
+@click.option(
+    "--no-plots",
+    is_flag=True,
+    help="Flag to skip the plots comparing the outputs to Mavrin, J. Fus. Eng., 2017 (i.e. for batch runs).",
+)
 def run_radas_cli(
     directory: Path,
     config: Optional[str],
     species: list[str],
     verbose: int,
     debug: bool,
+    all_rate_coefficients: bool,
+    no_cache: bool,
+    url_base: Optional[str],
+    workers: Optional[int],
+    max_memory: Optional[float],
+    force: bool,
+    no_plots: bool,
 ):
     """Runs the radas program.
 
@@ -61,13 +99,26 @@ def run_radas_cli(
 
     If species is given, it must be a valid species name (i.e. 'hydrogen').
     Otherwise, all valid species in the config.yaml file are evaluated.
+
+    Species whose output is up to date (see compute_fingerprint) are skipped,
+    unless force is set. Plots which are newer than their output are also
+    skipped, and no_plots skips the plots altogether.
     """
+    from .pipeline import run_radas
+
     kwargs = dict(
         directory=directory,
         config=config,
         species=species,
         verbose=verbose,
         debug=debug,
+        use_cache=not no_cache,
+        url_base=url_base,
+        all_rate_coefficients=all_rate_coefficients,
+        workers=workers,
+        max_memory=max_memory,
+        force=force,
+        plots=not no_plots,
     )
     
     if debug:
@@ -86,120 +137,17 @@ def _post_mortem_debugger():
         return contextlib.nullcontext()
     return launch_ipdb_on_exception()
 
-def run_radas(
-    directory: Path,
-    config: Optional[str],
-    species: list[str],
-    verbose: int,
-    debug: bool,
-):
-
-    radas_dir = Path(directory)
-    if verbose:
-        print(f"Running radas in {radas_dir.absolute()}")
-    data_file_dir = radas_dir / "data_files"
-    output_dir = radas_dir / "output"
-
-    for path in [radas_dir, data_file_dir, output_dir]:
-        path.mkdir(exist_ok=True)
-
-    if species == ("none",):
-        if verbose:
-            print("Skipping computation.")
-    else:
-        config_file = default_config_file if config is None else Path(config).absolute()
-        if verbose:
-            print(f"Opening config file at {config_file}")
-        configuration = open_yaml_file(config_file)
-
-        if verbose:
-            print(f"Downloading data from OpenADAS to {data_file_dir.absolute()}")
-        for species_name, species_config in configuration["species"].items():
-            if "data_files" in species_config and (
-                (species_name in species) or (species == ("all",))
-            ):
-                download_species_data(
-                    data_file_dir,
-                    species_name,
-                    species_config,
-                    configuration["data_file_config"],
-                    verbose=verbose,
-                )
-
-        if verbose:
-            print("Reading rate coefficients")
-        datasets = dict()
-        for species_name, species_config in configuration["species"].items():
-            if "data_files" in species_config and (
-                (species_name in species) or (species == ("all",))
-            ):
-                datasets[species_name] = read_rate_coeff(
-                    data_file_dir, species_name, configuration, verbose=verbose,
-                )
-        
-        output_dir.mkdir(exist_ok=True, parents=True)
-        if not debug:
-            with mp.Pool() as pool:
-                if species != ("all",):
-                    datasets = {
-                        species_name: datasets[species_name] for species_name in species
-                    }
-
-                # Sort by atomic number, to process heavier elements first since they take longer
-                # N.b. there will be a race condition, so it might not appear these start first
-                sorted_datasets = dict(sorted(datasets.items(), key=lambda item: item[1].atomic_number, reverse=True))
-                
-                pool.map(
-                    partial(
-                        run_radas_computation, output_dir=output_dir, verbose=verbose
-                    ),
-                    [(ds) for ds in sorted_datasets.values()],
-                )
-        else:
-            for ds in datasets.values():
-                run_radas_computation(ds, output_dir=output_dir, verbose=verbose)
-
-    if verbose:
-        print(f"Generating plots and saving output to {output_dir}")
-    compare_radas_to_mavrin(output_dir)
+def parse_memory(value: str) -> float:
+    """Convert a memory size (i.e. '16GB' or '500 MiB') to bytes. A number without units is in GB."""
+    from .unit_handling import Quantity, ureg
 
-    if verbose:
-        print("Done")
-
-
-def run_radas_computation(dataset: xr.Dataset, output_dir: Path, verbose: int):
-    """Calculate several dependent quantities based on the atomic rates, and store
-    the result as a NetCDF file.
-    """
-    if verbose:
-        print(f"Running computation for {dataset.species_name}")
-
-    dataset["coronal_charge_state_fraction"] = calculate_coronal_fractional_abundances(
-        dataset
-    )
-    dataset["coronal_mean_charge_state"] = (
-        dataset.coronal_charge_state_fraction * dataset.dim_charge_state
-    ).sum(dim="dim_charge_state")
-    dataset["coronal_Lz"] = calculate_Lz(dataset, dataset.coronal_charge_state_fraction)
-    dataset["residence_time"] = convert_units(
-        dataset.ne_tau / dataset.electron_density, ureg.s
-    )
-    dataset["charge_state_evolution"] = calculate_time_evolution(dataset)
-    dataset["equilibrium_charge_state_fraction"] = dataset.charge_state_evolution.isel(
-        dim_time=-1
-    )
-    dataset["equilibrium_mean_charge_state"] = (
-        dataset.equilibrium_charge_state_fraction * dataset.dim_charge_state
-    ).sum(dim="dim_charge_state")
-    dataset["equilibrium_Lz"] = calculate_Lz(
-        dataset, dataset.equilibrium_charge_state_fraction
-    )
-
-    output_dir.mkdir(exist_ok=True)
-    dataset.pint.dequantify().to_netcdf(output_dir / f"{dataset.species_name}.nc")
-
-    if verbose:
-        print(f"Finished computation for {dataset.species_name}")
+    try:
+        memory = Quantity(value)
+        if memory.unitless:
+            memory = memory * ureg.GB
+        return float(memory.m_as(ureg.byte))
+    except Exception as error:
+        raise click.BadParameter(f"Cannot parse '{value}' as a memory size.") from error
 
 
 @click.command()
@@ -215,3 +163,13 @@ def write_config_template(output: Path):
     print(f"Copying {default_config_file} to {output}")
     output.write_text(default_config_file.read_text())
     print("Done")
+
+
+def __getattr__(name: str):
+    """Forward the functions which moved to pipeline.py (i.e. radas.cli.run_radas), without importing it up front."""
+    if not name.startswith("__"):
+        from . import pipeline
+
+        if hasattr(pipeline, name):
+            return getattr(pipeline, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,27 +1,42 @@
+import numpy as np
 import xarray as xr
 from .unit_handling import dimensionless_magnitude
 
 
 def calculate_coronal_fractional_abundances(dataset: xr.Dataset) -> xr.DataArray:
-    """Calculate the fractional abundances of different charge states, assuming coronal equilibrium."""
+    """Calculate the fractional abundances of different charge states, assuming coronal equilibrium.
 
-    ratio_of_ionisation_to_recombination = (
+    The abundances are normalised from the log abundances (see calculate_log_coronal_abundances)
+    using the log-sum-exp trick.
+    """
+    log_abundance = calculate_log_coronal_abundances(dataset)
+
+    # Normalise relative to the most abundant charge state, so that the largest term in the sum is exp(0) = 1
+    charge_state_fraction = np.exp(log_abundance - log_abundance.max(dim="dim_charge_state"))
+    return charge_state_fraction / charge_state_fraction.sum(dim="dim_charge_state")
+
+
+def calculate_log_coronal_abundances(dataset: xr.Dataset) -> xr.DataArray:
+    """Calculate the (unnormalised) log abundances of the charge states in coronal equilibrium.
+
+    In coronal equilibrium, n_{k+1} / n_k = S_k / alpha_{k+1}, so the log abundance of each charge
+    state (relative to the neutral state) is the cumulative sum of the log ratios of ionisation to
+    recombination. Working in log space avoids the overflow and underflow of the product of ratios
+    for high-Z species. Charge states which cannot be reached have a log abundance of -inf.
+    """
+    ratio_of_ionisation_to_recombination = dimensionless_magnitude(
         dataset.effective_ionisation
         / dataset.effective_recombination.roll(dim_charge_state=-1)
-    )
-    charge_state_fraction = xr.zeros_like(ratio_of_ionisation_to_recombination)
-    ratio_of_ionisation_to_recombination = dimensionless_magnitude(
-        ratio_of_ionisation_to_recombination
-    )
+    ).transpose("dim_charge_state", ...)
 
-    charge_state_fraction[0] = 1.0
+    with np.errstate(divide="ignore"):
+        log_ratio = np.log(ratio_of_ionisation_to_recombination.values[: dataset.atomic_number])
 
-    for charge_state in range(dataset.atomic_number):
-        charge_state_fraction[charge_state + 1] = (
-            charge_state_fraction[charge_state]
-            * ratio_of_ionisation_to_recombination[charge_state]
-        )
+    log_abundance = np.zeros(ratio_of_ionisation_to_recombination.shape)
+    np.cumsum(log_ratio, axis=0, out=log_abundance[1 : dataset.atomic_number + 1])
 
-    charge_state_fraction /= charge_state_fraction.sum(dim="dim_charge_state")
-
-    return charge_state_fraction
+    return xr.DataArray(
+        log_abundance,
+        coords=ratio_of_ionisation_to_recombination.coords,
+        dims=ratio_of_ionisation_to_recombination.dims,
+    )
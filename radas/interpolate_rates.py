@@ -1,8 +1,8 @@
 """Routines for log-log interpolation of rate coefficients with boundary clipping."""
 import xarray as xr
 import numpy as np
-from scipy.interpolate import RectBivariateSpline
 from numpy.typing import NDArray
+from functools import lru_cache
 import warnings
 
 def is_significantly_below(requested, limit):
@@ -22,6 +22,8 @@ def interpolate_array(
     Uses nearest-neighbor extrapolation by clipping out-of-bounds coordinates to 
     the original grid edges.
     """
+    from scipy.interpolate import RectBivariateSpline
+
     units = array.pint.units
     array = array.pint.dequantify().squeeze()
 
@@ -35,31 +37,7 @@ def interpolate_array(
     if np.any(array <= 0.0):
         raise NotImplementedError("Cannot log-interpolate rate coefficients containing zeros.")
     
-    # Check if extrapolation is needed and raise a warning if this is the case.
-    out_of_bounds_msg = []
-
-    req_dens_min, req_dens_max = new_electron_density.min(), new_electron_density.max()
-    grid_dens_min, grid_dens_max = array.dim_electron_density.min(), array.dim_electron_density.max()
-
-    if is_significantly_below(req_dens_min, grid_dens_min) or is_significantly_above(req_dens_max, grid_dens_max):
-        out_of_bounds_msg.append(
-            f"Density requested [{req_dens_min:.2e}, {req_dens_max:.2e}] "
-            f"exceeds grid [{grid_dens_min:.2e}, {grid_dens_max:.2e}]."
-        )
-    
-    # Check Temperature Bounds
-    req_temp_min, req_temp_max = new_electron_temp.min(), new_electron_temp.max()
-    grid_temp_min, grid_temp_max = array.dim_electron_temp.min(), array.dim_electron_temp.max()
-
-    if is_significantly_below(req_temp_min, grid_temp_min) or is_significantly_above(req_temp_max, grid_temp_max):
-        out_of_bounds_msg.append(
-            f"Temperature requested [{req_temp_min:.2e}, {req_temp_max:.2e}] "
-            f"exceeds grid [{grid_temp_min:.2e}, {grid_temp_max:.2e}]."
-        )
-
-    if out_of_bounds_msg:
-        full_msg = "Nearest-neighbour extrapolation used for off-grid values: " + " ".join(out_of_bounds_msg)
-        warnings.warn(full_msg, RuntimeWarning)
+    warn_if_extrapolating(array.dim_electron_density, array.dim_electron_temp, new_electron_density, new_electron_temp)
     
     # ------------------------------------
     
@@ -83,4 +61,104 @@ def interpolate_array(
     return xr.DataArray(
         z_interp,
         coords=dict(dim_electron_temp=new_electron_temp, dim_electron_density=new_electron_density)
-    ) * units
\ No newline at end of file
+    ) * units
+
+
+def interpolate_charge_states(
+    array: xr.DataArray,
+    new_electron_density: NDArray[np.floating],
+    new_electron_temp: NDArray[np.floating]
+) -> xr.DataArray:
+    """
+    Interpolate the rate coefficients of every charge state onto a new density/temperature grid in log-log space.
+
+    This gives the same result as applying interpolate_array to each charge state, but in a single pass.
+    Since every charge state shares the same source grid, the interpolating bicubic spline is separable into
+    a pair of matrices (mapping values on the source grid to the spline evaluated on the target grid) which
+    are computed once and applied to all of the charge states as a matrix product.
+    """
+    units = array.pint.units
+    array = array.pint.dequantify().transpose("dim_charge_state", "dim_electron_density", "dim_electron_temp")
+    values = array.values
+
+    # Charge states where the rate is zero everywhere are returned as zeros (log of zero is undefined)
+    all_zero = np.all(values == 0.0, axis=(1, 2))
+    if np.any(values[~all_zero] <= 0.0):
+        raise NotImplementedError("Cannot log-interpolate rate coefficients containing zeros.")
+
+    warn_if_extrapolating(array.dim_electron_density, array.dim_electron_temp, new_electron_density, new_electron_temp)
+
+    density_matrix = build_interpolation_matrix(np.log10(array.dim_electron_density.values), np.log10(new_electron_density))
+    temp_matrix = build_interpolation_matrix(np.log10(array.dim_electron_temp.values), np.log10(new_electron_temp))
+
+    log_values = np.log10(np.where(all_zero[:, np.newaxis, np.newaxis], 1.0, values))
+    interpolated = np.power(10, density_matrix @ log_values @ temp_matrix.T)
+    interpolated[all_zero] = 0.0
+
+    return xr.DataArray(
+        interpolated.transpose(0, 2, 1),
+        coords=dict(
+            dim_charge_state=array.dim_charge_state.values,
+            dim_electron_temp=new_electron_temp,
+            dim_electron_density=new_electron_density,
+        )
+    ) * units
+
+
+def build_interpolation_matrix(x: NDArray[np.floating], x_interp: NDArray[np.floating]) -> NDArray[np.floating]:
+    """
+    Return the matrix which maps values on x to their interpolating cubic spline evaluated at x_interp.
+
+    The spline uses not-a-knot end conditions, matching RectBivariateSpline with s=0. Points outside of
+    x are clipped to the edges of x (nearest-neighbour extrapolation).
+
+    Data files of the same year usually share the same source grid, and each species is resampled onto a
+    grid set by the resolution in the config, so the matrices are cached (with least-recently-used eviction)
+    and reused across rate coefficients and species. The returned matrix is read-only.
+    """
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    x_interp = np.ascontiguousarray(x_interp, dtype=np.float64)
+    return _build_interpolation_matrix_cached(x.tobytes(), x_interp.tobytes())
+
+
+@lru_cache(maxsize=128)
+def _build_interpolation_matrix_cached(x_bytes: bytes, x_interp_bytes: bytes) -> NDArray[np.floating]:
+    """Build the interpolation matrix for grids passed as bytes (so that they can be used as cache keys)."""
+    from scipy.interpolate import make_interp_spline
+
+    x = np.frombuffer(x_bytes, dtype=np.float64)
+    x_interp = np.frombuffer(x_interp_bytes, dtype=np.float64)
+
+    x_clipped = np.clip(x_interp, x.min(), x.max())
+    matrix = make_interp_spline(x, np.eye(x.size), k=3)(x_clipped)
+    matrix.flags.writeable = False
+
+    return matrix
+
+
+def warn_if_extrapolating(grid_electron_density, grid_electron_temp, new_electron_density, new_electron_temp):
+    """Raise a warning if the requested grid extends beyond the original grid."""
+    out_of_bounds_msg = []
+
+    req_dens_min, req_dens_max = new_electron_density.min(), new_electron_density.max()
+    grid_dens_min, grid_dens_max = grid_electron_density.min(), grid_electron_density.max()
+
+    if is_significantly_below(req_dens_min, grid_dens_min) or is_significantly_above(req_dens_max, grid_dens_max):
+        out_of_bounds_msg.append(
+            f"Density requested [{req_dens_min:.2e}, {req_dens_max:.2e}] "
+            f"exceeds grid [{grid_dens_min:.2e}, {grid_dens_max:.2e}]."
+        )
+    
+    # Check Temperature Bounds
+    req_temp_min, req_temp_max = new_electron_temp.min(), new_electron_temp.max()
+    grid_temp_min, grid_temp_max = grid_electron_temp.min(), grid_electron_temp.max()
+
+    if is_significantly_below(req_temp_min, grid_temp_min) or is_significantly_above(req_temp_max, grid_temp_max):
+        out_of_bounds_msg.append(
+            f"Temperature requested [{req_temp_min:.2e}, {req_temp_max:.2e}] "
+            f"exceeds grid [{grid_temp_min:.2e}, {grid_temp_max:.2e}]."
+        )
+
+    if out_of_bounds_msg:
+        full_msg = "Nearest-neighbour extrapolation used for off-grid values: " + " ".join(out_of_bounds_msg)
+        warnings.warn(full_msg, RuntimeWarning)
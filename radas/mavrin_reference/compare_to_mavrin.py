@@ -1,6 +1,7 @@
+import functools
 import xarray as xr
 from pathlib import Path
-import matplotlib.pyplot as plt
+from typing import Optional
 from .read_mavrin_data import (
     read_mavrin_data,
     compute_Mavrin_polynomial_fit,
@@ -8,19 +9,51 @@ from .read_mavrin_data import (
 from ..unit_handling import ureg, magnitude_in_units
 
 
-def compare_radas_to_mavrin(output_dir: Path):
+def compare_radas_to_mavrin(output_dir: Path, pool=None, force: bool = False, verbose: int = 0):
+    """Plot the output of each species against Mavrin, J. Fus. Eng., 2017, saving the figures beside the outputs.
+
+    Plots which are newer than their output are up to date and are skipped (unless force is set). The
+    Mavrin data is read once and shared by every plot, and the plots are made on the pool if one is given.
+    """
+    species_to_plot = [
+        output_file.stem
+        for output_file in sorted(output_dir.glob("*.nc"))
+        if force or not plot_is_up_to_date(output_file)
+    ]
+    if not species_to_plot:
+        if verbose:
+            print("Plots are up to date")
+        return
+
+    plot_species = functools.partial(compare_radas_to_mavrin_per_species, output_dir, mavrin_data=read_mavrin_data())
+    if pool is None:
+        for species in species_to_plot:
+            plot_species(species)
+    else:
+        # Each plot is independent, so they are collected in whichever order they finish
+        for _ in pool.imap_unordered(plot_species, species_to_plot):
+            pass
+
+
+def plot_is_up_to_date(output_file: Path) -> bool:
+    "Check whether the plot of an output file exists and is newer than the output."
+    plot_file = output_file.with_suffix(".png")
+    return plot_file.exists() and plot_file.stat().st_mtime_ns > output_file.stat().st_mtime_ns
 
-    for output_file in output_dir.iterdir():
-        if output_file.suffix == ".nc":
-            species = output_file.stem
-            compare_radas_to_mavrin_per_species(output_dir, species)
 
+def compare_radas_to_mavrin_per_species(
+    output_dir: Path, species: str, max_decades: int = 4, show: bool = False, mavrin_data: Optional[dict] = None
+):
+    """Plot the equilibrium Lz and mean charge state of a species against Mavrin, J. Fus. Eng., 2017.
 
-def compare_radas_to_mavrin_per_species(output_dir: Path, species: str, max_decades: int = 4, show: bool=False):
-    mavrin_data = read_mavrin_data()
+    Unless the figure is shown, it is made without pyplot (so it needs no display and is not kept open by pyplot
+    after it is saved). If mavrin_data is not given, it is read from the package data.
+    """
+    if mavrin_data is None:
+        mavrin_data = read_mavrin_data()
 
-    ds = xr.open_dataset(output_dir / f"{species}.nc").pint.quantify()
-    ds = ds.sel(dim_electron_density=1e20, method="nearest")
+    with xr.open_dataset(output_dir / f"{species}.nc") as ds:
+        ds = ds.sel(dim_electron_density=1e20, method="nearest").load().pint.quantify()
 
     Te = ds["electron_temp"]
     ne_tau = ds["ne_tau"]
@@ -45,7 +78,15 @@ def compare_radas_to_mavrin_per_species(output_dir: Path, species: str, max_deca
     Lz_radas = ds["equilibrium_Lz"].pint.to(ureg.W * ureg.m**3)
     mean_charge_radas = ds["equilibrium_mean_charge_state"].pint.to(ureg.dimensionless)
 
-    fig, axs = plt.subplots(ncols=2, nrows=2, sharex="all", sharey="row")
+    if show:
+        import matplotlib.pyplot as plt
+
+        fig = plt.figure()
+    else:
+        from matplotlib.figure import Figure
+
+        fig = Figure()
+    axs = fig.subplots(ncols=2, nrows=2, sharex="all", sharey="row")
 
     for i in range(ds.sizes["dim_ne_tau"]):
         ne_tau = ds.ne_tau.isel(dim_ne_tau=i).item()
@@ -92,9 +133,11 @@ def compare_radas_to_mavrin_per_species(output_dir: Path, species: str, max_deca
     for ax in axs[-1][:].flatten():
         ax.set_xlabel("$T_e$ [$eV$]")
     
-    plt.suptitle(species)
+    fig.suptitle(species)
 
     if show:
         plt.show()
-    
-    plt.savefig(output_dir / f"{species}.png", dpi=300)
+
+    fig.savefig(output_dir / f"{species}.png", dpi=300)
+    if show:
+        plt.close(fig)
@@ -0,0 +1,642 @@
+"""Run radas for several species: download the data files, read the rate coefficients, and compute and
+store the outputs of each species (see run_radas, and cli.py for the command line)."""
+import xarray as xr
+import multiprocessing as mp
+from pathlib import Path
+from typing import Callable, Optional
+import contextlib
+import os
+import functools
+import hashlib
+import inspect
+import json
+import threading
+import queue
+import numpy as np
+from collections import defaultdict, deque
+
+from .shared import open_yaml_file, default_config_file, default_url_base, merge_globals
+from .adas_interface.download_adas_datasets import download_all_species_data
+from .adas_interface.determine_adas_dataset_type import (
+    determine_reader_class_and_config,
+    determine_data_file_key,
+    data_file_name,
+)
+from .adas_interface.adf11_cache import hash_file
+from .adas_interface.read_adf11_file import adf11_parser_version
+from .read_rate_coeffs import read_rate_coeff, get_radas_version
+
+from .coronal_equilibrium import calculate_coronal_fractional_abundances
+from .radiated_power import calculate_Lz
+from .time_evolution import calculate_time_evolution, assemble_time_evolution
+from .scheduling import (
+    summarise_time_evolution,
+    plan_time_evolution_tasks,
+    run_time_evolution_task,
+    limit_workers_by_memory,
+    estimate_main_process_memory,
+    estimate_species_computation_memory,
+    limit_worker_threads,
+    threads_per_worker,
+    thread_count_variables,
+)
+from .steady_state import calculate_steady_state_fractional_abundances
+from .superstaging import bundle_charge_states, unbundle_charge_states
+from .unit_handling import convert_units, ureg, magnitude_in_units
+
+
+@contextlib.contextmanager
+def _thread_count_environment(number_of_threads: int):
+    """Set the threadpool sizes in the environment while the workers are started (see limit_worker_threads)."""
+    previous = {variable: os.environ.get(variable) for variable in thread_count_variables}
+    os.environ.update({variable: str(number_of_threads) for variable in thread_count_variables})
+    try:
+        yield
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+
+def run_radas(
+    directory: Path,
+    config: Optional[str],
+    species: list[str],
+    verbose: int,
+    debug: bool,
+    use_cache: bool = True,
+    url_base: Optional[str] = None,
+    all_rate_coefficients: bool = False,
+    workers: Optional[int] = None,
+    max_memory: Optional[float] = None,
+    force: bool = False,
+    plots: bool = True,
+):
+
+    radas_dir = Path(directory)
+    if verbose:
+        print(f"Running radas in {radas_dir.absolute()}")
+    data_file_dir = radas_dir / "data_files"
+    output_dir = radas_dir / "output"
+
+    for path in [radas_dir, data_file_dir, output_dir]:
+        path.mkdir(exist_ok=True)
+
+    if debug:
+        number_of_workers = 1
+    else:
+        number_of_workers = workers or os.cpu_count() or 1
+        number_of_threads = threads_per_worker(number_of_workers)
+        if verbose:
+            print(f"Running on {number_of_workers} workers with {number_of_threads} threads each")
+
+    # The same pool is used for the computation and the plots
+    with contextlib.ExitStack() as stack:
+        if debug:
+            pool = None
+        else:
+            stack.enter_context(_thread_count_environment(number_of_threads))
+            pool = stack.enter_context(
+                mp.Pool(number_of_workers, initializer=limit_worker_threads, initargs=(number_of_threads,))
+            )
+
+        if species == ("none",):
+            if verbose:
+                print("Skipping computation.")
+        else:
+            config_file = default_config_file if config is None else Path(config).absolute()
+            if verbose:
+                print(f"Opening config file at {config_file}")
+            configuration = open_yaml_file(config_file)
+
+            if url_base is None:
+                url_base = configuration.get("url_base", default_url_base)
+
+            # Unless requested, only the rate coefficients needed for the computation are downloaded and read
+            dataset_types = None if all_rate_coefficients else required_rate_coefficients()
+
+            species_configs = {
+                species_name: species_config
+                for species_name, species_config in configuration["species"].items()
+                if "data_files" in species_config and (
+                    (species_name in species) or (species == ("all",))
+                )
+            }
+            output_dir.mkdir(exist_ok=True, parents=True)
+
+            # The stages are pipelined: each species is sent to the pool as soon as its data files are downloaded,
+            # where its rate coefficients are read and everything except the time evolution is computed (so that
+            # only the species names and the configuration are sent to the workers, and the main process never
+            # holds the datasets). The time evolution of each species is then scheduled over the same pool.
+            work_units = {
+                species_name: (species_name, configuration, data_file_dir, output_dir, verbose, use_cache, dataset_types, force)
+                for species_name in species_configs
+            }
+            download = functools.partial(
+                download_all_species_data,
+                data_file_dir,
+                species_configs,
+                configuration["data_file_config"],
+                verbose=verbose,
+                url_base=url_base,
+                dataset_types=dataset_types,
+            )
+            if verbose:
+                print(f"Downloading data from {url_base} to {data_file_dir.absolute()}, and computing each species once its data is downloaded")
+            # The memory budget only limits the tasks run at the same time on the pool
+            run_pipelined_computations(
+                work_units, output_dir, verbose, pool, number_of_workers, download=download,
+                max_memory=None if debug else max_memory,
+            )
+
+        if plots:
+            # matplotlib is only imported when the plots are made
+            from .mavrin_reference import compare_radas_to_mavrin
+
+            if verbose:
+                print(f"Generating plots and saving output to {output_dir}")
+            compare_radas_to_mavrin(output_dir, pool=pool, force=force, verbose=verbose)
+
+    if verbose:
+        print("Done")
+
+
+# The rate coefficients which each quantity computed by run_radas_computation depends on
+charge_state_rate_coefficients = ["effective_ionisation", "effective_recombination"]
+emission_rate_coefficients = ["line_emission_from_excitation", "recombination_and_bremsstrahlung"]
+
+output_rate_coefficients = dict(
+    coronal_charge_state_fraction=charge_state_rate_coefficients,
+    coronal_mean_charge_state=charge_state_rate_coefficients,
+    coronal_Lz=charge_state_rate_coefficients + emission_rate_coefficients,
+    residence_time=[],
+    charge_state_evolution=charge_state_rate_coefficients,
+    mean_charge_state_evolution=charge_state_rate_coefficients,
+    equilibrium_charge_state_fraction=charge_state_rate_coefficients,
+    equilibrium_mean_charge_state=charge_state_rate_coefficients,
+    equilibrium_Lz=charge_state_rate_coefficients + emission_rate_coefficients,
+)
+
+
+def required_rate_coefficients(outputs: Optional[list[str]] = None) -> list[str]:
+    """Return the rate coefficients needed to compute outputs (by default, every output of run_radas_computation)."""
+    if outputs is None:
+        outputs = list(output_rate_coefficients.keys())
+
+    required = []
+    for output in outputs:
+        required.extend(key for key in output_rate_coefficients[output] if key not in required)
+
+    return required
+
+
+def run_radas_computation(
+    dataset: xr.Dataset,
+    output_dir: Path,
+    verbose: int,
+    pool=None,
+    time_evolution: Optional[xr.DataArray] = None,
+    defer_time_evolution: bool = False,
+):
+    """Calculate several dependent quantities based on the atomic rates, and store
+    the result as a NetCDF file.
+
+    If a multiprocessing pool is given, the time evolution (which dominates the cost) is split into
+    chunks over the (Te, ne, ne_tau) grid which are run on the pool. If time_evolution is given (i.e.
+    calculated by run_scheduled_computations), it is used instead of calculating the time evolution. The
+    time evolution is stored as charge_state_evolution or mean_charge_state_evolution, depending on the
+    time_evolution_output global. If defer_time_evolution is True, the output is written without the time
+    evolution, which is added later by write_time_evolution (see run_scheduled_computations).
+    """
+    if verbose:
+        print(f"Running computation for {dataset.species_name}")
+
+    missing_rate_coefficients = [key for key in required_rate_coefficients() if key not in dataset]
+    if missing_rate_coefficients:
+        raise KeyError(f"Cannot run computation for {dataset.species_name}: missing {missing_rate_coefficients}.")
+
+    # If charge_state_bundle_size is more than 1, the charge-state fractions are calculated for bundles of
+    # charge states and then reconstructed (see superstaging.py)
+    bundle_size = int(dataset.charge_state_bundle_size)
+    coronal_dataset, coronal_partition = bundle_charge_states(dataset, bundle_size, refuelled=False)
+    reduced_dataset, partition = bundle_charge_states(dataset, bundle_size)
+
+    dataset["coronal_charge_state_fraction"] = unbundle_charge_states(
+        calculate_coronal_fractional_abundances(coronal_dataset), coronal_partition
+    )
+    dataset["coronal_mean_charge_state"] = (
+        dataset.coronal_charge_state_fraction * dataset.dim_charge_state
+    ).sum(dim="dim_charge_state")
+    dataset["coronal_Lz"] = calculate_Lz(dataset, dataset.coronal_charge_state_fraction)
+    dataset["residence_time"] = convert_units(
+        dataset.ne_tau / dataset.electron_density, ureg.s
+    )
+    if time_evolution is None and dataset.run_time_evolution and not defer_time_evolution:
+        time_evolution = calculate_time_evolution(dataset, pool=pool)
+    if time_evolution is not None:
+        add_time_evolution(dataset, time_evolution, verbose)
+    # The equilibrium is solved for directly, rather than integrating the time evolution to steady state
+    dataset["equilibrium_charge_state_fraction"] = unbundle_charge_states(
+        calculate_steady_state_fractional_abundances(reduced_dataset), partition
+    )
+    dataset["equilibrium_mean_charge_state"] = (
+        dataset.equilibrium_charge_state_fraction * dataset.dim_charge_state
+    ).sum(dim="dim_charge_state")
+    dataset["equilibrium_Lz"] = calculate_Lz(
+        dataset, dataset.equilibrium_charge_state_fraction
+    )
+
+    output_dir.mkdir(exist_ok=True)
+    dataset.pint.dequantify().to_netcdf(output_dir / f"{dataset.species_name}.nc")
+
+    if verbose:
+        print(f"Finished computation for {dataset.species_name}")
+
+
+def add_time_evolution(dataset: xr.Dataset, time_evolution: xr.DataArray, verbose: int):
+    """Store the time evolution in the dataset, with the stop times (if it was stopped at steady state) as a variable."""
+    if "time_evolution_stop_time" in time_evolution.coords:
+        dataset["time_evolution_stop_time"] = time_evolution.time_evolution_stop_time
+        time_evolution = time_evolution.drop_vars("time_evolution_stop_time")
+        if verbose:
+            report_time_evolution_stop_times(dataset)
+    dataset[time_evolution.name] = time_evolution
+
+
+def write_time_evolution(output_file: Path, time_evolution: xr.DataArray, verbose: int):
+    """Add the time evolution to an output written by run_radas_computation with defer_time_evolution."""
+    with xr.open_dataset(output_file) as output:
+        dataset = output.load().pint.quantify()
+
+    add_time_evolution(dataset, time_evolution, verbose)
+    mark_output_complete(dataset)
+    dataset.pint.dequantify().to_netcdf(output_file)
+
+
+def mark_output_complete(dataset: xr.Dataset):
+    """Store the fingerprint of an output which was written before its time evolution (see run_species_computation)."""
+    if "radas_pending_fingerprint" in dataset.attrs:
+        dataset.attrs["radas_fingerprint"] = dataset.attrs.pop("radas_pending_fingerprint")
+
+
+def run_species_computation(
+    species_name: str,
+    configuration: dict,
+    data_file_dir: Path,
+    output_dir: Path,
+    verbose: int,
+    use_cache: bool = True,
+    dataset_types: Optional[list[str]] = None,
+    force: bool = False,
+) -> dict:
+    """Read the rate coefficients of a species and run its computation, except for the time evolution.
+
+    This is the unit of work which run_radas sends to the pool. Only a small summary is sent back: the
+    species_name and, if run_time_evolution is set, a summary of the time evolution whose tasks read their
+    inputs from the output file (see summarise_time_evolution).
+
+    If the output of the species is up to date (see compute_fingerprint), nothing is computed (unless force is
+    set), and the summary has no time evolution. Until the time evolution is added, the fingerprint is stored
+    as radas_pending_fingerprint, so that an interrupted run is not taken as up to date.
+    """
+    output_file = output_dir / f"{species_name}.nc"
+    fingerprint = compute_fingerprint(species_name, configuration, data_file_dir, dataset_types)
+    if not force and read_output_fingerprint(output_file) == fingerprint:
+        if verbose:
+            print(f"Skipping {species_name}: output is up to date (use --force to recompute)")
+        return dict(species_name=species_name, time_evolution=None)
+
+    dataset = read_rate_coeff(
+        data_file_dir, species_name, configuration, verbose=verbose, use_cache=use_cache, dataset_types=dataset_types,
+    )
+    fingerprint_attribute = "radas_pending_fingerprint" if dataset.run_time_evolution else "radas_fingerprint"
+    dataset = dataset.assign_attrs({fingerprint_attribute: fingerprint})
+
+    run_radas_computation(dataset, output_dir=output_dir, verbose=verbose, defer_time_evolution=True)
+
+    time_evolution = None
+    if dataset.run_time_evolution:
+        time_evolution = summarise_time_evolution(dataset, source=output_file)
+    return dict(species_name=species_name, time_evolution=time_evolution)
+
+
+def report_time_evolution_stop_times(dataset: xr.Dataset):
+    """Print how much of the time evolution was skipped by stopping each integration at steady state."""
+    stop_time = magnitude_in_units(dataset.time_evolution_stop_time, ureg.s)
+    evolution_stop = stop_time.max().item()
+    stopped_early = stop_time < evolution_stop
+
+    print(
+        f"Time evolution for {dataset.species_name} reached steady state at {stopped_early.mean().item():.0%} of points "
+        f"(median stop time {np.median(stop_time):.2e}s, latest {evolution_stop:.2e}s)"
+    )
+
+
+def run_scheduled_computations(
+    summaries: dict[str, dict],
+    verbose: int,
+    pool,
+    number_of_workers: int,
+    max_memory: Optional[float] = None,
+):
+    """Calculate the time evolution of several species, sharing the pool between them.
+
+    The summaries are from summarise_time_evolution, with the output file of each species (written by
+    run_radas_computation with defer_time_evolution) as the source. See run_pipelined_computations.
+    """
+    run_pipelined_computations(
+        dict(), None, verbose, pool, number_of_workers, max_memory=max_memory, time_evolutions=summaries
+    )
+
+
+def run_pipelined_computations(
+    work_units: dict[str, tuple],
+    output_dir: Optional[Path],
+    verbose: int,
+    pool,
+    number_of_workers: int,
+    download: Optional[Callable] = None,
+    max_memory: Optional[float] = None,
+    time_evolutions: Optional[dict[str, dict]] = None,
+):
+    """Run the computation for several species as a pipeline, sharing the pool between the stages.
+
+    work_units are the arguments of run_species_computation for each species. If download is given, it is
+    run in a thread and called with an on_species_downloaded callback (see download_all_species_data), and
+    each species is only computed once its data files are downloaded. Otherwise, every species is ready at
+    the start.
+
+    When a species has been computed (except for the time evolution), its time evolution is split into tasks
+    with a predicted cost and memory use (see scheduling.py). Species with identical computation inputs (i.e.
+    hydrogen isotopes which use the hydrogen data files, see hash_computation_inputs) are only read and
+    computed once, and the output is copied for the other species once it is complete. Time evolutions which
+    are ready at the start can be given as
+    time_evolutions (summaries from summarise_time_evolution, with the output file of each species as the
+    source).
+
+    There are never more work units and tasks in flight than workers, so that the waiting work stays in the
+    main process, where it is prioritised: species are computed as soon as they are downloaded (since they
+    unlock more work, and their outputs land while the other downloads are still running), and then the
+    tasks are dispatched longest-first. If max_memory (in bytes) is given, a species or a task is only started
+    if the predicted memory of the work in flight stays within the budget (see
+    estimate_species_computation_memory and estimate_time_evolution_memory). When the next species or the
+    largest task does not fit, smaller tasks are started in its place. The time evolution of each species is added to its output as
+    soon as all of its tasks are done. If pool is None, everything is run in the main process.
+    """
+    events = queue.Queue()
+    ready_species = deque()
+    if download is not None:
+        def run_download():
+            try:
+                download(on_species_downloaded=lambda species_name: events.put(("downloaded", species_name)))
+                events.put(("downloads finished", None))
+            except BaseException as error:
+                events.put(("error", error))
+
+        threading.Thread(target=run_download, daemon=True).start()
+    downloading = download is not None
+
+    summaries = dict()
+    shared_computations = dict()
+    matching_species = defaultdict(list)
+    finished_species = set()
+    species_memory = dict()
+    pending_tasks = []
+    in_flight = dict()
+    memory_budget = np.inf if max_memory is None else max_memory
+
+    remaining_tasks = defaultdict(int)
+    predicted_time = defaultdict(float)
+    actual_time = defaultdict(float)
+    chunks = defaultdict(dict)
+
+    def submit(function, argument, key, memory=0.0):
+        in_flight[key] = memory
+        if pool is None:
+            events.put(("done", key, function(*argument)))
+        else:
+            pool.apply_async(
+                function,
+                argument,
+                callback=lambda result: events.put(("done", key, result)),
+                error_callback=lambda error: events.put(("error", error)),
+            )
+
+    def species_ready(species_name):
+        species_name, configuration, data_file_dir, dataset_types = select_computation_inputs(work_units[species_name])
+        source_species_name = shared_computations.setdefault(
+            hash_computation_inputs(species_name, configuration, data_file_dir, dataset_types), species_name
+        )
+        if source_species_name == species_name:
+            species_memory[species_name] = estimate_species_computation_memory(configuration, species_name, dataset_types)
+            ready_species.append(species_name)
+        elif source_species_name in finished_species:
+            write_output_from_matching_computation(work_units[species_name], source_species_name)
+        else:
+            matching_species[source_species_name].append(species_name)
+
+    def fill_pool():
+        while len(in_flight) < number_of_workers:
+            # Species and tasks are only started if the predicted memory of the work in flight stays within the
+            # budget (but work is always started if nothing is in flight)
+            memory_in_flight = sum(in_flight.values())
+            def fits(memory):
+                return memory_in_flight == 0.0 or memory_in_flight + memory <= memory_budget
+
+            if ready_species and fits(species_memory[ready_species[0]]):
+                species_name = ready_species.popleft()
+                submit(
+                    run_species_computation, work_units[species_name], ("species", species_name), species_memory[species_name]
+                )
+                continue
+
+            task = next((task for task in pending_tasks if fits(task["predicted_memory"])), None)
+            if task is None:
+                return
+            pending_tasks.remove(task)
+            submit(run_time_evolution_task, (task,), ("task", task["species_name"], task["index"]), task["predicted_memory"])
+
+    def schedule_time_evolution(species_name, summary):
+        nonlocal memory_budget
+        summaries[species_name] = summary
+        task_slots = number_of_workers
+        if max_memory is not None:
+            memory_budget = max_memory - estimate_main_process_memory(summaries)
+            task_slots = limit_workers_by_memory({species_name: summary}, number_of_workers, max_memory)
+
+        tasks = plan_time_evolution_tasks({species_name: summary}, task_slots, max_memory=max_memory)
+        remaining_tasks[species_name] = len(tasks)
+        predicted_time[species_name] = sum(task["predicted_time"] for task in tasks)
+        pending_tasks.extend(tasks)
+        pending_tasks.sort(key=lambda task: task["predicted_time"], reverse=True)
+        if verbose:
+            print(
+                f"Split the time evolution for {species_name} into {len(tasks)} tasks (predicted {predicted_time[species_name]:.1f}s)"
+                + (
+                    f", running within {memory_budget / 1e9:.2f}GB (largest task predicted to use "
+                    f"{max(task['predicted_memory'] for task in tasks) / 1e9:.2f}GB)"
+                    if max_memory is not None else ""
+                )
+            )
+
+    def species_computed(summary):
+        if summary["time_evolution"] is None:
+            species_finished(summary["species_name"])
+        else:
+            schedule_time_evolution(summary["species_name"], summary["time_evolution"])
+
+    def species_finished(species_name):
+        finished_species.add(species_name)
+        for matching_species_name in matching_species.pop(species_name, []):
+            write_output_from_matching_computation(work_units[matching_species_name], species_name)
+
+    def task_finished(result):
+        species_name, index, charge_state_fraction, elapsed = result
+        chunks[species_name][index] = charge_state_fraction
+        actual_time[species_name] += elapsed
+        remaining_tasks[species_name] -= 1
+        if verbose >= 2:
+            print(f"Finished time evolution task {index} for {species_name} in {elapsed:.2f}s")
+        if remaining_tasks[species_name] > 0:
+            return
+
+        if verbose:
+            print(
+                f"Time evolution for {species_name}: predicted {predicted_time[species_name]:.1f}s, "
+                f"actual {actual_time[species_name]:.1f}s (summed over tasks)"
+            )
+        species_chunks = chunks.pop(species_name)
+        time_evolution = assemble_time_evolution(
+            [species_chunks[index] for index in sorted(species_chunks)], summaries[species_name]["options"]
+        )
+        write_time_evolution(summaries[species_name]["source"], time_evolution, verbose)
+        species_finished(species_name)
+
+    for species_name, summary in (time_evolutions or dict()).items():
+        schedule_time_evolution(species_name, summary)
+    if download is None:
+        for species_name in work_units:
+            species_ready(species_name)
+
+    fill_pool()
+    while in_flight or downloading:
+        event = events.get()
+        if event[0] == "error":
+            raise event[1]
+        elif event[0] == "downloaded":
+            species_ready(event[1])
+        elif event[0] == "downloads finished":
+            downloading = False
+        else:
+            _, key, result = event
+            in_flight.pop(key)
+            if key[0] == "species":
+                species_computed(result)
+            else:
+                task_finished(result)
+        fill_pool()
+
+
+def describe_computation_inputs(
+    species_name: str, configuration: dict, data_file_dir: Path, dataset_types: Optional[list[str]]
+) -> dict:
+    """Return everything which the computation for a species depends on, apart from the name of the species.
+
+    This covers the source data files (by the SHA-256 hash of their contents), the atomic number, the globals
+    (including those set for the species, and the defaults of missing globals), the data_file_config of the
+    datasets which are read, the radas version and the options of the algorithms (which rate coefficients are
+    read and the version of the ADF11 parser).
+    """
+    species_config = configuration["species"][species_name]
+    selected_dataset_types = [
+        dataset_type for dataset_type in species_config["data_files"]
+        if dataset_types is None or dataset_type in dataset_types
+    ]
+
+    source_files = dict()
+    for dataset_type in selected_dataset_types:
+        filename = data_file_dir / data_file_name(
+            determine_data_file_key(species_name, species_config, configuration["data_file_config"], dataset_type)
+        )
+        source_files[dataset_type] = [filename.name, hash_file(filename) if filename.exists() else None]
+
+    return dict(
+        source_files=source_files,
+        atomic_number=species_config["atomic_number"],
+        globals=merge_globals(configuration, species_name),
+        data_file_config={
+            dataset_type: determine_reader_class_and_config(configuration["data_file_config"], dataset_type)
+            for dataset_type in selected_dataset_types
+        },
+        radas_version=get_radas_version(),
+        algorithm_options=dict(dataset_types=selected_dataset_types, adf11_parser_version=adf11_parser_version),
+    )
+
+
+def hash_computation_inputs(
+    species_name: str, configuration: dict, data_file_dir: Path, dataset_types: Optional[list[str]]
+) -> str:
+    """Hash the inputs of the computation for a species (see describe_computation_inputs).
+
+    Species with the same hash (i.e. deuterium and tritium, which use the hydrogen data files) have identical
+    results, so the computation is only run for one of them.
+    """
+    inputs = describe_computation_inputs(species_name, configuration, data_file_dir, dataset_types)
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def compute_fingerprint(species_name: str, configuration: dict, data_file_dir: Path, dataset_types: Optional[list[str]]) -> str:
+    """Hash everything which the output of a species depends on.
+
+    The fingerprint covers the inputs of the computation (see describe_computation_inputs) and the config of
+    the species. It is stored as the radas_fingerprint attribute of the output, so that run_radas can skip the
+    species whose output is up to date.
+    """
+    fingerprint = dict(
+        describe_computation_inputs(species_name, configuration, data_file_dir, dataset_types),
+        species=configuration["species"][species_name],
+    )
+
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def select_computation_inputs(work_unit: tuple) -> tuple:
+    """Return the arguments of hash_computation_inputs from the arguments of run_species_computation."""
+    arguments = inspect.signature(run_species_computation).bind(*work_unit)
+    arguments.apply_defaults()
+    return tuple(arguments.arguments[key] for key in ["species_name", "configuration", "data_file_dir", "dataset_types"])
+
+
+def read_output_fingerprint(output_file: Path) -> Optional[str]:
+    """Return the fingerprint stored in an output NetCDF, or None if there is no (readable) output."""
+    if not output_file.exists():
+        return None
+    try:
+        with xr.open_dataset(output_file) as output:
+            return output.attrs.get("radas_fingerprint")
+    except (OSError, ValueError):
+        return None
+
+
+def write_output_from_matching_computation(work_unit: tuple, source_species_name: str):
+    """Write the output of a species by copying the (complete) output of a species with identical computation
+    inputs, unless it is already up to date. work_unit holds the arguments of run_species_computation."""
+    arguments = inspect.signature(run_species_computation).bind(*work_unit)
+    arguments.apply_defaults()
+    species_name, output_dir, verbose = (arguments.arguments[key] for key in ["species_name", "output_dir", "verbose"])
+    output_file = output_dir / f"{species_name}.nc"
+
+    fingerprint = compute_fingerprint(*select_computation_inputs(work_unit))
+    if not arguments.arguments["force"] and read_output_fingerprint(output_file) == fingerprint:
+        if verbose:
+            print(f"Skipping {species_name}: output is up to date (use --force to recompute)")
+        return
+    if verbose:
+        print(f"Reusing the computation for {source_species_name} for {species_name}")
+
+    with xr.open_dataset(output_dir / f"{source_species_name}.nc") as source:
+        dataset = source.load()
+    dataset.attrs.update(species_name=species_name, radas_fingerprint=fingerprint)
+    dataset.to_netcdf(output_file)
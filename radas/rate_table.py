@@ -0,0 +1,220 @@
+"""A compiled table of radas quantities for fast point-wise evaluation.
+
+Transport codes need Lz, the mean charge state or individual rate coefficients at many arbitrary
+(ne, Te, ne_tau) points. Rather than interpolating the xarray datasets at each call, RateTable precomputes
+the coefficients of the bicubic spline (in log10(ne), log10(Te) space) on every grid cell and stores them
+in contiguous arrays, so that evaluation is a lookup and a small matrix product per point in plain NumPy.
+"""
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import xarray as xr
+from numpy.typing import NDArray, ArrayLike
+from .unit_handling import Quantity, ureg
+
+# Maps corner values and derivatives to the coefficients of a cubic on the unit interval
+hermite_to_power_basis = np.array([
+    [1.0, 0.0, 0.0, 0.0],
+    [0.0, 0.0, 1.0, 0.0],
+    [-3.0, 3.0, -2.0, -1.0],
+    [2.0, -2.0, 1.0, 1.0],
+])
+
+# Number of (point, slice, coefficient) values to evaluate at once, which bounds the memory used by evaluate
+evaluation_chunk_size = 2**21
+
+
+class RateTable:
+    """Precomputed bicubic spline coefficients of radas quantities for fast point-wise evaluation.
+
+    The table can be built from a dataset returned by read_rate_coeff or from a radas output (NetCDF) file.
+    Each quantity must depend on dim_electron_density and dim_electron_temp, and can additionally depend on
+    dim_charge_state and dim_ne_tau. Quantities are interpolated with a bicubic spline in log10(ne) and
+    log10(Te) (matching read_rate_coeff), of the log10 of their values if they are positive, and linearly in
+    log10(ne_tau). Points outside of the grid are clipped to the grid edges.
+    """
+
+    def __init__(self, dataset: xr.Dataset, quantities: Optional[list[str]] = None):
+        dataset = dataset.pint.dequantify()
+
+        if quantities is None:
+            quantities = [key for key in dataset.data_vars if is_tabulable(dataset[key])]
+
+        self.log_electron_density = np.log10(magnitude_from_attrs(dataset["electron_density"], ureg.m**-3))
+        self.log_electron_temp = np.log10(magnitude_from_attrs(dataset["electron_temp"], ureg.eV))
+        self.log_ne_tau = (
+            np.log10(magnitude_from_attrs(dataset["ne_tau"], ureg.m**-3 * ureg.s)) if "ne_tau" in dataset else None
+        )
+
+        self.units = dict()
+        self.dims = dict()
+        self.tables = dict()
+        for key in quantities:
+            if not is_tabulable(dataset[key]):
+                raise ValueError(f"Cannot tabulate {key} with dimensions {dataset[key].dims}.")
+            self.units[key] = dataset[key].attrs.get("units", "")
+            self.dims[key] = [dim for dim in dataset[key].dims if dim not in interpolated_dims]
+            self.tables[key] = self.build_table(dataset[key])
+
+    @classmethod
+    def from_netcdf(cls, filename: Path, quantities: Optional[list[str]] = None) -> "RateTable":
+        """Build a RateTable from a radas output file."""
+        with xr.open_dataset(filename) as dataset:
+            return cls(dataset.load(), quantities=quantities)
+
+    @property
+    def quantities(self) -> list[str]:
+        return list(self.tables.keys())
+
+    def build_table(self, array: xr.DataArray) -> dict:
+        """Compute the power-basis coefficients of the bicubic spline on each cell, for each slice of array."""
+        has_ne_tau = "dim_ne_tau" in array.dims
+        other_dims = [dim for dim in array.dims if dim not in interpolated_dims]
+        array = array.transpose(*other_dims, *(["dim_ne_tau"] if has_ne_tau else []), "dim_electron_density", "dim_electron_temp")
+
+        x, y = self.log_electron_density, self.log_electron_temp
+        values = np.asarray(array.values, dtype=np.float64).reshape((-1, x.size, y.size))
+
+        # Slices which are zero everywhere (i.e. the padded charge state) are returned as zeros
+        zero_slices = np.all(values == 0.0, axis=(1, 2))
+        log_values = bool(np.all(values[~zero_slices] > 0.0))
+        if log_values:
+            values = np.log10(np.where(zero_slices[:, np.newaxis, np.newaxis], 1.0, values))
+
+        # Values and derivatives of the interpolating spline at the grid nodes
+        x_derivative = nodal_derivative_matrix(x)
+        y_derivative = nodal_derivative_matrix(y)
+        f = values
+        fx = x_derivative @ values
+        fy = values @ y_derivative.T
+        fxy = x_derivative @ values @ y_derivative.T
+
+        # Corner data of each cell, scaled to the unit square
+        hx = np.diff(x)[:, np.newaxis]
+        hy = np.diff(y)[np.newaxis, :]
+        corners = np.empty((values.shape[0], x.size - 1, y.size - 1, 4, 4))
+        cell_edges = [slice(None, -1), slice(1, None)]
+        for i, x_edge in enumerate(cell_edges):
+            for j, y_edge in enumerate(cell_edges):
+                corners[..., i, j] = f[:, x_edge, y_edge]
+                corners[..., i, j + 2] = fy[:, x_edge, y_edge] * hy
+                corners[..., i + 2, j] = fx[:, x_edge, y_edge] * hx
+                corners[..., i + 2, j + 2] = fxy[:, x_edge, y_edge] * hx * hy
+
+        coefficients = hermite_to_power_basis @ corners @ hermite_to_power_basis.T
+
+        return dict(
+            # Stored as (cell_x, cell_y, slice, coefficient) so that the coefficients for a point are contiguous
+            coefficients=np.ascontiguousarray(
+                coefficients.transpose(1, 2, 0, 3, 4).reshape((x.size - 1, y.size - 1, values.shape[0], 16))
+            ),
+            shape=tuple(array.sizes[dim] for dim in other_dims),
+            has_ne_tau=has_ne_tau,
+            log_values=log_values,
+            zero_slices=zero_slices,
+        )
+
+    def evaluate(
+        self,
+        electron_density: ArrayLike,
+        electron_temp: ArrayLike,
+        ne_tau: Optional[ArrayLike] = None,
+        quantities: Optional[list[str]] = None,
+    ) -> dict[str, NDArray[np.floating]]:
+        """Evaluate quantities at each (electron_density, electron_temp, ne_tau) point.
+
+        The inputs are plain arrays (or scalars, which are broadcast) in m^-3, eV and m^-3 s. ne_tau is only
+        needed for quantities which depend on ne_tau. Returns a dict of arrays with the shape of the
+        non-interpolated dimensions of each quantity (see RateTable.dims) followed by the number of points,
+        in the units given in RateTable.units.
+        """
+        if quantities is None:
+            quantities = self.quantities
+
+        needs_ne_tau = any(self.tables[key]["has_ne_tau"] for key in quantities)
+        if needs_ne_tau and ne_tau is None:
+            raise ValueError("ne_tau must be given to evaluate quantities which depend on ne_tau.")
+
+        electron_density, electron_temp, ne_tau = np.broadcast_arrays(
+            np.asarray(electron_density, dtype=np.float64),
+            np.asarray(electron_temp, dtype=np.float64),
+            np.asarray(ne_tau if needs_ne_tau else np.nan, dtype=np.float64),
+        )
+        log_electron_density = np.log10(electron_density).ravel()
+        log_electron_temp = np.log10(electron_temp).ravel()
+        log_ne_tau = np.log10(ne_tau).ravel()
+        number_of_points = log_electron_density.size
+
+        results = {
+            key: np.empty((*self.tables[key]["shape"], number_of_points)) for key in quantities
+        }
+
+        largest_slice_count = max(self.tables[key]["coefficients"].shape[2] for key in quantities)
+        chunk = max(1, evaluation_chunk_size // (16 * largest_slice_count))
+
+        for start in range(0, number_of_points, chunk):
+            points = slice(start, min(start + chunk, number_of_points))
+
+            ix, u = locate_in_grid(self.log_electron_density, log_electron_density[points])
+            iy, v = locate_in_grid(self.log_electron_temp, log_electron_temp[points])
+            u_powers = np.stack([np.ones_like(u), u, u**2, u**3], axis=-1)
+            v_powers = np.stack([np.ones_like(v), v, v**2, v**3], axis=-1)
+            basis = (u_powers[:, :, np.newaxis] * v_powers[:, np.newaxis, :]).reshape((-1, 16, 1))
+
+            if needs_ne_tau:
+                ik, w = locate_in_grid(self.log_ne_tau, log_ne_tau[points])
+
+            for key in quantities:
+                table = self.tables[key]
+
+                values = (table["coefficients"][ix, iy] @ basis)[..., 0].T
+                if table["log_values"]:
+                    values = np.power(10.0, values)
+                values[table["zero_slices"]] = 0.0
+
+                if table["has_ne_tau"]:
+                    # Linear interpolation in log10(ne_tau) between the neighbouring ne_tau slices
+                    values = values.reshape((-1, self.log_ne_tau.size, values.shape[-1]))
+                    upper = np.minimum(ik + 1, self.log_ne_tau.size - 1)
+                    point_index = np.arange(values.shape[-1])
+                    values = (1.0 - w) * values[:, ik, point_index] + w * values[:, upper, point_index]
+
+                results[key][..., points] = values.reshape((*table["shape"], -1))
+
+        return results
+
+
+# Dimensions which are interpolated over, rather than returned
+interpolated_dims = ["dim_electron_density", "dim_electron_temp", "dim_ne_tau"]
+
+
+def is_tabulable(array: xr.DataArray) -> bool:
+    """Return True if array depends on ne and Te, and otherwise only on the charge state and ne_tau."""
+    return (
+        "dim_electron_density" in array.dims
+        and "dim_electron_temp" in array.dims
+        and set(array.dims) <= set(interpolated_dims) | {"dim_charge_state"}
+    )
+
+
+def magnitude_from_attrs(array: xr.DataArray, units) -> NDArray[np.floating]:
+    """Return the values of a dequantified array, converted from the units in its attributes."""
+    return Quantity(np.asarray(array.values, dtype=np.float64), array.attrs.get("units", "")).to(units).magnitude
+
+
+def nodal_derivative_matrix(x: NDArray[np.floating]) -> NDArray[np.floating]:
+    """Return the matrix which maps values on x to the first derivative of their interpolating cubic spline at x."""
+    from scipy.interpolate import make_interp_spline
+
+    return make_interp_spline(x, np.eye(x.size), k=3).derivative()(x)
+
+
+def locate_in_grid(grid: NDArray[np.floating], points: NDArray[np.floating]):
+    """Return the cell index of each point and its (clipped) position within the cell, from 0 to 1."""
+    if grid.size == 1:
+        return np.zeros(points.size, dtype=int), np.zeros(points.size)
+
+    index = np.clip(np.searchsorted(grid, points, side="right") - 1, 0, grid.size - 2)
+    position = np.clip((points - grid[index]) / (grid[index + 1] - grid[index]), 0.0, 1.0)
+
+    return index, position
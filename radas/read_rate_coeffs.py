@@ -1,32 +1,37 @@
 from .unit_handling import Quantity, ureg, convert_units, dimensionless_magnitude
 from .adas_interface.determine_adas_dataset_type import (
     determine_reader_class_and_config,
+    determine_data_file_key,
+    data_file_name,
 )
 from importlib.metadata import version, PackageNotFoundError
 import datetime
 import xarray as xr
 import numpy as np
 import warnings
-from .interpolate_rates import interpolate_array
+from .interpolate_rates import interpolate_charge_states
+from .shared import merge_globals
 
 # Reference units for non-dimensionalizing coordinates
 reference_electron_density = Quantity(1.0, ureg.m**-3)
 reference_electron_temp = Quantity(1.0, ureg.eV)
 
-def read_rate_coeff(data_file_dir, species_name, config, verbose=0):
+def read_rate_coeff(data_file_dir, species_name, config, verbose=0, use_cache=True, dataset_types=None):
     """
     Main pipeline to assemble an atomic rate dataset for a specific species.
     
     Reads raw ADAS files, standardizes their grids, aligns charge states, 
-    and attaches metadata.
+    and attaches metadata. If use_cache is True, parsed ADAS files are cached
+    beside the source files and reused while the source files are unchanged.
+
+    If dataset_types is given, only those datasets (i.e. the rate coefficients
+    needed for a computation) are read. Otherwise, every dataset listed in the
+    species data_files is read.
     """
-    try:
-        radas_version = version("radas")
-    except PackageNotFoundError:
-        radas_version = "UNDEFINED"
-    
     # 1. Collect and sort data by year
-    rate_coefficients = build_sorted_dictionary_of_rate_coefficients(config, species_name, data_file_dir)
+    rate_coefficients = build_sorted_dictionary_of_rate_coefficients(
+        config, species_name, data_file_dir, use_cache=use_cache, dataset_types=dataset_types,
+    )
     
     # 2. Resample all datasets to a common resolution
     rate_coefficients = interpolate_rates_onto_matching_grids(config, species_name, rate_coefficients, verbose=verbose)
@@ -51,33 +56,43 @@ def read_rate_coeff(data_file_dir, species_name, config, verbose=0):
     dataset = dataset.assign_attrs(
         atomic_number=config["species"][species_name]["atomic_number"],
         species_name=species_name,
-        radas_version=radas_version,
+        radas_version=get_radas_version(),
         created=datetime.date.today().strftime("%Y-%b-%d"),
     )
 
-    return write_global_attributes(dataset, config["globals"])
+    return write_global_attributes(dataset, merge_globals(config, species_name))
 
-def build_sorted_dictionary_of_rate_coefficients(config, species_name, data_file_dir):
+def get_radas_version() -> str:
+    """Return the installed version of radas, or "UNDEFINED" if radas is not installed."""
+    try:
+        return version("radas")
+    except PackageNotFoundError:
+        return "UNDEFINED"
+
+def build_sorted_dictionary_of_rate_coefficients(config, species_name, data_file_dir, use_cache=True, dataset_types=None):
     """Make a dictionary of rate coefficient datasets, ordered most-recent first."""
     rate_coefficients = dict()
     years = dict()
 
-    for dataset_type, file_to_read in config["species"][species_name]["data_files"].items():
+    species_config = config["species"][species_name]
+
+    for dataset_type in species_config["data_files"].keys():
+        if dataset_types is not None and dataset_type not in dataset_types:
+            continue
+
         reader_key, dataset_config = determine_reader_class_and_config(
             config["data_file_config"], dataset_type
         )
 
-        # Extract year for sorting; entries can be a simple int or [file, year] list
-        if isinstance(file_to_read, int):
-            years[dataset_type] = file_to_read
-        elif isinstance(file_to_read, list) and len(file_to_read) == 2:
-            years[dataset_type] = file_to_read[1]
-        else:
-            raise NotImplementedError(f"Unsupported config format for {species_name} {dataset_type}")
+        # Data files are stored by (reader, prefix, year, element), so that species can share files
+        data_file_key = determine_data_file_key(
+            species_name, species_config, config["data_file_config"], dataset_type
+        )
+        years[dataset_type] = data_file_key[2]
 
         if reader_key == "adf11":
             rate_dataset = build_adf11_rate_dataset(
-                data_file_dir, species_name, years[dataset_type], dataset_type, dataset_config,
+                data_file_dir / data_file_name(data_file_key), dataset_config, use_cache=use_cache,
             )
         else:
             raise NotImplementedError(f"No implementation for reader: {reader_key}")
@@ -91,19 +106,20 @@ def build_sorted_dictionary_of_rate_coefficients(config, species_name, data_file
 def interpolate_rates_onto_matching_grids(config, species_name, rate_coefficients, verbose):
     """Resample all rate coefficients to a uniform log-grid defined by the newest dataset."""
     
-    # Use the range of the most recent dataset to define the master grid
+    # Use the range of the most recent dataset to define the master grid, with the resolution set for the species
     most_recent_rate_coeff = list(rate_coefficients.values())[0]
+    globals = merge_globals(config, species_name)
 
     new_electron_density = np.logspace(
         np.log10(most_recent_rate_coeff["dim_electron_density"].min().item()),
         np.log10(most_recent_rate_coeff["dim_electron_density"].max().item()),
-        num = config["globals"]["electron_density_resolution"]
+        num = globals["electron_density_resolution"]
     )
 
     new_electron_temp = np.logspace(
         np.log10(most_recent_rate_coeff["dim_electron_temp"].min().item()),
         np.log10(most_recent_rate_coeff["dim_electron_temp"].max().item()),
-        num = config["globals"]["electron_temp_resolution"]
+        num = globals["electron_temp_resolution"]
     )
 
     interpolated_rate_coefficients = dict()
@@ -111,9 +127,9 @@ def interpolate_rates_onto_matching_grids(config, species_name, rate_coefficient
         with warnings.catch_warnings(record=True) as captured_warnings:
             warnings.simplefilter("always")
 
-            # Map interpolation across charge states
-            interpolated_rate_coefficients[key] = value.groupby("dim_charge_state").map(
-                interpolate_array, args=(new_electron_density, new_electron_temp)
+            # Interpolate all charge states in a single pass
+            interpolated_rate_coefficients[key] = interpolate_charge_states(
+                value, new_electron_density, new_electron_temp
             )
         
         if verbose:
@@ -144,11 +160,22 @@ def write_global_attributes(dataset: xr.Dataset, globals: dict) -> xr.Dataset:
             dataset[attribute] = value
     return dataset
 
-def build_adf11_rate_dataset(data_file_dir, species_name, year, dataset_type, dataset_config):
-    """Read a specific ADF11 file and format it as a quantified xarray Dataset."""
-    from .adas_interface.read_adf11_file import read_adf11_file
+def build_adf11_rate_dataset(filename, dataset_config, use_cache=True, selector=None):
+    """Read a specific ADF11 file and format it as a quantified xarray Dataset.
 
-    data = read_adf11_file(data_file_dir, species_name, year, dataset_type)
+    If a selector is given, it must be a dict of integer indices (as for xr.Dataset.isel) for
+    dim_charge_state, dim_electron_temp and/or dim_electron_density. In this case, only the selected
+    charge-state blocks are read from the file, and the cache is not used.
+    """
+    from .adas_interface.adf11_cache import read_adf11_file_cached
+    from .adas_interface.read_adf11_file import read_adf11_file_selection
+
+    if selector is None:
+        data = read_adf11_file_cached(filename, use_cache=use_cache)
+        charge_states = np.arange(data["IZMAX"])
+    else:
+        data = read_adf11_file_selection(filename, **selector)
+        charge_states = data["charge_states"]
     ds = xr.Dataset()
 
     # Log values stored in ADAS files are converted to linear scale if required
@@ -164,7 +191,7 @@ def build_adf11_rate_dataset(data_file_dir, species_name, year, dataset_type, da
     dim_electron_temp = dimensionless_magnitude(electron_temp / reference_electron_temp)
     
     rate_coefficient = xr.DataArray(coefficient, coords=dict(
-        dim_charge_state = np.arange(data["IZMAX"]),
+        dim_charge_state = charge_states,
         dim_electron_temp = dim_electron_temp,
         dim_electron_density = dim_electron_density,
     )).pint.quantify(dataset_config["stored_units"])
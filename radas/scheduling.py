@@ -0,0 +1,279 @@
+"""Plan the time evolution of several species as tasks for a process pool.
+
+The time evolution dominates the cost of run_radas_computation, so it is split into tasks (chunks of the
+(Te, ne, ne_tau) grid) whose cost and memory use are predicted with simple models. The tasks of every
+species are then dispatched longest-first (see run_pipelined_computations in pipeline.py), with no more tasks
+in flight than fit in the memory budget. The planning only needs a small summary of each dataset (see
+summarise_time_evolution), and the tasks can read their inputs from the NetCDF file of their dataset, so
+the main process does not need to hold the datasets.
+"""
+import os
+import time
+import warnings
+import numpy as np
+import xarray as xr
+from pathlib import Path
+from typing import Optional
+
+from .time_evolution import (
+    prepare_time_evolution,
+    eigendecomposition_chunk_size,
+    evolve_charge_states,
+    split_electron_temp,
+    select_electron_temp,
+)
+from .shared import merge_globals
+
+# Approximate time (in s, on a single core) to evolve a single (Te, ne, ne_tau) point with each time evolution
+# method, modelled as fixed + per_charge_state * number_of_charge_states**exponent. The predicted and actual
+# times are printed with -v, and can be used to recalibrate the model for a particular machine.
+time_evolution_cost_model = dict(
+    radau=dict(fixed=1.5e-2, per_charge_state=1.5e-4, exponent=1),
+    eigendecomposition=dict(fixed=1e-5, per_charge_state=2.5e-9, exponent=3),
+)
+
+# The work is split into roughly this many tasks per worker, so that the pool can balance the load
+tasks_per_worker = 4
+
+# Tasks are predicted to take at least this long (in s, unless the whole time evolution is shorter), since each
+# task has an overhead of a few 10s of ms to send it to a worker and read its inputs
+minimum_task_time = 0.5
+
+# Size (in bytes) of each element of the arrays
+bytes_per_value = np.dtype(float).itemsize
+
+# Environment variables which set the size of the BLAS and OpenMP threadpools
+thread_count_variables = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+
+def summarise_time_evolution(dataset: xr.Dataset, source: Optional[Path] = None) -> dict:
+    """Return the sizes and options of the time evolution of a dataset, which is all the planning needs.
+
+    The summary does not include the rate coefficients, so that the datasets can be read in the workers and
+    only their summaries sent back to the main process. If source is given, it is a NetCDF file holding the
+    dataset (i.e. the output written by run_radas_computation), which the tasks read their inputs from.
+    Otherwise, the tasks are given their inputs (which are sent to the workers with the tasks).
+    """
+    options, inputs = prepare_time_evolution(dataset)
+    summary = dict(sizes=dict(dataset.sizes), options=options)
+    if source is None:
+        summary["inputs"] = inputs
+    else:
+        summary["source"] = source
+
+    return summary
+
+
+def count_points(summary: dict, number_of_electron_temps: int = None) -> int:
+    """Return the number of (Te, ne, ne_tau) points of a time evolution (or of a task with number_of_electron_temps)."""
+    sizes = summary["sizes"]
+    if number_of_electron_temps is None:
+        number_of_electron_temps = sizes["dim_electron_temp"]
+    return number_of_electron_temps * sizes["dim_electron_density"] * sizes["dim_ne_tau"]
+
+
+def estimate_time_evolution_cost(summary: dict) -> float:
+    """Predict the time (in s, on a single core) to calculate a time evolution (see summarise_time_evolution)."""
+    options = summary["options"]
+    model = time_evolution_cost_model[options["method"]]
+
+    return count_points(summary) * (
+        model["fixed"] + model["per_charge_state"] * options["number_of_evolved_states"] ** model["exponent"]
+    )
+
+
+def estimate_time_evolution_memory(summary: dict, number_of_electron_temps: int = None) -> float:
+    """Predict the peak memory (in bytes) used by a worker to calculate a time evolution (see summarise_time_evolution).
+
+    If number_of_electron_temps is given, the estimate is for a task with this many electron temperatures.
+    The worker holds the charge x time result for each point, and a copy of the (possibly reduced) output
+    which is sent back to the main process. The eigendecomposition also stores a charge x charge matrix (and
+    its eigenvectors) for each point of a batch, while the Radau integration only works on a single point at
+    a time. If the charge states are bundled, the working arrays are for the bundles, while the result is
+    reconstructed for every charge state.
+    """
+    options = summary["options"]
+    number_of_charge_states = summary["sizes"]["dim_charge_state"]
+    number_of_evolved_states = options["number_of_evolved_states"]
+    number_of_times = len(options["evaluation_times"])
+    number_of_points = count_points(summary, number_of_electron_temps)
+
+    result = number_of_points * number_of_charge_states * number_of_times
+    output = number_of_points * output_values_per_point(summary)
+    inputs = 2 * number_of_points * number_of_charge_states
+    if options["method"] == "eigendecomposition":
+        points_per_batch = min(number_of_points, eigendecomposition_chunk_size)
+        working = points_per_batch * (3 * number_of_evolved_states**2 + 2 * number_of_evolved_states * number_of_times)
+    else:
+        working = 4 * number_of_evolved_states**2 + number_of_evolved_states * number_of_times
+
+    return bytes_per_value * (result + 2 * output + inputs + working)
+
+
+def estimate_species_computation_memory(
+    configuration: dict, species_name: str, dataset_types: Optional[list[str]] = None
+) -> float:
+    """Predict the peak memory (in bytes) used by a worker to read a species and compute everything except the
+    time evolution (see run_species_computation in pipeline.py).
+
+    The sizes of the grid are known from the config before the species is read. The worker holds the rate
+    coefficients and the coronal results on the (charge, Te, ne) grid, and the equilibrium results on the
+    (charge, Te, ne, ne_tau) grid, with a few working arrays of that size for the steady state and Lz. The
+    dataset is copied when it is written to the output file.
+    """
+    species_config = configuration["species"][species_name]
+    globals = merge_globals(configuration, species_name)
+
+    number_of_rate_coefficients = len(
+        [dataset_type for dataset_type in species_config["data_files"] if dataset_types is None or dataset_type in dataset_types]
+    )
+    charge_grid = (species_config["atomic_number"] + 1) * globals["electron_temp_resolution"] * globals["electron_density_resolution"]
+    equilibrium_grid = charge_grid * len(globals["ne_tau"]["value"])
+
+    dataset = charge_grid * (number_of_rate_coefficients + 2) + equilibrium_grid
+    working = 3 * equilibrium_grid
+    return bytes_per_value * (2 * dataset + working)
+
+
+def output_values_per_point(summary: dict) -> int:
+    """Return the number of values of the time evolution output stored for each (Te, ne, ne_tau) point."""
+    options = summary["options"]
+    if options["output"] == "mean_charge_state":
+        return len(options["output_times"])
+    return summary["sizes"]["dim_charge_state"] * len(options["output_times"])
+
+
+def estimate_main_process_memory(summaries: dict[str, dict]) -> float:
+    """Predict the memory (in bytes) used by the main process to collect the results of the tasks.
+
+    While the tasks of a species are collected, the main process holds each chunk of the time evolution output
+    and then the concatenated array, so it needs (at least) twice the output of the largest species.
+    """
+    result_sizes = [count_points(summary) * output_values_per_point(summary) for summary in summaries.values()]
+
+    return 2 * bytes_per_value * max(result_sizes, default=0)
+
+
+def limit_workers_by_memory(summaries: dict[str, dict], number_of_workers: int, max_memory: float) -> int:
+    """Return the number of workers which can run tasks at the same time within max_memory (in bytes).
+
+    Tasks are at least one electron temperature, so each worker needs at least the memory of the largest
+    single-temperature task. If even a single worker does not fit in the budget, the computation is run
+    with one worker anyway (with a warning).
+    """
+    smallest_task_memory = max(
+        (estimate_time_evolution_memory(summary, 1) for summary in summaries.values()), default=0.0
+    )
+    if smallest_task_memory == 0.0:
+        return number_of_workers
+    main_process_memory = estimate_main_process_memory(summaries)
+    available_memory = max_memory - main_process_memory
+
+    if available_memory < smallest_task_memory:
+        warnings.warn(
+            f"max_memory of {max_memory / 1e9:.2f}GB is less than the {(main_process_memory + smallest_task_memory) / 1e9:.2f}GB "
+            "needed to calculate the time evolution with a single worker. Running with one worker.",
+            RuntimeWarning,
+        )
+        return 1
+
+    return int(min(number_of_workers, available_memory // smallest_task_memory))
+
+
+def plan_time_evolution_tasks(
+    summaries: dict[str, dict], number_of_workers: int, max_memory: Optional[float] = None
+) -> list[dict]:
+    """Split the time evolutions (see summarise_time_evolution) into tasks, sorted by predicted cost (longest first).
+
+    The tasks are chunks of electron temperatures, sized so that the total predicted cost is divided into
+    roughly tasks_per_worker tasks per worker (but with a predicted time of at least minimum_task_time).
+    Heavy species are therefore split into many tasks, while light species may be a single task.
+
+    If max_memory (in bytes) is given, the chunks are also small enough that number_of_workers tasks fit in
+    the memory left over by the main process (see limit_workers_by_memory).
+    """
+    costs = {species_name: estimate_time_evolution_cost(summary) for species_name, summary in summaries.items()}
+    if not costs:
+        return []
+    target_cost = max(sum(costs.values()) / (tasks_per_worker * number_of_workers), minimum_task_time)
+    if max_memory is not None:
+        memory_per_worker = (max_memory - estimate_main_process_memory(summaries)) / number_of_workers
+
+    tasks = []
+    for species_name, cost in costs.items():
+        summary = summaries[species_name]
+        number_of_electron_temps = summary["sizes"]["dim_electron_temp"]
+        cost_per_electron_temp = cost / number_of_electron_temps
+        electron_temps_per_chunk = int(np.clip(round(target_cost / cost_per_electron_temp), 1, number_of_electron_temps))
+        if max_memory is not None:
+            while electron_temps_per_chunk > 1 and (
+                estimate_time_evolution_memory(summary, electron_temps_per_chunk) > memory_per_worker
+            ):
+                electron_temps_per_chunk //= 2
+
+        for index, chunk in enumerate(split_electron_temp(number_of_electron_temps, electron_temps_per_chunk)):
+            chunk_electron_temps = len(range(number_of_electron_temps)[chunk])
+            task = dict(
+                species_name=species_name,
+                index=index,
+                options=summary["options"],
+                electron_temps=chunk,
+                predicted_time=cost_per_electron_temp * chunk_electron_temps,
+                predicted_memory=estimate_time_evolution_memory(summary, chunk_electron_temps),
+            )
+            if "source" in summary:
+                task["source"] = summary["source"]
+            else:
+                task["inputs"] = [select_electron_temp(array, chunk) for array in summary["inputs"]]
+            tasks.append(task)
+
+    return sorted(tasks, key=lambda task: task["predicted_time"], reverse=True)
+
+
+def load_time_evolution_inputs(source: Path, electron_temps: slice) -> list:
+    """Read the inputs of a task from the NetCDF file holding its dataset.
+
+    Only the task's electron temperatures are read. The inputs are calculated point-by-point, so they match
+    the inputs of the whole dataset at these electron temperatures.
+    """
+    with xr.open_dataset(source) as dataset:
+        dataset = dataset.isel(dim_electron_temp=electron_temps).load()
+
+    return prepare_time_evolution(dataset.pint.quantify())[1]
+
+
+def run_time_evolution_task(task: dict):
+    """Run a task from plan_time_evolution_tasks, returning the result and the time taken."""
+    start = time.perf_counter()
+    inputs = task["inputs"] if "inputs" in task else load_time_evolution_inputs(task["source"], task["electron_temps"])
+    result = evolve_charge_states(task["options"], *inputs)
+
+    return task["species_name"], task["index"], result, time.perf_counter() - start
+
+
+def threads_per_worker(number_of_workers: int) -> int:
+    """Share the CPUs between the workers, so that their threadpools do not oversubscribe the machine."""
+    return max(1, (os.cpu_count() or 1) // number_of_workers)
+
+
+def limit_worker_threads(number_of_threads: int):
+    """Limit the BLAS and OpenMP threadpools of the current process to number_of_threads (i.e. a pool initializer).
+
+    The environment variables only affect libraries which have not been loaded yet, so threadpoolctl is used
+    (if installed) to resize the threadpools which are already running.
+    """
+    for variable in thread_count_variables:
+        os.environ[variable] = str(number_of_threads)
+
+    try:
+        from threadpoolctl import threadpool_limits
+    except ModuleNotFoundError:
+        return
+    threadpool_limits(limits=number_of_threads)
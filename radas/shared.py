@@ -2,14 +2,63 @@
 
 from pathlib import Path
 from importlib.resources import files
+from contextlib import contextmanager
+import os
+import uuid
 import yaml
 
 default_config_file = files("radas").joinpath("config.yaml")
-mavrin_data_file = files("radas.mavrin_reference").joinpath("mavrin_data.yaml")
+mavrin_data_file = files("radas").joinpath("mavrin_reference", "mavrin_data.yaml")
 
 library_extensions = [".a", ".so"]
 
+# Server to download the data files from, if url_base is not set in the config
+default_url_base = "https://open.adas.ac.uk"
+
+# Values for the globals which are missing from a config (i.e. a config written for an older version of radas),
+# which keep the behaviour from before the global was added
+default_globals = dict(
+    run_time_evolution=True,
+    time_evolution_method="radau",
+    number_of_evolution_times=50,
+    time_evolution_output="full",
+    stop_at_steady_state=False,
+    steady_state_tolerance=1.0e-6,
+    charge_state_bundle_size=1,
+)
+
+
+def merge_globals(configuration: dict, species_name: str) -> dict:
+    """Return the globals used for a species.
+
+    Globals which are missing from the config take their default values, and globals which are set for a
+    single species (i.e. charge_state_bundle_size for the heavy species) override the config.
+    """
+    globals = {**default_globals, **configuration["globals"]}
+    species_config = configuration["species"][species_name]
+    return {**globals, **{key: value for key, value in species_config.items() if key in globals}}
+
 
 def open_yaml_file(yaml_file: Path) -> dict:
     with open(yaml_file, "r") as file:
         return yaml.load(file, Loader=yaml.FullLoader)
+
+
+@contextmanager
+def write_atomically(filename: Path):
+    """Open a temporary file beside filename for writing in binary mode, and move it to filename when the block exits.
+
+    Concurrent readers never see a partially-written file. If the block raises an exception, the temporary file
+    is removed and filename is left unchanged. The temporary file has a unique name, and is created with the
+    default permissions (unlike tempfile.mkstemp, which restricts them to the owner), so that the written files
+    can be shared.
+    """
+    temporary_file = filename.with_name(f"{filename.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temporary_file, "xb") as file:
+            yield file
+        os.replace(temporary_file, filename)
+    except BaseException:
+        if temporary_file.exists():
+            os.unlink(temporary_file)
+        raise
@@ -0,0 +1,73 @@
+import numpy as np
+import xarray as xr
+from .unit_handling import ureg, magnitude_in_units
+
+
+def calculate_steady_state_fractional_abundances(dataset: xr.Dataset) -> xr.DataArray:
+    """Calculate the steady-state impurity charge-state fractions for each value of ne_tau.
+
+    This is the t -> infinity limit of calculate_time_evolution, found directly rather than by
+    integrating the rate equations. Setting the time derivative (see calculate_derivative) to zero
+    gives a tridiagonal system for the charge-state fractions n_k
+
+        S_{k-1} n_{k-1} - (S_k + alpha_k + 1 / ne_tau) n_k + alpha_{k+1} n_{k+1} = -delta_{k0} / ne_tau
+
+    which is solved for every (Te, ne, ne_tau) point at once. The electron density only sets the
+    timescale, so it does not appear. ne_tau must be finite (otherwise use the coronal equilibrium).
+    """
+    return xr.apply_ufunc(
+        solve_steady_state,
+        magnitude_in_units(dataset.effective_ionisation, ureg.m**3 / ureg.s),
+        magnitude_in_units(
+            dataset.effective_recombination.roll(dim_charge_state=-1),
+            ureg.m**3 / ureg.s,
+        ),
+        magnitude_in_units(dataset.ne_tau, ureg.m**-3 * ureg.s),
+        input_core_dims=[("dim_charge_state",), ("dim_charge_state",), ()],
+        output_core_dims=[("dim_charge_state",)],
+    ).pint.quantify("")
+
+
+def solve_steady_state(effective_ionisation, effective_recombination, ne_tau):
+    """Solve the steady-state rate equations with the Thomas algorithm, vectorised over the leading axes.
+
+    effective_ionisation[..., k] is the rate from k to k+1, and effective_recombination[..., k] is the rate
+    from k+1 to k. The matrix is strictly diagonally dominant by columns for finite ne_tau, so no pivoting
+    is needed.
+    """
+    effective_ionisation, effective_recombination, loss_rate = np.broadcast_arrays(
+        effective_ionisation, effective_recombination, (1.0 / np.asarray(ne_tau))[..., np.newaxis]
+    )
+    # Put the charge states on the first axis, so that each step of the sweep works on a contiguous slice
+    ionisation = np.moveaxis(effective_ionisation, -1, 0)
+    recombination = np.moveaxis(effective_recombination, -1, 0)
+    loss_rate = np.moveaxis(loss_rate, -1, 0)
+    number_of_charge_states = ionisation.shape[0]
+
+    lower = np.zeros_like(ionisation)
+    lower[1:] = ionisation[:-1]
+    diagonal = -(ionisation + loss_rate)
+    diagonal[1:] -= recombination[:-1]
+    upper = recombination
+
+    # Forward elimination
+    modified_upper = np.empty_like(ionisation)
+    modified_rhs = np.empty_like(ionisation)
+    modified_upper[0] = upper[0] / diagonal[0]
+    modified_rhs[0] = -loss_rate[0] / diagonal[0]
+    for k in range(1, number_of_charge_states):
+        denominator = diagonal[k] - lower[k] * modified_upper[k - 1]
+        modified_upper[k] = upper[k] / denominator
+        modified_rhs[k] = -lower[k] * modified_rhs[k - 1] / denominator
+
+    # Back substitution
+    charge_state_fraction = np.empty_like(ionisation)
+    charge_state_fraction[-1] = modified_rhs[-1]
+    for k in range(number_of_charge_states - 2, -1, -1):
+        charge_state_fraction[k] = modified_rhs[k] - modified_upper[k] * charge_state_fraction[k + 1]
+
+    # The exact solution sums to 1. For very weak refuelling the system is close to singular, and the
+    # rounding error is mostly in the overall scale (along the coronal solution), so renormalise.
+    charge_state_fraction /= np.sum(charge_state_fraction, axis=0)
+
+    return np.moveaxis(charge_state_fraction, 0, -1)
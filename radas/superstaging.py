@@ -0,0 +1,181 @@
+"""Bundle adjacent charge states into superstages, to shrink the system of rate equations for high-Z species.
+
+Within each bundle, the charge states are assumed to be distributed as in equilibrium at the local (Te, ne)
+and (optionally) ne_tau (the partition), and the bundles are evolved as single states with partition-weighted
+rates. Summing the rate equations over the charge states of a bundle shows that the bundled rates give the
+exact equilibrium populations of the bundles, so the approximation is only in the transients of the time
+evolution. The resolved charge-state fractions are reconstructed by splitting the population of each bundle
+according to the partition.
+"""
+import time
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .coronal_equilibrium import calculate_log_coronal_abundances
+from .unit_handling import magnitude, dimensionless_magnitude
+
+# The emission coefficients which are bundled (see bundle_charge_states)
+bundled_emission_coefficients = ["line_emission_from_excitation", "recombination_and_bremsstrahlung"]
+
+
+def assign_charge_state_bundles(number_of_charge_states: int, bundle_size: int) -> np.ndarray:
+    """Return the bundle of each charge state.
+
+    The neutral state is kept as its own bundle, since the refuelling source (and the initial state of
+    the time evolution) is in the neutral state. The other charge states are grouped into bundles of
+    bundle_size adjacent states.
+    """
+    charge_state = np.arange(number_of_charge_states)
+    return np.where(charge_state == 0, 0, (charge_state - 1) // bundle_size + 1)
+
+
+def bundle_charge_states(
+    dataset: xr.Dataset, bundle_size: int, refuelled: bool = True
+) -> tuple[xr.Dataset, xr.DataArray]:
+    """Return a dataset with adjacent charge states bundled into superstages, and the partition within each bundle.
+
+    If refuelled is True, the partition is the steady state for each ne_tau (for the time evolution and the
+    steady state). Otherwise, it is the coronal equilibrium (for the coronal charge-state fractions).
+
+    In the bundled dataset, dim_charge_state is the index of the bundle, and
+    - the ionisation of a bundle is the ionisation of its highest charge state, weighted by its partition;
+    - the recombination of a bundle (to the bundle below) is the recombination of its lowest charge state,
+      weighted by its partition;
+    - the emission coefficients of a bundle are the partition-weighted sums over its charge states, so
+      calculate_Lz gives the same result for the bundled and the reconstructed charge-state fractions.
+    Other variables with a charge-state dimension are dropped. The partition has the charge_state_bundle
+    of each charge state as a coordinate, for unbundle_charge_states.
+
+    If bundle_size is 1, the dataset is returned unchanged, with a partition of None.
+    """
+    if bundle_size <= 1:
+        return dataset, None
+
+    bundles = assign_charge_state_bundles(dataset.sizes["dim_charge_state"], bundle_size)
+    number_of_bundles = bundles[-1] + 1
+    lowest_in_bundle = np.searchsorted(bundles, np.arange(number_of_bundles), side="left")
+    highest_in_bundle = np.searchsorted(bundles, np.arange(number_of_bundles), side="right") - 1
+
+    partition = calculate_bundle_partition(dataset, bundles, refuelled=refuelled)
+
+    bundled = dataset.drop_vars(
+        [key for key in dataset.data_vars if "dim_charge_state" in dataset[key].dims] + ["dim_charge_state"]
+    )
+    bundled["effective_ionisation"] = select_bundle_members(
+        dataset.effective_ionisation * partition, highest_in_bundle
+    )
+    bundled["effective_recombination"] = select_bundle_members(
+        dataset.effective_recombination * partition, lowest_in_bundle
+    )
+    for key in [key for key in bundled_emission_coefficients if key in dataset]:
+        bundled[key] = (
+            (dataset[key] * partition).groupby("charge_state_bundle").sum().rename(charge_state_bundle="dim_charge_state")
+        )
+
+    bundled = bundled.assign_coords(dim_charge_state=np.arange(number_of_bundles))
+    return bundled.assign_attrs(atomic_number=number_of_bundles - 1, charge_state_bundle_size=bundle_size), partition
+
+
+def calculate_bundle_partition(dataset: xr.Dataset, bundles: np.ndarray, refuelled: bool = True) -> xr.DataArray:
+    """Calculate the equilibrium distribution of the charge states within each bundle.
+
+    The distribution is normalised within each bundle in log space, so that bundles with very small total
+    abundances are still resolved. If refuelled is True, the distribution is the steady state for each ne_tau
+    (see steady_state.py), except in bundles where the steady state underflows, which use the coronal
+    equilibrium. The charge states of a bundle which cannot be reached at all (i.e. if the ionisation is
+    zero below it) are given equal weights.
+    """
+    log_abundance = calculate_log_coronal_abundances(dataset)
+    if refuelled:
+        from .steady_state import calculate_steady_state_fractional_abundances
+
+        with np.errstate(divide="ignore"):
+            log_steady_state = np.log(dimensionless_magnitude(calculate_steady_state_fractional_abundances(dataset)))
+        underflows = np.isneginf(reduce_over_bundles(log_steady_state, bundles, "max"))
+        log_abundance = xr.where(underflows, log_abundance, log_steady_state)
+    log_abundance = log_abundance.transpose("dim_charge_state", ...)
+
+    largest_in_bundle = reduce_over_bundles(log_abundance, bundles, "max")
+    with np.errstate(invalid="ignore"):
+        partition = np.exp(xr.where(np.isneginf(largest_in_bundle), 0.0, log_abundance - largest_in_bundle))
+    partition = partition / reduce_over_bundles(partition, bundles, "sum")
+
+    return partition.assign_coords(charge_state_bundle=("dim_charge_state", bundles))
+
+
+def reduce_over_bundles(array: xr.DataArray, bundles: np.ndarray, reduction: str) -> xr.DataArray:
+    """Reduce an array over the charge states of each bundle (i.e. "max" or "sum"), and broadcast the result
+    back to the charge states."""
+    grouped = array.assign_coords(charge_state_bundle=("dim_charge_state", bundles)).groupby("charge_state_bundle")
+    reduced = getattr(grouped, reduction)().isel(charge_state_bundle=bundles)
+
+    return reduced.rename(charge_state_bundle="dim_charge_state").assign_coords(dim_charge_state=array.dim_charge_state)
+
+
+def select_bundle_members(array: xr.DataArray, members: np.ndarray) -> xr.DataArray:
+    """Select one charge state for each bundle, indexed by bundle."""
+    return array.isel(dim_charge_state=members).drop_vars("charge_state_bundle").assign_coords(
+        dim_charge_state=np.arange(len(members))
+    )
+
+
+def unbundle_charge_states(charge_state_fraction: xr.DataArray, partition: xr.DataArray) -> xr.DataArray:
+    """Reconstruct the resolved charge-state fractions from the fractions of the bundles.
+
+    If the partition is None (i.e. the charge states were not bundled), charge_state_fraction is returned
+    unchanged.
+    """
+    if partition is None:
+        return charge_state_fraction
+
+    bundle_fraction = charge_state_fraction.isel(dim_charge_state=partition.charge_state_bundle.values)
+    bundle_fraction = bundle_fraction.assign_coords(dim_charge_state=partition.dim_charge_state)
+
+    return (bundle_fraction * partition).drop_vars("charge_state_bundle").transpose(*charge_state_fraction.dims)
+
+
+def compare_bundled_to_resolved(dataset: xr.Dataset, bundle_sizes=(2, 3, 4, 6)) -> pd.DataFrame:
+    """Compare the bundled calculation to the fully resolved calculation for several bundle sizes.
+
+    For each bundle size (and for the resolved calculation, with a bundle size of 1), this reports the
+    number of evolved states, the time to calculate the time evolution (with the dataset's
+    time_evolution_method, including the bundling) and the speedup relative to the resolved calculation.
+    The errors are the largest and mean absolute errors in the charge-state fractions over the time
+    evolution, and the largest errors in the equilibrium charge-state fractions, mean charge state and
+    Lz (relative to its largest value).
+    """
+    from .time_evolution import calculate_time_evolution
+    from .steady_state import calculate_steady_state_fractional_abundances
+    from .radiated_power import calculate_Lz
+
+    rows, resolved = [], None
+    for bundle_size in [1, *bundle_sizes]:
+        reduced_dataset, partition = bundle_charge_states(dataset, bundle_size)
+        start = time.perf_counter()
+        evolution = calculate_time_evolution(dataset.assign(charge_state_bundle_size=bundle_size))
+        elapsed = time.perf_counter() - start
+        equilibrium = unbundle_charge_states(calculate_steady_state_fractional_abundances(reduced_dataset), partition)
+        Lz = magnitude(calculate_Lz(dataset, equilibrium))
+        if resolved is None:
+            resolved = dict(elapsed=elapsed, evolution=evolution, equilibrium=equilibrium, Lz=Lz)
+
+        evolution_error = np.abs(dimensionless_magnitude(evolution - resolved["evolution"]))
+        equilibrium_error = equilibrium - resolved["equilibrium"]
+        rows.append(
+            dict(
+                bundle_size=bundle_size,
+                number_of_states=reduced_dataset.sizes["dim_charge_state"],
+                time_evolution_time=elapsed,
+                speedup=resolved["elapsed"] / elapsed,
+                max_evolution_error=evolution_error.max().item(),
+                mean_evolution_error=evolution_error.mean().item(),
+                max_equilibrium_error=np.abs(dimensionless_magnitude(equilibrium_error)).max().item(),
+                max_mean_charge_state_error=np.abs(
+                    dimensionless_magnitude((equilibrium_error * dataset.dim_charge_state).sum(dim="dim_charge_state"))
+                ).max().item(),
+                max_relative_Lz_error=(np.abs(Lz - resolved["Lz"]).max() / resolved["Lz"].max()).item(),
+            )
+        )
+
+    return pd.DataFrame(rows).set_index("bundle_size")
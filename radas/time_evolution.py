@@ -1,62 +1,385 @@
 import numpy as np
 import xarray as xr
-from scipy.integrate import solve_ivp
+from functools import partial
 from .unit_handling import ureg, magnitude_in_units
+from .superstaging import bundle_charge_states, unbundle_charge_states
 
+# Number of points in each batch of time_evolve_by_eigendecomposition
+eigendecomposition_chunk_size = 256
 
-def calculate_time_evolution(dataset: xr.Dataset) -> xr.Dataset:
+
+# How the time evolution can be stored (the time_evolution_output global), and the name of the stored variable
+time_evolution_outputs = dict(
+    full="charge_state_evolution",
+    final_state="charge_state_evolution",
+    mean_charge_state="mean_charge_state_evolution",
+)
+
+
+def calculate_time_evolution(dataset: xr.Dataset, pool=None, points_per_chunk: int = 64) -> xr.DataArray:
     """Evolve the system over time, and record the impurity charge-state fractions as a function of time.
 
-    The equations are stiff, so we need to use "BDF", "Radau" or "LSODA" as the solver method. Radau was
-    found to give a good balance of accuracy and speed.
+    The method is selected by the time_evolution_method global. "radau" integrates the equations at each
+    point with an adaptive stiff solver (see time_evolve_with_radau), while "eigendecomposition" evaluates
+    the closed-form solution of the linear equations at every point at once (see
+    time_evolve_by_eigendecomposition).
+
+    The system starts in the neutral state at evolution_start, and is recorded at number_of_evolution_times
+    log-spaced times up to evolution_stop (or at the times given by evolution_times). Depending on the
+    time_evolution_output global, the result is the charge-state fractions at every time ("full"), at the
+    last time only ("final_state") or the mean charge state at every time ("mean_charge_state"). The
+    reduction is applied to each chunk, so the full charge-state fractions are never held for the whole grid.
+
+    If stop_at_steady_state is set (for the "radau" method), each integration is stopped once it reaches
+    steady state (to within steady_state_tolerance), and the time at which it stopped is returned as the
+    time_evolution_stop_time coordinate.
+
+    If charge_state_bundle_size is more than 1, the rate equations are solved for bundles of adjacent charge
+    states (see superstaging.py), and the resolved charge-state fractions are reconstructed from the bundles.
+
+    If a multiprocessing pool is given, the grid is split along dim_electron_temp into chunks of roughly
+    points_per_chunk (Te, ne, ne_tau) points, which are evolved on the pool and reassembled in order.
     """
-    evaluation_times = np.logspace(
-        np.log10(magnitude_in_units(dataset.evolution_start, ureg.s)).item(),
-        np.log10(magnitude_in_units(dataset.evolution_stop, ureg.s)).item(),
-    )
+    options, inputs = prepare_time_evolution(dataset)
 
-    def _time_evolve(
-        effective_ionisation,
-        effective_recombination,
-        electron_density,
-        ne_tau,
-    ):
-        charge_state_fraction = np.zeros_like(effective_ionisation)
-        charge_state_fraction[0] = 1.0
-
-        result = solve_ivp(
-            calculate_derivative,
-            y0=charge_state_fraction,
-            t_span=[evaluation_times[0], evaluation_times[-1]],
-            t_eval=evaluation_times,
-            args=(
-                effective_ionisation,
-                effective_recombination,
-                electron_density,
-                ne_tau,
-            ),
-            method="Radau",
-            rtol=1e-3,
-            atol=1e-12,
+    if pool is None:
+        charge_state_fraction = evolve_charge_states(options, *inputs)
+    else:
+        points_per_electron_temp = dataset.sizes["dim_electron_density"] * dataset.sizes["dim_ne_tau"]
+        chunks = split_electron_temp(
+            dataset.sizes["dim_electron_temp"], max(1, points_per_chunk // points_per_electron_temp)
+        )
+        charge_state_fraction = pool.starmap(
+            partial(evolve_charge_states, options),
+            [[select_electron_temp(array, chunk) for array in inputs] for chunk in chunks],
         )
 
-        return result.y
+    return assemble_time_evolution(charge_state_fraction, options)
 
-    charge_state_fraction = xr.apply_ufunc(
-        _time_evolve,
-        magnitude_in_units(dataset.effective_ionisation, ureg.m**3 / ureg.s),
+
+def prepare_time_evolution(dataset: xr.Dataset):
+    """Return the options and the (dequantified) inputs of evolve_charge_states."""
+    evolution_start = magnitude_in_units(dataset.evolution_start, ureg.s).item()
+
+    if "evolution_times" in dataset:
+        evaluation_times = np.unique(magnitude_in_units(dataset.evolution_times, ureg.s))
+        if evaluation_times[0] < evolution_start:
+            raise ValueError(
+                f"evolution_times must not be before evolution_start ({evolution_start}s), but got {evaluation_times[0]}s."
+            )
+    else:
+        evaluation_times = np.logspace(
+            np.log10(evolution_start),
+            np.log10(magnitude_in_units(dataset.evolution_stop, ureg.s)).item(),
+            num=int(dataset.number_of_evolution_times),
+        )
+
+    reduced_dataset, partition = bundle_charge_states(dataset, int(dataset.charge_state_bundle_size))
+
+    output = str(dataset.time_evolution_output.values)
+    if output not in time_evolution_outputs:
+        raise NotImplementedError(f"No implementation for time_evolution_output: {output}")
+
+    options = dict(
+        method=str(dataset.time_evolution_method.values),
+        initial_time=evolution_start,
+        evaluation_times=evaluation_times,
+        output=output,
+        output_times=evaluation_times[-1:] if output == "final_state" else evaluation_times,
+        steady_state_tolerance=float(dataset.steady_state_tolerance) if dataset.stop_at_steady_state else None,
+        number_of_evolved_states=reduced_dataset.sizes["dim_charge_state"],
+    )
+
+    inputs = [
+        magnitude_in_units(reduced_dataset.effective_ionisation, ureg.m**3 / ureg.s),
         magnitude_in_units(
-            dataset.effective_recombination.roll(dim_charge_state=-1),
+            reduced_dataset.effective_recombination.roll(dim_charge_state=-1),
             ureg.m**3 / ureg.s,
         ),
         magnitude_in_units(dataset.electron_density, ureg.m**-3),
         magnitude_in_units(dataset.ne_tau, ureg.m**-3 * ureg.s),
-        vectorize=True,
+    ]
+    if partition is not None:
+        inputs.append(partition)
+
+    return options, inputs
+
+
+def assemble_time_evolution(charge_state_fraction, options: dict) -> xr.DataArray:
+    """Quantify the result of evolve_charge_states, concatenating the chunks if given a list (in order)."""
+    if isinstance(charge_state_fraction, list):
+        charge_state_fraction = xr.concat(charge_state_fraction, dim="dim_electron_temp")
+
+    return (
+        charge_state_fraction.assign_coords(dim_time=options["output_times"])
+        .pint.quantify("")
+        .rename(time_evolution_outputs[options["output"]])
+    )
+
+
+def split_electron_temp(number_of_electron_temps: int, electron_temps_per_chunk: int) -> list[slice]:
+    return [
+        slice(start, start + electron_temps_per_chunk)
+        for start in range(0, number_of_electron_temps, electron_temps_per_chunk)
+    ]
+
+
+def select_electron_temp(array: xr.DataArray, chunk: slice) -> xr.DataArray:
+    return array.isel(dim_electron_temp=chunk) if "dim_electron_temp" in array.dims else array
+
+
+def evolve_charge_states(
+    options: dict,
+    effective_ionisation: xr.DataArray,
+    effective_recombination: xr.DataArray,
+    electron_density: xr.DataArray,
+    ne_tau: xr.DataArray,
+    partition: xr.DataArray = None,
+) -> xr.DataArray:
+    """Evolve the charge-state fractions at each point of the (dequantified) inputs, with the options from
+    prepare_time_evolution, and reduce them to the requested output. If the inputs are for bundled charge
+    states, the partition is used to reconstruct the resolved charge-state fractions."""
+    method = options["method"]
+    time_evolve_kwargs = dict(evaluation_times=options["evaluation_times"], initial_time=options["initial_time"])
+    output_core_dims = [("dim_charge_state", "dim_time")]
+    if method == "radau":
+        time_evolve, vectorize = time_evolve_with_radau, True
+        if options["steady_state_tolerance"] is not None:
+            # Also returns the time at which each integration stopped
+            time_evolve_kwargs["steady_state_tolerance"] = options["steady_state_tolerance"]
+            output_core_dims.append(())
+    elif method == "eigendecomposition":
+        time_evolve, vectorize = time_evolve_by_eigendecomposition, False
+    else:
+        raise NotImplementedError(f"No implementation for time_evolution_method: {method}")
+
+    charge_state_fraction = xr.apply_ufunc(
+        partial(time_evolve, **time_evolve_kwargs),
+        effective_ionisation,
+        effective_recombination,
+        electron_density,
+        ne_tau,
+        vectorize=vectorize,
         input_core_dims=[("dim_charge_state",), ("dim_charge_state",), (), ()],
-        output_core_dims=[("dim_charge_state", "dim_time")],
-    ).assign_coords(dim_time=evaluation_times).pint.quantify("")
+        output_core_dims=output_core_dims,
+    )
+    if isinstance(charge_state_fraction, tuple):
+        charge_state_fraction, stop_time = charge_state_fraction
+        charge_state_fraction = charge_state_fraction.assign_coords(
+            time_evolution_stop_time=stop_time.assign_attrs(units="s")
+        )
+    charge_state_fraction = unbundle_charge_states(charge_state_fraction, partition)
 
-    return charge_state_fraction
+    if options["output"] == "final_state":
+        return charge_state_fraction.isel(dim_time=[-1])
+    elif options["output"] == "mean_charge_state":
+        return (charge_state_fraction * charge_state_fraction.dim_charge_state).sum(dim="dim_charge_state")
+    else:
+        return charge_state_fraction
+
+
+def time_evolve_with_radau(
+    effective_ionisation,
+    effective_recombination,
+    electron_density,
+    ne_tau,
+    evaluation_times,
+    initial_time=None,
+    steady_state_tolerance=None,
+):
+    """Integrate the charge-state fractions at a single point, starting from the neutral state at initial_time
+    (by default, the first of the evaluation_times).
+
+    The equations are stiff, so we need to use "BDF", "Radau" or "LSODA" as the solver method. Radau was
+    found to give a good balance of accuracy and speed. The equations are linear, so the exact (constant)
+    Jacobian is passed to the solver instead of estimating it by finite differences.
+
+    If steady_state_tolerance is given, the integration is stopped once the system is at steady state (see
+    steady_state_event), and the remaining evaluation times are filled with the final state. In this case,
+    the time at which the integration stopped is also returned.
+    """
+    from scipy.integrate import solve_ivp
+
+    if initial_time is None:
+        initial_time = evaluation_times[0]
+    charge_state_fraction = np.zeros_like(effective_ionisation)
+    charge_state_fraction[0] = 1.0
+    args = (effective_ionisation, effective_recombination, electron_density, ne_tau)
+
+    event = None
+    if steady_state_tolerance is not None:
+        event = steady_state_event(*args, steady_state_tolerance)
+        if event is not None and event(initial_time, charge_state_fraction, *args) <= 0.0:
+            # Already at steady state (i.e. when the ionisation is negligible)
+            return np.repeat(charge_state_fraction[:, np.newaxis], len(evaluation_times), axis=1), initial_time
+
+    result = solve_ivp(
+        calculate_derivative,
+        y0=charge_state_fraction,
+        t_span=[initial_time, evaluation_times[-1]],
+        t_eval=evaluation_times,
+        args=args,
+        method="Radau",
+        jac=calculate_jacobian(*args),
+        rtol=1e-3,
+        atol=1e-12,
+        events=event,
+    )
+
+    if steady_state_tolerance is None:
+        return result.y
+
+    if result.status == 1:
+        # Stopped by the steady-state event
+        stop_time = result.t_events[0][0]
+        charge_state_fraction = np.empty((len(charge_state_fraction), len(evaluation_times)))
+        charge_state_fraction[:, : result.y.shape[1]] = result.y
+        charge_state_fraction[:, result.y.shape[1] :] = result.y_events[0][0][:, np.newaxis]
+        return charge_state_fraction, stop_time
+
+    return result.y, evaluation_times[-1]
+
+
+def steady_state_event(effective_ionisation, effective_recombination, electron_density, ne_tau, tolerance):
+    """Return a solve_ivp event which stops the integration at steady state (or None if the system cannot evolve).
+
+    The system is taken to be at steady state when the largest derivative of the charge-state fractions,
+    divided by the slowest relaxation rate of the system (see calculate_slowest_relaxation_rate), is less
+    than the tolerance. This is an estimate of the remaining change in the charge-state fractions, since
+    the last mode to decay is the slowest one.
+    """
+    slowest_relaxation_rate = calculate_slowest_relaxation_rate(
+        effective_ionisation, effective_recombination, electron_density, ne_tau
+    )
+    if slowest_relaxation_rate == 0.0:
+        return None
+
+    # The event is evaluated at every step, so the derivative is calculated from the Jacobian (which is
+    # much cheaper than calculate_derivative, and accurate enough to compare against the tolerance)
+    jacobian = calculate_jacobian(effective_ionisation, effective_recombination, electron_density, ne_tau)
+    source = np.zeros(len(jacobian))
+    source[0] = electron_density / ne_tau
+
+    def event(time, charge_state_fraction, *args):
+        return np.max(np.abs(jacobian @ charge_state_fraction + source)) / slowest_relaxation_rate - tolerance
+
+    event.terminal = True
+    event.direction = -1
+    return event
+
+
+def calculate_slowest_relaxation_rate(effective_ionisation, effective_recombination, electron_density, ne_tau=np.inf):
+    """Return the slowest rate (in s^-1) at which the system relaxes towards steady state.
+
+    This is the smallest non-zero magnitude of the eigenvalues of the rate matrix, which are found from the
+    symmetric form of the matrix (see time_evolve_by_eigendecomposition). Without refuelling, the total
+    density is conserved, so there is an eigenvalue of zero (up to rounding), which is skipped.
+    """
+    from scipy.linalg import eigvalsh_tridiagonal
+
+    effective_ionisation = np.asarray(effective_ionisation)
+    effective_recombination = np.asarray(effective_recombination)
+
+    diagonal = -(effective_ionisation + 1.0 / ne_tau)
+    diagonal[1:] -= effective_recombination[:-1]
+    off_diagonal = np.sqrt(effective_ionisation[:-1] * effective_recombination[:-1])
+    rates = np.abs(eigvalsh_tridiagonal(diagonal * electron_density, off_diagonal * electron_density))
+
+    rates = rates[rates > len(rates) * np.finfo(float).eps * np.max(rates)]
+    return np.min(rates) if rates.size else 0.0
+
+
+def time_evolve_by_eigendecomposition(
+    effective_ionisation,
+    effective_recombination,
+    electron_density,
+    ne_tau,
+    evaluation_times,
+    initial_time=None,
+    chunk_size: int = eigendecomposition_chunk_size,
+    tolerance: float = 1e-6,
+):
+    """Evaluate the charge-state fractions in closed form, for a batch of points starting from the neutral state
+    at initial_time (by default, the first of the evaluation_times).
+
+    The rates have shape (..., charge_state), and electron_density and ne_tau broadcast against the leading
+    axes. The rate equations are dn/dt = A n + b, where A is tridiagonal with positive off-diagonals. So A is
+    similar to a symmetric matrix J = D^-1 A D (with d_{k+1} / d_k = sqrt(S_k / alpha_{k+1})), and
+
+        n(t) = n_ss + D Q exp(Lambda (t - t_0)) Q^T D^-1 (n(t_0) - n_ss)
+
+    where J = Q Lambda Q^T is found with a batched symmetric eigendecomposition, and n_ss is the steady state.
+    When D spans a large range (i.e. for high-Z species at high temperature), the rounding error in this
+    expression can be large. The error is estimated (conservatively) for each point, and the points where it
+    exceeds the tolerance (well below the error of the Radau integration) are integrated with
+    time_evolve_with_radau instead.
+    """
+    from .steady_state import solve_steady_state
+
+    number_of_charge_states = np.shape(effective_ionisation)[-1]
+    batch_shape = np.broadcast_shapes(
+        np.shape(effective_ionisation)[:-1],
+        np.shape(effective_recombination)[:-1],
+        np.shape(electron_density),
+        np.shape(ne_tau),
+    )
+    rate_shape = (*batch_shape, number_of_charge_states)
+    effective_ionisation = np.broadcast_to(effective_ionisation, rate_shape).reshape((-1, number_of_charge_states))
+    effective_recombination = np.broadcast_to(effective_recombination, rate_shape).reshape((-1, number_of_charge_states))
+    electron_density = np.broadcast_to(electron_density, batch_shape).ravel()
+    ne_tau = np.broadcast_to(ne_tau, batch_shape).ravel()
+    if initial_time is None:
+        initial_time = evaluation_times[0]
+    elapsed_times = np.asarray(evaluation_times) - initial_time
+
+    charge_state_fraction = np.empty((electron_density.size, number_of_charge_states, elapsed_times.size))
+    diagonal_index = np.arange(number_of_charge_states)
+
+    for start in range(0, electron_density.size, chunk_size):
+        chunk = slice(start, min(start + chunk_size, electron_density.size))
+        ionisation, recombination = effective_ionisation[chunk], effective_recombination[chunk]
+        density, refuelling_rate = electron_density[chunk, np.newaxis], 1.0 / ne_tau[chunk, np.newaxis]
+
+        # Symmetric form of the rate matrix (in s^-1)
+        diagonal = -(ionisation + refuelling_rate)
+        diagonal[:, 1:] -= recombination[:, :-1]
+        off_diagonal = np.sqrt(ionisation[:, :-1] * recombination[:, :-1])
+        symmetric_matrix = np.zeros((diagonal.shape[0], number_of_charge_states, number_of_charge_states))
+        symmetric_matrix[:, diagonal_index, diagonal_index] = diagonal * density
+        symmetric_matrix[:, diagonal_index[1:], diagonal_index[:-1]] = off_diagonal * density
+        symmetric_matrix[:, diagonal_index[:-1], diagonal_index[1:]] = off_diagonal * density
+        eigenvalues, eigenvectors = np.linalg.eigh(symmetric_matrix)
+
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            log_scaling = np.zeros_like(diagonal)
+            np.cumsum(0.5 * (np.log(ionisation[:, :-1]) - np.log(recombination[:, :-1])), axis=1, out=log_scaling[:, 1:])
+            scaling = np.exp(log_scaling)
+
+            # The steady state (zero if there is no refuelling)
+            steady_state = np.zeros_like(diagonal)
+            refuelled = refuelling_rate[:, 0] > 0.0
+            steady_state[refuelled] = solve_steady_state(ionisation[refuelled], recombination[refuelled], ne_tau[chunk][refuelled])
+
+            initial_state = np.zeros_like(diagonal)
+            initial_state[:, 0] = 1.0
+            modal_coefficients = np.einsum("bji,bj->bi", eigenvectors, (initial_state - steady_state) / scaling)
+
+            charge_state_fraction[chunk] = steady_state[..., np.newaxis] + scaling[..., np.newaxis] * np.einsum(
+                "bij,bjt->bit", eigenvectors, modal_coefficients[..., np.newaxis] * np.exp(eigenvalues[..., np.newaxis] * elapsed_times)
+            )
+
+            estimated_error = (
+                number_of_charge_states * np.finfo(float).eps * np.max(scaling, axis=1) * np.sum(np.abs(modal_coefficients), axis=1)
+            )
+
+        for i in np.flatnonzero(~(estimated_error <= tolerance)):
+            point = start + i
+            charge_state_fraction[point] = time_evolve_with_radau(
+                effective_ionisation[point], effective_recombination[point], electron_density[point], ne_tau[point],
+                evaluation_times, initial_time,
+            )
+
+    return charge_state_fraction.reshape((*batch_shape, number_of_charge_states, elapsed_times.size))
 
 
 def shift(arr, num, fill_value=0.0):
@@ -89,25 +412,31 @@ def calculate_derivative(
     The default option is for a non-refuelled impurity. If you set a ne_tau, it is assumed that the ground state is
     constantly refuelled at a rate of 1 / ne_tau and that the excited states
     are lost at a rate proportional to their concentration.
+
+    The charge states are along the first axis. charge_state_fraction can also be a stacked batch of states
+    with shape (charge_state, ...), i.e. as passed by solve_ivp with vectorized=True. The rate coefficients
+    are broadcast against the trailing axes, and electron_density and ne_tau against the batch axes.
     """
+    charge_state_fraction = np.asarray(charge_state_fraction)
+    effective_ionisation = expand_to_batch(effective_ionisation, charge_state_fraction.ndim)
+    effective_recombination = expand_to_batch(effective_recombination, charge_state_fraction.ndim)
+
     ionisation_to_above = effective_ionisation * charge_state_fraction
-    ionisation_from_below = shift(effective_ionisation * charge_state_fraction, +1)
+    ionisation_from_below = shift(ionisation_to_above, +1)
 
     recombination_from_above = effective_recombination * shift(
         charge_state_fraction, -1
     )
     recombination_to_below = shift(effective_recombination, +1) * charge_state_fraction
 
-    change_in_charge_state_fraction = np.zeros_like(charge_state_fraction)
-    for i in range(len(change_in_charge_state_fraction)):
-        change_in_charge_state_fraction[i] = kahan_babushka_neumaier_sum(
-            [
-                -ionisation_to_above[i],
-                ionisation_from_below[i],
-                recombination_from_above[i],
-                -recombination_to_below[i],
-            ]
-        )
+    change_in_charge_state_fraction = kahan_babushka_neumaier_sum(
+        [
+            -ionisation_to_above,
+            ionisation_from_below,
+            recombination_from_above,
+            -recombination_to_below,
+        ]
+    )
 
     change_in_charge_state_fraction -= charge_state_fraction / ne_tau
     change_in_charge_state_fraction[0] += 1.0 / ne_tau
@@ -115,18 +444,57 @@ def calculate_derivative(
     return change_in_charge_state_fraction * electron_density
 
 
+def calculate_jacobian(
+    effective_ionisation,
+    effective_recombination,
+    electron_density,
+    ne_tau=np.inf,
+    sparse: bool = False,
+):
+    """Calculate the Jacobian of calculate_derivative w.r.t. the charge-state fractions.
+
+    The rate equations are linear in the charge-state fractions and only couple neighbouring charge states,
+    so the Jacobian is a constant tridiagonal matrix. If sparse is True, it is returned as a scipy.sparse
+    matrix (so that the solver uses a sparse LU decomposition). Otherwise, it is returned as a dense array,
+    which is faster for the number of charge states in the radas datasets (up to 75 for tungsten).
+    """
+    from scipy.sparse import diags
+
+    effective_ionisation = np.asarray(effective_ionisation)
+    effective_recombination = np.asarray(effective_recombination)
+
+    # d/dn_k of (ionisation_from_below, -ionisation_to_above - recombination_to_below - loss, recombination_from_above)
+    lower = effective_ionisation[:-1]
+    diagonal = -(effective_ionisation + 1.0 / ne_tau)
+    diagonal[1:] -= effective_recombination[:-1]
+    upper = effective_recombination[:-1]
+
+    jacobian = diags([lower, diagonal, upper], offsets=[-1, 0, 1], format="csc") * electron_density
+
+    return jacobian if sparse else jacobian.toarray()
+
+
+def expand_to_batch(array, ndim):
+    """Append axes to an array of per-charge-state values, so that it broadcasts against a batch of states."""
+    array = np.asarray(array)
+    return array.reshape(array.shape + (1,) * (ndim - array.ndim))
+
+
 def kahan_babushka_neumaier_sum(values_to_sum):
-    """Improved Kahan compensated summation algorithm."""
-    running_sum = 0.0
+    """Improved Kahan compensated summation algorithm.
+
+    The sum is taken elementwise over a sequence of arrays (or scalars), in the same order and with the same
+    operations as a scalar loop over each element.
+    """
+    # The first term is added exactly, so it does not contribute to the compensation
+    running_sum = 0.0 + values_to_sum[0]
     compensation = 0.0
 
-    for value in values_to_sum:
+    for value in values_to_sum[1:]:
         temporary_sum = running_sum + value
 
-        if running_sum >= value:
-            compensation += running_sum - temporary_sum + value
-        else:
-            compensation += value - temporary_sum + running_sum
+        # Equivalent to (running_sum - temporary_sum + value) if running_sum >= value, else (value - temporary_sum + running_sum)
+        compensation += np.maximum(running_sum, value) - temporary_sum + np.minimum(running_sum, value)
 
         running_sum = temporary_sum
 
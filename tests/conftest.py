@@ -37,3 +37,92 @@ def output_dir(radas_dir):
 @pytest.fixture()
 def verbose():
     return 10
+
+
+def write_synthetic_adf11_file(filename: Path, atomic_number: int, log_values: bool = True):
+    """Write a small ADF11-formatted file with smooth, physically-shaped rate coefficients."""
+    import numpy as np
+
+    log_density = np.linspace(7.69897, 15.30103, 12)
+    log_temp = np.linspace(-0.69897, 4.0, 19)
+    temp, density = np.meshgrid(10**log_temp, 10**log_density, indexing="ij")
+
+    def format_block(values):
+        fields = [f"{value:10.5f}" for value in np.ravel(values)]
+        return ["".join(fields[i : i + 8]) for i in range(0, len(fields), 8)]
+
+    lines = [
+        f"{atomic_number:5d}{log_density.size:5d}{log_temp.size:5d}{1:5d}{atomic_number:5d}     /SYNTHETIC        /",
+        "-" * 80,
+        *format_block(log_density),
+        *format_block(log_temp),
+    ]
+    for charge_state in range(atomic_number):
+        values = 1e-8 * np.exp(-13.6 * (charge_state + 1) ** 1.5 / temp) / np.sqrt(temp) + 1e-12 * density**0.01
+        lines.append(f"------------------/ IPRT= 1  / IGRD= 1  /--------/ Z1={charge_state + 1:2d}   / DATE= 18/01/99")
+        lines.extend(format_block(np.log10(values) if log_values else values))
+    lines.extend(["C" + "-" * 79, "C  SYNTHETIC TEST DATA", "C" + "-" * 79])
+
+    filename.write_text("\n".join(lines) + "\n")
+
+
+def write_synthetic_species_data(data_file_dir: Path, species_name: str):
+    """Write synthetic ADF11 files for each of the data_files of a species in the default config."""
+    from radas.shared import default_config_file, open_yaml_file
+
+    configuration = open_yaml_file(default_config_file)
+    species_config = configuration["species"][species_name]
+
+    for dataset_type, year in species_config["data_files"].items():
+        dataset_config = configuration["data_file_config"]["adf11"][dataset_type]
+        write_synthetic_adf11_file(
+            data_file_dir / f"{dataset_config['prefix'].lower()}{str(year)[-2:]}_{species_config['atomic_symbol'].lower()}.dat",
+            atomic_number=species_config["atomic_number"],
+            log_values=dataset_config["code"] <= 9,
+        )
+
+
+@pytest.fixture(scope="session")
+def synthetic_data_file_dir(tmpdir_factory):
+    "Write a set of synthetic ADF11 files for 'helium', so that the readers can be tested offline."
+    data_file_dir = Path(tmpdir_factory.mktemp("synthetic_data_files"))
+    write_synthetic_species_data(data_file_dir, "helium")
+
+    return data_file_dir
+
+
+@pytest.fixture(scope="session")
+def synthetic_tungsten_data_file_dir(tmpdir_factory):
+    "Write a set of synthetic ADF11 files for 'tungsten', to test the handling of high-Z species offline."
+    data_file_dir = Path(tmpdir_factory.mktemp("synthetic_tungsten_data_files"))
+    write_synthetic_species_data(data_file_dir, "tungsten")
+
+    return data_file_dir
+
+
+@pytest.fixture(scope="session")
+def read_synthetic_dataset(synthetic_data_file_dir, synthetic_tungsten_data_file_dir):
+    "Return a function which reads the rate coefficients for the time evolution of 'helium' or 'tungsten' from the synthetic files."
+    from radas import read_rate_coeff, required_rate_coefficients
+    from radas.shared import default_config_file, open_yaml_file
+
+    data_file_dirs = dict(helium=synthetic_data_file_dir, tungsten=synthetic_tungsten_data_file_dir)
+
+    def read(species_name: str, configuration: dict = None):
+        if configuration is None:
+            configuration = open_yaml_file(default_config_file)
+        return read_rate_coeff(data_file_dirs[species_name], species_name, configuration, dataset_types=required_rate_coefficients())
+
+    return read
+
+
+@pytest.fixture()
+def helium_dataset(read_synthetic_dataset):
+    "Read a new copy of the synthetic 'helium' dataset, with the default config, for each test."
+    return read_synthetic_dataset("helium")
+
+
+@pytest.fixture()
+def reduced_helium_dataset(helium_dataset):
+    "A coarse subset of the 'helium' grid, to keep the time integration quick."
+    return helium_dataset.isel(dim_electron_temp=slice(None, None, 10), dim_electron_density=slice(None, None, 7))
@@ -0,0 +1,103 @@
+"""Check the ADF11 reader against the reference fortranformat implementation."""
+
+import os
+import stat
+import pytest
+import numpy as np
+
+from radas.adas_interface import read_adf11_data_file
+
+
+@pytest.mark.filterwarnings("error")
+@pytest.mark.parametrize("filename", ["scd96_he.dat", "ecd96_he.dat"])
+def test_fixed_width_reader_matches_fortranformat(synthetic_data_file_dir, filename):
+    fast = read_adf11_data_file(synthetic_data_file_dir / filename)
+    reference = read_adf11_data_file(synthetic_data_file_dir / filename, use_fortranformat=True)
+
+    assert fast.keys() == reference.keys()
+    for key in fast:
+        np.testing.assert_array_equal(fast[key], reference[key])
+
+
+@pytest.mark.filterwarnings("error")
+def test_fixed_width_reader_falls_back_to_fortranformat(synthetic_data_file_dir, tmp_path):
+    source = synthetic_data_file_dir / "scd96_he.dat"
+    lines = source.read_text().split("\n")
+    # Split the first density line over two lines, which breaks the fixed 8-values-per-line layout
+    lines[2:3] = [lines[2][:40], lines[2][40:]]
+    (tmp_path / source.name).write_text("\n".join(lines))
+
+    fallback = read_adf11_data_file(tmp_path / source.name)
+    reference = read_adf11_data_file(source)
+
+    np.testing.assert_array_equal(fallback["DDENSD"], reference["DDENSD"])
+    np.testing.assert_array_equal(fallback["DRCOFD"], reference["DRCOFD"])
+
+
+def test_legacy_reader(synthetic_data_file_dir, tmp_path):
+    from radas.adas_interface import read_adf11_file
+
+    # Older versions of radas stored the files by species and dataset type
+    source = synthetic_data_file_dir / "scd96_he.dat"
+    (tmp_path / "helium_effective_ionisation_96.dat").write_text(source.read_text())
+
+    legacy = read_adf11_file(tmp_path, "helium", 1996, "effective_ionisation")
+    reference = read_adf11_data_file(source)
+    for key in reference:
+        np.testing.assert_array_equal(legacy[key], reference[key])
+
+
+@pytest.mark.filterwarnings("error")
+def test_cached_reader(synthetic_data_file_dir, tmp_path):
+    from radas.adas_interface import read_adf11_file_cached
+
+    source = tmp_path / "scd96_he.dat"
+    source.write_text((synthetic_data_file_dir / source.name).read_text())
+    cache_file = source.with_suffix(".npz")
+
+    reference = read_adf11_data_file(source)
+    first = read_adf11_file_cached(source)
+    assert cache_file.exists()
+    cache_time = cache_file.stat().st_mtime_ns
+    # The cache is written with the default permissions, so that it can be shared
+    umask = os.umask(0)
+    os.umask(umask)
+    assert stat.S_IMODE(cache_file.stat().st_mode) == 0o666 & ~umask
+
+    second = read_adf11_file_cached(source)
+    assert cache_file.stat().st_mtime_ns == cache_time
+    for data in [first, second]:
+        assert data.keys() == reference.keys()
+        for key in reference:
+            np.testing.assert_array_equal(data[key], reference[key])
+    assert isinstance(second["IZMAX"], int)
+
+    # Changing the source file must invalidate the cache
+    source.write_text(source.read_text().replace("  -0.69897", "  -0.50000", 1))
+    updated = read_adf11_file_cached(source)
+    assert updated["DTEVD"][0] == -0.5
+
+
+@pytest.mark.filterwarnings("error")
+def test_selection_reader(synthetic_data_file_dir):
+    from radas.adas_interface import read_adf11_file_selection
+    from radas.read_rate_coeffs import build_adf11_rate_dataset
+    from radas.shared import default_config_file, open_yaml_file
+
+    filename = synthetic_data_file_dir / "scd96_he.dat"
+    full = read_adf11_data_file(filename)
+    selection = read_adf11_file_selection(
+        filename, dim_charge_state=[1], dim_electron_temp=slice(2, 10), dim_electron_density=[0, 5, 7]
+    )
+
+    np.testing.assert_array_equal(selection["charge_states"], [1])
+    np.testing.assert_array_equal(selection["DTEVD"], full["DTEVD"][2:10])
+    np.testing.assert_array_equal(selection["DDENSD"], full["DDENSD"][[0, 5, 7]])
+    np.testing.assert_array_equal(selection["DRCOFD"], full["DRCOFD"][1:2, 2:10][:, :, [0, 5, 7]])
+
+    dataset_config = open_yaml_file(default_config_file)["data_file_config"]["adf11"]["effective_ionisation"]
+    selector = dict(dim_charge_state=slice(1, 2), dim_electron_temp=slice(2, 10))
+    selected_dataset = build_adf11_rate_dataset(filename, dataset_config, selector=selector)
+    full_dataset = build_adf11_rate_dataset(filename, dataset_config, use_cache=False)
+
+    assert selected_dataset.rate_coefficient.identical(full_dataset.rate_coefficient.isel(**selector))
@@ -0,0 +1,80 @@
+"""Check the log-space coronal equilibrium solver against a direct product of ratios."""
+
+import time
+import pytest
+import numpy as np
+import xarray as xr
+
+from radas import calculate_coronal_fractional_abundances, ureg
+
+# Budget (in s) for test_coronal_throughput, about ten times the measured time
+time_budget = 3.0
+
+
+def build_dataset(atomic_number, log_ratio):
+    """Build a dataset where log(S_k / alpha_{k+1}) = log_ratio[k] on a (Te, ne) grid."""
+    shape = (atomic_number + 1, *log_ratio.shape[1:])
+    ionisation = np.zeros(shape)
+    ionisation[:atomic_number] = 1e-14 * np.exp(log_ratio)
+    recombination = np.zeros(shape)
+    recombination[1:] = 1e-14
+    coords = dict(
+        dim_charge_state=np.arange(atomic_number + 1),
+        dim_electron_temp=np.logspace(0, 4, shape[1]),
+        dim_electron_density=np.logspace(17, 21, shape[2]),
+    )
+    dims = ("dim_charge_state", "dim_electron_temp", "dim_electron_density")
+
+    dataset = xr.Dataset(
+        dict(effective_ionisation=(dims, ionisation), effective_recombination=(dims, recombination)),
+        coords=coords,
+    ).pint.quantify(effective_ionisation=ureg.m**3 / ureg.s, effective_recombination=ureg.m**3 / ureg.s)
+    return dataset.assign_attrs(atomic_number=atomic_number)
+
+
+def reference_fractional_abundances(log_ratio):
+    """Product of ratios, which is only representable in floating point for small log ratios."""
+    fraction = np.concatenate([np.ones((1, *log_ratio.shape[1:])), np.cumprod(np.exp(log_ratio), axis=0)])
+    return fraction / fraction.sum(axis=0)
+
+
+@pytest.mark.filterwarnings("error")
+def test_coronal_matches_product_of_ratios():
+    rng = np.random.default_rng(seed=0)
+    log_ratio = rng.normal(scale=2.0, size=(10, 7, 5))
+
+    fraction = calculate_coronal_fractional_abundances(build_dataset(10, log_ratio))
+
+    assert fraction.dims == ("dim_charge_state", "dim_electron_temp", "dim_electron_density")
+    np.testing.assert_allclose(fraction.values, reference_fractional_abundances(log_ratio), rtol=1e-12, atol=1e-300)
+
+
+@pytest.mark.filterwarnings("error")
+def test_coronal_is_stable_for_high_z():
+    # The product of ratios spans e^(+/-5000), which overflows and underflows a float64
+    atomic_number = 74
+    log_ratio = np.broadcast_to(np.array([-70.0, 70.0])[np.newaxis, :, np.newaxis], (atomic_number, 2, 3)).copy()
+
+    fraction = calculate_coronal_fractional_abundances(build_dataset(atomic_number, log_ratio)).values
+
+    assert np.all(np.isfinite(fraction))
+    np.testing.assert_allclose(fraction.sum(axis=0), 1.0, rtol=1e-12)
+    # Neutral at low Te, fully stripped at high Te, with the neighbours suppressed by e^-70
+    np.testing.assert_allclose(fraction[0, 0], 1.0)
+    np.testing.assert_allclose(fraction[-1, 1], 1.0)
+    np.testing.assert_allclose(fraction[1, 0], np.exp(-70.0), rtol=1e-10)
+    np.testing.assert_allclose(fraction[-2, 1], np.exp(-70.0), rtol=1e-10)
+
+
+@pytest.mark.slow
+def test_coronal_throughput():
+    rng = np.random.default_rng(seed=1)
+    log_ratio = rng.normal(scale=2.0, size=(74, 400, 200))
+    dataset = build_dataset(74, log_ratio)
+
+    start = time.perf_counter()
+    fraction = calculate_coronal_fractional_abundances(dataset)
+    elapsed = time.perf_counter() - start
+
+    np.testing.assert_allclose(fraction.values, reference_fractional_abundances(log_ratio), rtol=1e-10, atol=1e-300)
+    assert elapsed < time_budget, f"Coronal equilibrium for {log_ratio[0].size} (Te, ne) points took {elapsed:.3f}s"
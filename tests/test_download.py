@@ -0,0 +1,90 @@
+"""Test the downloader against a local stand-in for the OpenADAS server."""
+
+import os
+import stat
+import pytest
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def mirror_url(tmp_path):
+    "Serve a directory laid out like OpenADAS, with one valid file, one error page and one missing file."
+    mirror_dir = tmp_path / "mirror"
+    (mirror_dir / "download" / "adf11" / "scd96").mkdir(parents=True)
+    (mirror_dir / "download" / "adf11" / "acd96").mkdir(parents=True)
+    (mirror_dir / "download" / "adf11" / "scd96" / "scd96_he.dat").write_text("    2   24   30    1    2\n" * 1000)
+    (mirror_dir / "download" / "adf11" / "acd96" / "acd96_he.dat").write_text("<html>OPEN-ADAS Error</html>\n")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(mirror_dir)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.filterwarnings("error")
+def test_download_from_mirror(mirror_url, tmp_path):
+    from radas.adas_interface import download_all_species_data
+
+    data_file_config = dict(adf11=dict(
+        effective_recombination=dict(prefix="ACD"),
+        effective_ionisation=dict(prefix="SCD"),
+        line_emission_from_excitation=dict(prefix="PLT"),
+    ))
+    species_configs = dict(
+        helium=dict(atomic_symbol="He", data_files=dict(
+            effective_recombination=1996,
+            effective_ionisation=1996,
+            line_emission_from_excitation=1996,
+        )),
+        # An alias which reuses the helium data should not download it again
+        helium_alias=dict(atomic_symbol="X", data_files=dict(
+            effective_ionisation=["He", 1996],
+        )),
+    )
+    data_file_dir = tmp_path / "data_files"
+
+    download_all_species_data(data_file_dir, species_configs, data_file_config, verbose=0, url_base=mirror_url)
+
+    assert sorted(path.name for path in data_file_dir.iterdir()) == ["scd96_he.dat"]
+    assert (data_file_dir / "scd96_he.dat").read_text() == (
+        tmp_path / "mirror" / "download" / "adf11" / "scd96" / "scd96_he.dat"
+    ).read_text()
+
+    # The data files are written with the default permissions, so that they can be shared
+    umask = os.umask(0)
+    os.umask(umask)
+    assert stat.S_IMODE((data_file_dir / "scd96_he.dat").stat().st_mode) == 0o666 & ~umask
+
+
+def test_reuse_data_files_from_older_versions(mirror_url, tmp_path):
+    from radas.adas_interface import download_all_species_data
+
+    data_file_config = dict(adf11=dict(
+        effective_recombination=dict(prefix="ACD"),
+        effective_ionisation=dict(prefix="SCD"),
+    ))
+    species_configs = dict(helium=dict(atomic_symbol="He", data_files=dict(
+        effective_recombination=1996,
+        effective_ionisation=1996,
+    )))
+    data_file_dir = tmp_path / "data_files"
+    data_file_dir.mkdir()
+    # The recombination file is an error page on the mirror, so it can only come from the existing file
+    legacy_file = data_file_dir / "helium_effective_recombination_96.dat"
+    legacy_file.write_text("    2   24   30    1    2\n")
+
+    download_all_species_data(data_file_dir, species_configs, data_file_config, verbose=0, url_base=mirror_url)
+
+    assert (data_file_dir / "acd96_he.dat").read_text() == legacy_file.read_text()
+    assert (data_file_dir / "scd96_he.dat").exists()
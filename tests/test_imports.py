@@ -0,0 +1,60 @@
+"""Check that radas is quick to import, with the command line, plotting and SciPy only loaded when used."""
+
+import subprocess
+import sys
+import pytest
+
+# Generous budget (in s) for `import radas`, which took several seconds when every submodule was imported up front.
+# The deferred imports are checked directly by test_deferred_imports, so this only catches gross regressions.
+import_time_budget = 2.0
+
+
+def run_python(*arguments: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *arguments], capture_output=True, text=True, check=True)
+
+
+def loaded_modules(statement: str) -> set[str]:
+    "Return the top-level modules (and radas submodules) which are loaded after running statement."
+    output = run_python("-c", f"{statement}; import sys; print('\\n'.join(sys.modules))").stdout
+    return {name if name.startswith("radas.") else name.split(".")[0] for name in output.split()}
+
+
+def test_import_time():
+    stderr = run_python("-X", "importtime", "-c", "import radas").stderr
+
+    # Lines are "import time: self [us] | cumulative [us] | module", with the module indented by its depth
+    cumulative_times = {
+        fields[2].strip(): int(fields[1])
+        for fields in (line.split("|") for line in stderr.splitlines() if line.startswith("import time:"))
+        if fields[1].strip().isdigit()
+    }
+    assert cumulative_times["radas"] / 1e6 < import_time_budget
+
+
+@pytest.mark.parametrize(
+    "statement, unwanted_modules",
+    [
+        ("import radas", {"numpy", "click", "matplotlib", "scipy", "xarray", "pint", "radas.cli"}),
+        ("from radas import ureg, Quantity", {"click", "matplotlib", "radas.cli", "radas.pipeline"}),
+        ("from radas import RateTable", {"click", "matplotlib", "radas.cli", "radas.pipeline", "scipy.interpolate"}),
+        ("from radas.cli import run_radas_cli", {"numpy", "matplotlib", "scipy", "xarray", "pint", "radas.pipeline", "radas.adas_interface"}),
+        ("from radas import run_radas", {"click", "matplotlib", "scipy.integrate"}),
+    ],
+)
+def test_deferred_imports(statement, unwanted_modules):
+    assert not unwanted_modules & loaded_modules(statement)
+
+
+def test_lazy_attributes():
+    import radas
+    from radas.rate_table import RateTable
+
+    assert radas.RateTable is RateTable
+    assert set(radas.__all__) <= set(dir(radas))
+    with pytest.raises(AttributeError):
+        radas.not_a_radas_function
+
+    from radas.cli import run_radas_computation
+    from radas.pipeline import run_radas_computation as moved_run_radas_computation
+
+    assert run_radas_computation is moved_run_radas_computation
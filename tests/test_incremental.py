@@ -0,0 +1,120 @@
+"""Check that run_radas only recomputes the species whose output is out of date."""
+
+import shutil
+import pytest
+import yaml
+import xarray as xr
+
+
+@pytest.fixture()
+def radas_directory(synthetic_data_file_dir, tmp_path):
+    "A working directory with the synthetic helium data files already downloaded."
+    shutil.copytree(synthetic_data_file_dir, tmp_path / "data_files", ignore=shutil.ignore_patterns("*.npz"))
+    return tmp_path
+
+
+def write_config(directory, **overrides):
+    from radas.shared import default_config_file, open_yaml_file
+
+    configuration = open_yaml_file(default_config_file)
+    configuration["globals"].update(
+        time_evolution_method="eigendecomposition", electron_density_resolution=5, electron_temp_resolution=10, **overrides
+    )
+    config_file = directory / "config.yaml"
+    config_file.write_text(yaml.safe_dump(configuration))
+    return config_file
+
+
+def run(directory, config_file, **kwargs):
+    from radas.pipeline import run_radas
+
+    run_radas(directory, config_file, species=("helium",), verbose=1, debug=True, **kwargs)
+
+
+def test_skip_up_to_date_species(radas_directory, capsys):
+    output_file = radas_directory / "output" / "helium.nc"
+    config_file = write_config(radas_directory)
+
+    run(radas_directory, config_file)
+    with xr.open_dataset(output_file) as output:
+        fingerprint = output.radas_fingerprint
+    assert "Running computation for helium" in capsys.readouterr().out
+
+    # Nothing has changed, so the output is reused
+    modified = output_file.stat().st_mtime_ns
+    run(radas_directory, config_file)
+    assert "Skipping helium: output is up to date" in capsys.readouterr().out
+    assert output_file.stat().st_mtime_ns == modified
+
+    run(radas_directory, config_file, force=True)
+    assert "Running computation for helium" in capsys.readouterr().out
+
+    # Changing a global or a source file makes the output stale
+    config_file = write_config(radas_directory, number_of_evolution_times=10)
+    run(radas_directory, config_file)
+    assert "Running computation for helium" in capsys.readouterr().out
+    with xr.open_dataset(output_file) as output:
+        assert output.radas_fingerprint != fingerprint
+        fingerprint = output.radas_fingerprint
+
+    source_file = next((radas_directory / "data_files").glob("scd*.dat"))
+    source_file.write_text(source_file.read_text() + "C\n")
+    run(radas_directory, config_file)
+    assert "Running computation for helium" in capsys.readouterr().out
+    with xr.open_dataset(output_file) as output:
+        assert output.radas_fingerprint != fingerprint
+
+
+def test_run_with_an_older_config(radas_directory):
+    from radas.shared import default_config_file, default_globals, open_yaml_file
+
+    # The config from before the globals with defaults (and url_base) were added
+    configuration = open_yaml_file(default_config_file)
+    configuration.pop("url_base")
+    configuration["globals"] = {
+        key: value for key, value in configuration["globals"].items() if key not in default_globals
+    }
+    configuration["globals"].update(electron_density_resolution=5, electron_temp_resolution=10)
+    config_file = radas_directory / "config.yaml"
+    config_file.write_text(yaml.safe_dump(configuration))
+
+    run(radas_directory, config_file, plots=False)
+    with xr.open_dataset(radas_directory / "output" / "helium.nc") as output:
+        assert output.charge_state_evolution.sizes["dim_time"] == 50
+        assert "radas_fingerprint" in output.attrs
+
+
+def test_plots_are_only_remade_when_out_of_date(radas_directory, capsys, monkeypatch):
+    import os
+    import multiprocessing as mp
+    import matplotlib.pyplot as plt
+    from radas.mavrin_reference import compare_radas_to_mavrin
+
+    output_dir = radas_directory / "output"
+    plot_file = output_dir / "helium.png"
+    config_file = write_config(radas_directory)
+
+    run(radas_directory, config_file, plots=False)
+    assert not plot_file.exists()
+
+    run(radas_directory, config_file)
+    assert plot_file.exists()
+    # The figures are not kept open by pyplot
+    assert plt.get_fignums() == []
+
+    modified = plot_file.stat().st_mtime_ns
+    capsys.readouterr()
+    # The Mavrin data is not read if there is nothing to plot
+    with monkeypatch.context() as patch:
+        patch.setattr("radas.mavrin_reference.compare_to_mavrin.read_mavrin_data", lambda: pytest.fail("Mavrin data was read"))
+        compare_radas_to_mavrin(output_dir, verbose=1)
+    assert "Plots are up to date" in capsys.readouterr().out
+    assert plot_file.stat().st_mtime_ns == modified
+
+    # A plot which is older than its output is remade (on the pool, if given)
+    output_file = output_dir / "helium.nc"
+    older = output_file.stat().st_mtime_ns - 10**9
+    os.utime(plot_file, ns=(older, older))
+    with mp.Pool(1) as pool:
+        compare_radas_to_mavrin(output_dir, pool=pool)
+    assert plot_file.stat().st_mtime_ns > output_file.stat().st_mtime_ns
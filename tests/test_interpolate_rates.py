@@ -0,0 +1,78 @@
+"""Check the batched interpolation against the per-charge-state reference implementation."""
+
+import pytest
+import numpy as np
+import xarray as xr
+
+from radas.interpolate_rates import interpolate_array, interpolate_charge_states
+
+
+@pytest.fixture()
+def rate_coefficient():
+    from radas.unit_handling import ureg
+
+    rng = np.random.default_rng(seed=0)
+    electron_density = np.logspace(13, 21, 12)
+    electron_temp = np.logspace(-0.5, 4, 19)
+    values = 10 ** (-12 + rng.normal(scale=0.1, size=(4, electron_temp.size, electron_density.size)))
+    # A charge state with zero rate must be handled without log-interpolating
+    values[-1] = 0.0
+
+    return xr.DataArray(values, coords=dict(
+        dim_charge_state=np.arange(4),
+        dim_electron_temp=electron_temp,
+        dim_electron_density=electron_density,
+    )).pint.quantify(ureg.m**3 / ureg.s)
+
+
+@pytest.mark.filterwarnings("error")
+def test_interpolate_charge_states_matches_reference(rate_coefficient):
+    new_electron_density = np.logspace(13, 21, 20)
+    new_electron_temp = np.logspace(-0.5, 4, 80)
+
+    batched = interpolate_charge_states(rate_coefficient, new_electron_density, new_electron_temp)
+    reference = rate_coefficient.groupby("dim_charge_state").map(
+        interpolate_array, args=(new_electron_density, new_electron_temp)
+    )
+
+    assert batched.dims == reference.dims
+    assert batched.pint.units == reference.pint.units
+    np.testing.assert_allclose(batched.pint.magnitude, reference.pint.magnitude, rtol=1e-10, atol=0.0)
+    assert np.all(batched.isel(dim_charge_state=-1).pint.magnitude == 0.0)
+
+
+def test_interpolate_charge_states_extrapolation(rate_coefficient):
+    new_electron_density = np.logspace(12, 22, 20)
+    new_electron_temp = np.logspace(-0.5, 4, 80)
+
+    with pytest.warns(RuntimeWarning, match="Nearest-neighbour extrapolation"):
+        batched = interpolate_charge_states(rate_coefficient, new_electron_density, new_electron_temp)
+    with pytest.warns(RuntimeWarning, match="Nearest-neighbour extrapolation"):
+        reference = rate_coefficient.groupby("dim_charge_state").map(
+            interpolate_array, args=(new_electron_density, new_electron_temp)
+        )
+
+    np.testing.assert_allclose(batched.pint.magnitude, reference.pint.magnitude, rtol=1e-10, atol=0.0)
+
+
+def test_interpolate_charge_states_rejects_zeros(rate_coefficient):
+    rate_coefficient.data.magnitude[0, 0, 0] = 0.0
+
+    with pytest.raises(NotImplementedError):
+        interpolate_charge_states(rate_coefficient, np.logspace(13, 21, 20), np.logspace(-0.5, 4, 80))
+
+
+@pytest.mark.filterwarnings("error")
+def test_interpolation_matrix_cache(rate_coefficient):
+    from radas.interpolate_rates import build_interpolation_matrix, _build_interpolation_matrix_cached
+
+    x = np.log10(rate_coefficient.dim_electron_temp.values)
+    x_interp = np.linspace(x.min(), x.max(), 37)
+
+    hits = _build_interpolation_matrix_cached.cache_info().hits
+    first = build_interpolation_matrix(x, x_interp)
+    second = build_interpolation_matrix(x.copy(), x_interp.copy())
+
+    assert second is first
+    assert _build_interpolation_matrix_cached.cache_info().hits == hits + 1
+    assert not first.flags.writeable
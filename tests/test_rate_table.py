@@ -0,0 +1,124 @@
+"""Check the compiled RateTable against the spline interpolation used by read_rate_coeff."""
+
+import time
+import pytest
+import numpy as np
+import xarray as xr
+from scipy.interpolate import RectBivariateSpline
+
+from radas import RateTable, ureg
+
+# Lower bound (in points/s) for test_rate_table_throughput, about a tenth of the measured throughput
+throughput_floor = 1e5
+
+
+@pytest.fixture()
+def dataset():
+    rng = np.random.default_rng(seed=0)
+    electron_density = np.logspace(17, 21, 12)
+    electron_temp = np.logspace(0, 4, 19)
+    ne_tau = np.array([1e16, 1e17, 1e18])
+
+    rate = 10 ** (-14 + rng.normal(scale=0.1, size=(4, electron_temp.size, electron_density.size)))
+    # The padded charge state is zero everywhere
+    rate[-1] = 0.0
+    mean_charge = (1.0 + np.arange(ne_tau.size))[:, np.newaxis, np.newaxis] * rng.uniform(
+        0.0, 1.0, size=(electron_temp.size, electron_density.size)
+    )
+
+    coords = dict(
+        dim_charge_state=np.arange(4),
+        dim_electron_temp=electron_temp,
+        dim_electron_density=electron_density,
+        dim_ne_tau=ne_tau,
+    )
+    dataset = xr.Dataset(
+        dict(
+            effective_ionisation=(("dim_charge_state", "dim_electron_temp", "dim_electron_density"), rate),
+            mean_charge_state=(("dim_ne_tau", "dim_electron_temp", "dim_electron_density"), mean_charge),
+            electron_density=("dim_electron_density", electron_density),
+            electron_temp=("dim_electron_temp", electron_temp),
+            ne_tau=("dim_ne_tau", ne_tau),
+        ),
+        coords=coords,
+    )
+    return dataset.pint.quantify(
+        effective_ionisation=ureg.m**3 / ureg.s,
+        mean_charge_state=ureg.dimensionless,
+        electron_density=ureg.m**-3,
+        electron_temp=ureg.eV,
+        ne_tau=ureg.m**-3 * ureg.s,
+    )
+
+
+def reference_spline(dataset, key, log_values, **selection):
+    array = dataset[key].pint.dequantify().sel(selection).transpose("dim_electron_density", "dim_electron_temp")
+    values = np.log10(array.values) if log_values else array.values
+    return RectBivariateSpline(np.log10(array.dim_electron_density), np.log10(array.dim_electron_temp), values)
+
+
+@pytest.mark.filterwarnings("error")
+def test_rate_table_matches_spline(dataset):
+    table = RateTable(dataset)
+    assert sorted(table.quantities) == ["effective_ionisation", "mean_charge_state"]
+    assert table.dims["effective_ionisation"] == ["dim_charge_state"]
+
+    rng = np.random.default_rng(seed=1)
+    electron_density = 10 ** rng.uniform(17, 21, size=1000)
+    electron_temp = 10 ** rng.uniform(0, 4, size=1000)
+
+    result = table.evaluate(electron_density, electron_temp, quantities=["effective_ionisation"])
+    assert result["effective_ionisation"].shape == (4, 1000)
+    assert ureg.Unit(table.units["effective_ionisation"]) == ureg.m**3 / ureg.s
+
+    for charge_state in range(3):
+        spline = reference_spline(dataset, "effective_ionisation", True, dim_charge_state=charge_state)
+        np.testing.assert_allclose(
+            result["effective_ionisation"][charge_state],
+            10 ** spline.ev(np.log10(electron_density), np.log10(electron_temp)),
+            rtol=1e-12,
+        )
+    assert np.all(result["effective_ionisation"][-1] == 0.0)
+
+
+def test_rate_table_ne_tau_and_clipping(dataset):
+    table = RateTable(dataset)
+
+    with pytest.raises(ValueError):
+        table.evaluate(1e19, 100.0, quantities=["mean_charge_state"])
+
+    electron_density = np.array([1e18, 1e19, 1e25, 1e10])
+    electron_temp = np.array([5.0, 100.0, 1e6, 0.1])
+    clipped_density = np.clip(electron_density, 1e17, 1e21)
+    clipped_temp = np.clip(electron_temp, 1.0, 1e4)
+
+    def reference(ne_tau):
+        spline = reference_spline(dataset, "mean_charge_state", True, dim_ne_tau=ne_tau)
+        return 10 ** spline.ev(np.log10(clipped_density), np.log10(clipped_temp))
+
+    # On an ne_tau node, below the grid (clipped) and between nodes (linear in log10(ne_tau))
+    for ne_tau, expected in [
+        (1e17, reference(1e17)),
+        (1e14, reference(1e16)),
+        (10**17.25, 0.75 * reference(1e17) + 0.25 * reference(1e18)),
+    ]:
+        result = table.evaluate(electron_density, electron_temp, ne_tau=ne_tau, quantities=["mean_charge_state"])
+        np.testing.assert_allclose(result["mean_charge_state"], expected, rtol=1e-12, atol=1e-14)
+
+
+@pytest.mark.slow
+def test_rate_table_throughput(dataset):
+    table = RateTable(dataset)
+
+    rng = np.random.default_rng(seed=2)
+    number_of_points = 1_000_000
+    electron_density = 10 ** rng.uniform(17, 21, size=number_of_points)
+    electron_temp = 10 ** rng.uniform(0, 4, size=number_of_points)
+    ne_tau = 10 ** rng.uniform(16, 18, size=number_of_points)
+
+    start = time.perf_counter()
+    result = table.evaluate(electron_density, electron_temp, ne_tau=ne_tau)
+    elapsed = time.perf_counter() - start
+
+    assert all(np.all(np.isfinite(values)) for values in result.values())
+    assert number_of_points / elapsed > throughput_floor, f"RateTable evaluated {number_of_points / elapsed:.3e} points/s"
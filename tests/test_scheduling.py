@@ -0,0 +1,270 @@
+"""Check the planning and scheduling of the time evolution tasks."""
+
+import os
+import multiprocessing as mp
+import pytest
+import numpy as np
+import xarray as xr
+
+from radas.scheduling import plan_time_evolution_tasks, estimate_time_evolution_cost, summarise_time_evolution
+
+
+@pytest.fixture()
+def dataset(helium_dataset):
+    helium_dataset["time_evolution_method"] = "eigendecomposition"
+    return helium_dataset
+
+
+def start_computation(dataset, output_dir):
+    "Write the output without the time evolution, and summarise the time evolution to read its inputs from the output."
+    from radas.pipeline import run_radas_computation
+
+    run_radas_computation(dataset.copy(), output_dir, verbose=0, defer_time_evolution=True)
+    return summarise_time_evolution(dataset, source=output_dir / f"{dataset.species_name}.nc")
+
+
+def test_plan_time_evolution_tasks(dataset):
+    # A heavier species, which only needs the right sizes for planning
+    heavy_dataset = dataset.pad(dim_charge_state=(0, 40), constant_values=0.0)
+    summaries = dict(helium=summarise_time_evolution(dataset), heavy=summarise_time_evolution(heavy_dataset))
+
+    assert estimate_time_evolution_cost(summaries["heavy"]) > estimate_time_evolution_cost(summaries["helium"])
+
+    tasks = plan_time_evolution_tasks(summaries, number_of_workers=4)
+    predicted_times = [task["predicted_time"] for task in tasks]
+    assert predicted_times == sorted(predicted_times, reverse=True)
+    assert {task["species_name"] for task in tasks} == {"helium", "heavy"}
+
+    # Every electron temperature is covered exactly once, and the heavy species is split into more tasks
+    for species_name in ["helium", "heavy"]:
+        species_tasks = sorted([task for task in tasks if task["species_name"] == species_name], key=lambda task: task["index"])
+        electron_temps = np.concatenate([task["inputs"][0].dim_electron_temp.values for task in species_tasks])
+        np.testing.assert_array_equal(electron_temps, dataset.dim_electron_temp.values)
+        np.testing.assert_allclose(
+            sum(task["predicted_time"] for task in species_tasks), estimate_time_evolution_cost(summaries[species_name])
+        )
+
+    number_of_tasks = {name: sum(task["species_name"] == name for task in tasks) for name in ["helium", "heavy"]}
+    assert number_of_tasks["heavy"] > number_of_tasks["helium"]
+
+
+def test_run_scheduled_computations(dataset, tmp_path, capsys):
+    from radas.pipeline import run_scheduled_computations, run_radas_computation
+
+    dataset = dataset.isel(dim_electron_temp=slice(None, None, 4))
+    summaries = dict(helium=start_computation(dataset, tmp_path / "scheduled"))
+    with xr.open_dataset(tmp_path / "scheduled" / "helium.nc") as deferred:
+        assert "charge_state_evolution" not in deferred
+        assert "equilibrium_Lz" in deferred
+
+    with mp.Pool(2) as pool:
+        run_scheduled_computations(summaries, verbose=1, pool=pool, number_of_workers=2)
+    run_radas_computation(dataset.copy(), tmp_path / "serial", verbose=0)
+
+    assert "Time evolution for helium: predicted" in capsys.readouterr().out
+    with xr.open_dataset(tmp_path / "scheduled" / "helium.nc") as scheduled, xr.open_dataset(tmp_path / "serial" / "helium.nc") as serial:
+        xr.testing.assert_identical(scheduled.drop_attrs(), serial.drop_attrs())
+
+
+@pytest.fixture()
+def configuration():
+    from radas.shared import default_config_file, open_yaml_file
+
+    configuration = open_yaml_file(default_config_file)
+    configuration["globals"]["time_evolution_method"] = "eigendecomposition"
+    configuration["species"]["alias"] = configuration["species"]["helium"]
+    return configuration
+
+
+def test_run_species_computation(synthetic_data_file_dir, configuration, tmp_path, capsys):
+    import pickle
+    from radas import required_rate_coefficients
+    from radas.pipeline import run_species_computation, run_pipelined_computations, read_output_fingerprint
+
+    work_units = {
+        species_name: (species_name, configuration, synthetic_data_file_dir, tmp_path, 0, True, required_rate_coefficients())
+        for species_name in ["helium", "alias"]
+    }
+    summary = run_species_computation(*work_units["helium"])
+
+    # Only a small summary (without the rate coefficients) is sent back from the workers
+    with xr.open_dataset(tmp_path / "helium.nc") as output:
+        assert len(pickle.dumps(summary)) < output.effective_ionisation.nbytes / 10
+    # The output is not up to date until the time evolution is added
+    assert read_output_fingerprint(tmp_path / "helium.nc") is None
+
+    # The alias has the same inputs as helium, so it is not read or computed again
+    work_units["alias"] = ("alias", configuration, synthetic_data_file_dir, tmp_path, 1, True, required_rate_coefficients())
+    run_pipelined_computations(work_units, tmp_path, verbose=0, pool=None, number_of_workers=1)
+    output = capsys.readouterr().out
+    assert "Reusing the computation for helium for alias" in output
+    assert "Running computation for alias" not in output
+    with xr.open_dataset(tmp_path / "helium.nc") as helium, xr.open_dataset(tmp_path / "alias.nc") as alias:
+        xr.testing.assert_identical(helium.drop_attrs(), alias.drop_attrs())
+        assert alias.species_name == "alias"
+        assert "charge_state_evolution" in alias
+        assert "radas_fingerprint" in alias.attrs
+    assert read_output_fingerprint(tmp_path / "helium.nc") is not None
+
+
+def test_pipelined_computations_overlap_downloads(synthetic_data_file_dir, configuration, tmp_path):
+    import time
+    from radas import required_rate_coefficients
+    from radas.pipeline import run_pipelined_computations
+
+    work_units = {
+        species_name: (species_name, configuration, synthetic_data_file_dir, tmp_path, 0, True, required_rate_coefficients())
+        for species_name in ["helium", "alias"]
+    }
+    finished_before_download = []
+
+    def download(on_species_downloaded):
+        "Only 'download' the second species once the first has been computed."
+        on_species_downloaded("helium")
+        deadline = time.monotonic() + 60.0
+        while not (tmp_path / "helium.nc").exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        finished_before_download.append((tmp_path / "helium.nc").exists())
+        on_species_downloaded("alias")
+
+    with mp.Pool(2) as pool:
+        run_pipelined_computations(work_units, tmp_path, verbose=0, pool=pool, number_of_workers=2, download=download)
+
+    assert finished_before_download == [True]
+    for species_name in ["helium", "alias"]:
+        with xr.open_dataset(tmp_path / f"{species_name}.nc") as output:
+            assert "charge_state_evolution" in output
+
+
+def test_memory_budget(dataset):
+    from radas.scheduling import estimate_time_evolution_memory, estimate_main_process_memory, limit_workers_by_memory
+
+    summary = summarise_time_evolution(dataset)
+    datasets = dict(helium=summary)
+    smallest_task_memory = estimate_time_evolution_memory(summary, 1)
+    main_process_memory = estimate_main_process_memory(datasets)
+    assert estimate_time_evolution_memory(summary) > smallest_task_memory > 0.0
+
+    # Room for exactly three of the smallest tasks
+    max_memory = main_process_memory + 3.5 * smallest_task_memory
+    assert limit_workers_by_memory(datasets, 8, max_memory) == 3
+    assert limit_workers_by_memory(datasets, 2, max_memory) == 2
+    with pytest.warns(RuntimeWarning):
+        assert limit_workers_by_memory(datasets, 8, main_process_memory) == 1
+
+    # The tasks are split so that each worker stays within its share of the budget
+    tasks = plan_time_evolution_tasks(datasets, 3, max_memory=max_memory)
+    assert max(task["predicted_memory"] for task in tasks) <= (max_memory - main_process_memory) / 3
+    assert len(tasks) == dataset.sizes["dim_electron_temp"]
+
+
+def test_run_scheduled_computations_within_memory(dataset, tmp_path):
+    from radas.pipeline import run_scheduled_computations
+    from radas.scheduling import estimate_time_evolution_memory, estimate_main_process_memory
+
+    dataset = dataset.isel(dim_electron_temp=slice(None, None, 4))
+    summaries = dict(helium=start_computation(dataset, tmp_path))
+    # Only one of the smallest tasks fits in the budget at a time
+    max_memory = estimate_main_process_memory(summaries) + 1.5 * estimate_time_evolution_memory(summaries["helium"], 1)
+
+    with mp.Pool(2) as pool:
+        run_scheduled_computations(summaries, verbose=0, pool=pool, number_of_workers=2, max_memory=max_memory)
+
+    with xr.open_dataset(tmp_path / "helium.nc") as output:
+        assert output.charge_state_evolution.sizes["dim_electron_temp"] == dataset.sizes["dim_electron_temp"]
+
+
+def test_species_computation_memory(synthetic_data_file_dir, configuration, tmp_path):
+    from radas import required_rate_coefficients
+    from radas.pipeline import run_pipelined_computations
+    from radas.scheduling import estimate_species_computation_memory
+
+    dataset_types = required_rate_coefficients()
+    memory = estimate_species_computation_memory(configuration, "helium", dataset_types)
+    assert estimate_species_computation_memory(configuration, "tungsten", dataset_types) > 10 * memory
+
+    # The budget only fits a single species at a time, so the species are run one after the other
+    configuration["globals"]["run_time_evolution"] = False
+    # A species which differs from helium (so that it is computed separately)
+    configuration["species"]["other"] = dict(configuration["species"]["helium"], steady_state_tolerance=1e-5)
+    work_units = {
+        species_name: (species_name, configuration, synthetic_data_file_dir, tmp_path, 0, True, dataset_types)
+        for species_name in ["helium", "other"]
+    }
+    with mp.Pool(2) as pool:
+        run_pipelined_computations(work_units, tmp_path, verbose=0, pool=pool, number_of_workers=2, max_memory=1.5 * memory)
+
+    for species_name in ["helium", "other"]:
+        with xr.open_dataset(tmp_path / f"{species_name}.nc") as output:
+            # The estimate covers (at least) the output of the species
+            assert output.nbytes < memory
+
+
+def test_species_override_of_the_grid(read_synthetic_dataset, configuration):
+    from radas import required_rate_coefficients
+    from radas.scheduling import estimate_species_computation_memory
+
+    dataset_types = required_rate_coefficients()
+    memory = estimate_species_computation_memory(configuration, "helium", dataset_types)
+    electron_temp_resolution = configuration["globals"]["electron_temp_resolution"]
+    configuration["species"]["helium"]["electron_temp_resolution"] = 10
+
+    # The grid, its metadata and the memory estimate all use the resolution set for the species
+    dataset = read_synthetic_dataset("helium", configuration)
+    assert dataset.sizes["dim_electron_temp"] == 10
+    assert dataset.electron_temp_resolution == 10
+    assert dataset.sizes["dim_electron_density"] == dataset.electron_density_resolution
+    np.testing.assert_allclose(
+        estimate_species_computation_memory(configuration, "helium", dataset_types), memory * 10 / electron_temp_resolution
+    )
+
+
+def test_merge_globals(configuration):
+    from radas.shared import merge_globals
+
+    # A config written before charge_state_bundle_size was added, with the bundle size set for a single species
+    del configuration["globals"]["charge_state_bundle_size"]
+    configuration["species"]["tungsten"]["charge_state_bundle_size"] = 4
+
+    assert merge_globals(configuration, "tungsten")["charge_state_bundle_size"] == 4
+    assert merge_globals(configuration, "helium")["charge_state_bundle_size"] == 1
+    assert merge_globals(configuration, "helium")["time_evolution_method"] == "eigendecomposition"
+
+
+def test_parse_memory():
+    import click
+    from radas.cli import parse_memory
+
+    assert parse_memory("16GB") == 16e9
+    assert parse_memory("500 MiB") == 500 * 2**20
+    assert parse_memory("2") == 2e9
+    with pytest.raises(click.BadParameter):
+        parse_memory("16 m")
+
+
+def test_limit_worker_threads(monkeypatch):
+    from radas.scheduling import limit_worker_threads, thread_count_variables
+
+    for variable in thread_count_variables:
+        monkeypatch.delenv(variable, raising=False)
+    limit_worker_threads(2)
+
+    assert all(os.environ[variable] == "2" for variable in thread_count_variables)
+
+
+def test_run_scheduled_computations_with_reduced_output(dataset, tmp_path):
+    from radas.pipeline import run_scheduled_computations
+    from radas.scheduling import estimate_main_process_memory
+
+    dataset = dataset.isel(dim_electron_temp=slice(None, None, 4))
+    full_memory = estimate_main_process_memory(dict(helium=summarise_time_evolution(dataset)))
+    dataset["time_evolution_output"] = "mean_charge_state"
+    summaries = dict(helium=start_computation(dataset, tmp_path))
+    assert estimate_main_process_memory(summaries) < full_memory / 2
+
+    with mp.Pool(2) as pool:
+        run_scheduled_computations(summaries, verbose=0, pool=pool, number_of_workers=2)
+
+    with xr.open_dataset(tmp_path / "helium.nc") as output:
+        assert "charge_state_evolution" not in output
+        assert output.mean_charge_state_evolution.dims == ("dim_electron_temp", "dim_electron_density", "dim_ne_tau", "dim_time")
@@ -0,0 +1,41 @@
+"""Check the direct steady-state solver against integrating the time evolution to steady state."""
+
+import pytest
+import numpy as np
+
+from radas import (
+    Quantity,
+    calculate_time_evolution,
+    calculate_steady_state_fractional_abundances,
+)
+
+
+@pytest.fixture()
+def dataset(reduced_helium_dataset):
+    return reduced_helium_dataset
+
+
+def test_steady_state_matches_time_evolution(dataset):
+    # Integrate for long enough to reach steady state at the lowest density (tau = ne_tau / ne ~ 1e4 s)
+    dataset["evolution_stop"] = Quantity(1e7, "s")
+
+    steady_state = calculate_steady_state_fractional_abundances(dataset)
+    time_evolution = calculate_time_evolution(dataset).isel(dim_time=-1)
+
+    assert steady_state.dims == time_evolution.dims
+    np.testing.assert_allclose(steady_state.pint.magnitude, time_evolution.pint.magnitude, rtol=1e-3, atol=1e-9)
+    np.testing.assert_allclose(steady_state.sum(dim="dim_charge_state").pint.magnitude, 1.0, rtol=1e-12)
+
+
+@pytest.mark.filterwarnings("error")
+def test_steady_state_tends_to_coronal(dataset):
+    from radas import calculate_coronal_fractional_abundances
+
+    # With very weak refuelling, the steady state tends to the coronal equilibrium (wherever the rates
+    # are much faster than the refuelling, so excluding the lowest temperatures)
+    dataset = dataset.isel(dim_ne_tau=[0]).sel(dim_electron_temp=slice(10.0, None))
+    dataset["ne_tau"] = dataset.ne_tau * 1e14
+    steady_state = calculate_steady_state_fractional_abundances(dataset).isel(dim_ne_tau=0)
+    coronal = calculate_coronal_fractional_abundances(dataset).transpose(*steady_state.dims)
+
+    np.testing.assert_allclose(steady_state.pint.magnitude, coronal.values, atol=1e-6)
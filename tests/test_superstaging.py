@@ -0,0 +1,115 @@
+"""Check the bundling of charge states into superstages against the fully resolved calculation."""
+
+import pytest
+import numpy as np
+import xarray as xr
+
+from radas.superstaging import (
+    assign_charge_state_bundles,
+    bundle_charge_states,
+    unbundle_charge_states,
+    compare_bundled_to_resolved,
+)
+
+
+@pytest.fixture(scope="module")
+def dataset(read_synthetic_dataset):
+    return read_synthetic_dataset("tungsten").isel(dim_electron_temp=slice(None, None, 8), dim_electron_density=slice(None, None, 5))
+
+
+def test_assign_charge_state_bundles():
+    np.testing.assert_array_equal(assign_charge_state_bundles(8, 3), [0, 1, 1, 1, 2, 2, 2, 3])
+    np.testing.assert_array_equal(assign_charge_state_bundles(4, 1), [0, 1, 2, 3])
+
+
+def test_bundle_charge_states(dataset):
+    assert bundle_charge_states(dataset, 1) == (dataset, None)
+
+    bundled, partition = bundle_charge_states(dataset, 4)
+    assert bundled.sizes["dim_charge_state"] == 1 + int(np.ceil(74 / 4))
+    assert bundled.atomic_number == bundled.sizes["dim_charge_state"] - 1
+    np.testing.assert_allclose(partition.groupby("charge_state_bundle").sum(), 1.0)
+
+
+def test_bundled_equilibrium_is_exact(dataset):
+    from radas.coronal_equilibrium import calculate_coronal_fractional_abundances
+    from radas.steady_state import calculate_steady_state_fractional_abundances
+    from radas.radiated_power import calculate_Lz
+
+    bundled, partition = bundle_charge_states(dataset, 4, refuelled=False)
+    coronal = calculate_coronal_fractional_abundances(dataset)
+    np.testing.assert_allclose(unbundle_charge_states(calculate_coronal_fractional_abundances(bundled), partition), coronal, atol=1e-12)
+
+    bundled, partition = bundle_charge_states(dataset, 4)
+    bundled_steady_state = calculate_steady_state_fractional_abundances(bundled)
+    steady_state = unbundle_charge_states(bundled_steady_state, partition)
+    np.testing.assert_allclose(
+        steady_state.pint.magnitude, calculate_steady_state_fractional_abundances(dataset).pint.magnitude, atol=1e-12
+    )
+
+    # The bundled emission coefficients give the same Lz as the reconstructed charge-state fractions
+    np.testing.assert_allclose(
+        calculate_Lz(bundled, bundled_steady_state).pint.magnitude, calculate_Lz(dataset, steady_state).pint.magnitude, rtol=1e-10
+    )
+
+
+def test_bundle_size_for_a_single_species(read_synthetic_dataset):
+    from radas.shared import default_config_file, open_yaml_file
+
+    configuration = open_yaml_file(default_config_file)
+    configuration["species"]["tungsten"]["charge_state_bundle_size"] = 4
+    dataset = read_synthetic_dataset("tungsten", configuration)
+
+    assert dataset.charge_state_bundle_size == 4
+    assert configuration["globals"]["charge_state_bundle_size"] == 1
+
+    # The species can set the bundle size even if the config has no global for it
+    del configuration["globals"]["charge_state_bundle_size"]
+    dataset = read_synthetic_dataset("tungsten", configuration)
+    assert dataset.charge_state_bundle_size == 4
+
+
+def test_run_radas_computation_with_bundles(dataset, tmp_path):
+    from radas.pipeline import run_radas_computation
+
+    bundled_dataset = dataset.copy()
+    bundled_dataset["time_evolution_method"] = "eigendecomposition"
+    bundled_dataset["charge_state_bundle_size"] = 4
+    run_radas_computation(bundled_dataset, tmp_path / "bundled", verbose=0)
+
+    resolved_dataset = bundled_dataset.copy()
+    resolved_dataset["charge_state_bundle_size"] = 1
+    run_radas_computation(resolved_dataset, tmp_path / "resolved", verbose=0)
+
+    with xr.open_dataset(tmp_path / "bundled" / "tungsten.nc") as bundled, xr.open_dataset(tmp_path / "resolved" / "tungsten.nc") as resolved:
+        assert bundled.charge_state_evolution.sizes == resolved.charge_state_evolution.sizes
+        for key in ["coronal_charge_state_fraction", "equilibrium_charge_state_fraction", "equilibrium_mean_charge_state"]:
+            np.testing.assert_allclose(bundled[key], resolved[key], atol=1e-10)
+        np.testing.assert_allclose(bundled.equilibrium_Lz, resolved.equilibrium_Lz, rtol=1e-10)
+        # The transients are approximate, but the charge-state fractions are still normalised
+        np.testing.assert_allclose(bundled.charge_state_evolution.sum(dim="dim_charge_state"), 1.0, atol=1e-9)
+
+
+def test_compare_bundled_to_resolved(dataset):
+    report = compare_bundled_to_resolved(
+        dataset.isel(dim_electron_temp=slice(None, None, 2)).assign(time_evolution_method="eigendecomposition"), bundle_sizes=(4,)
+    )
+
+    assert list(report.index) == [1, 4]
+    assert report.loc[1, "max_evolution_error"] == 0.0
+    assert report.loc[4, "number_of_states"] < report.loc[1, "number_of_states"]
+    assert report.loc[4, "max_equilibrium_error"] < 1e-12
+    assert 0.0 < report.loc[4, "mean_evolution_error"] < report.loc[4, "max_evolution_error"]
+
+
+@pytest.mark.slow
+def test_bundling_accuracy_and_speed(dataset):
+    report = compare_bundled_to_resolved(dataset)
+
+    assert np.all(np.diff(report["number_of_states"]) < 0)
+    assert np.all(np.isfinite(report["max_evolution_error"]))
+    assert np.all(report["max_evolution_error"] <= 1.0)
+    # Bundling only approximates the transients, so the equilibrium is unchanged
+    assert np.all(report["max_equilibrium_error"] < 1e-12)
+    assert np.all(report["max_relative_Lz_error"] < 1e-12)
+    assert report["speedup"].iloc[-1] > 1.0, f"Speedup for each bundle size:\n{report['speedup']}"
@@ -0,0 +1,348 @@
+"""Check the vectorised time-evolution kernels against a per-charge-state reference."""
+
+import time
+import pytest
+import numpy as np
+
+from radas.time_evolution import calculate_derivative, shift
+
+
+def reference_kahan_babushka_neumaier_sum(values_to_sum):
+    running_sum = 0.0
+    compensation = 0.0
+
+    for value in values_to_sum:
+        temporary_sum = running_sum + value
+
+        if running_sum >= value:
+            compensation += running_sum - temporary_sum + value
+        else:
+            compensation += value - temporary_sum + running_sum
+
+        running_sum = temporary_sum
+
+    return running_sum + compensation
+
+
+def reference_derivative(charge_state_fraction, effective_ionisation, effective_recombination, electron_density, ne_tau):
+    """The derivative evaluated with a loop over charge states, which calculate_derivative replaces."""
+    ionisation_to_above = effective_ionisation * charge_state_fraction
+    ionisation_from_below = shift(effective_ionisation * charge_state_fraction, +1)
+    recombination_from_above = effective_recombination * shift(charge_state_fraction, -1)
+    recombination_to_below = shift(effective_recombination, +1) * charge_state_fraction
+
+    change_in_charge_state_fraction = np.zeros_like(charge_state_fraction)
+    for i in range(len(change_in_charge_state_fraction)):
+        change_in_charge_state_fraction[i] = reference_kahan_babushka_neumaier_sum(
+            [-ionisation_to_above[i], ionisation_from_below[i], recombination_from_above[i], -recombination_to_below[i]]
+        )
+
+    change_in_charge_state_fraction -= charge_state_fraction / ne_tau
+    change_in_charge_state_fraction[0] += 1.0 / ne_tau
+
+    return change_in_charge_state_fraction * electron_density
+
+
+@pytest.fixture()
+def rates():
+    """Tungsten-sized rate coefficients, with zeros in the padded charge state as in the radas datasets."""
+    rng = np.random.default_rng(seed=0)
+    number_of_charge_states = 75
+    effective_ionisation = 10 ** rng.uniform(-20, -12, size=number_of_charge_states)
+    effective_recombination = 10 ** rng.uniform(-20, -12, size=number_of_charge_states)
+    effective_ionisation[-1] = 0.0
+    effective_recombination[-1] = 0.0
+    return effective_ionisation, effective_recombination
+
+
+@pytest.mark.parametrize("ne_tau", [np.inf, 5e16])
+def test_derivative_matches_reference(rates, ne_tau):
+    rng = np.random.default_rng(seed=1)
+
+    for _ in range(20):
+        charge_state_fraction = rng.dirichlet(np.full(75, 0.1))
+        derivative = calculate_derivative(0.0, charge_state_fraction, *rates, 1e20, ne_tau)
+        reference = reference_derivative(charge_state_fraction, *rates, 1e20, ne_tau)
+
+        np.testing.assert_array_equal(derivative, reference)
+
+
+def test_derivative_of_batch(rates):
+    rng = np.random.default_rng(seed=2)
+    charge_state_fractions = rng.dirichlet(np.full(75, 0.1), size=8).T
+    electron_density = np.logspace(18, 21, 8)
+
+    derivative = calculate_derivative(0.0, charge_state_fractions, *rates, electron_density, 5e16)
+
+    assert derivative.shape == charge_state_fractions.shape
+    for i in range(8):
+        np.testing.assert_array_equal(
+            derivative[:, i], calculate_derivative(0.0, charge_state_fractions[:, i], *rates, electron_density[i], 5e16)
+        )
+
+
+@pytest.mark.slow
+def test_derivative_throughput(rates):
+    rng = np.random.default_rng(seed=3)
+    charge_state_fraction = rng.dirichlet(np.full(75, 0.1))
+    number_of_calls = 2000
+
+    results = dict()
+    for name, function in [("reference", reference_derivative), ("vectorised", calculate_derivative)]:
+        args = (charge_state_fraction, *rates, 1e20, 5e16)
+        if function is calculate_derivative:
+            args = (0.0, *args)
+
+        start = time.perf_counter()
+        for _ in range(number_of_calls):
+            results[name] = function(*args)
+        elapsed = time.perf_counter() - start
+
+        # The timings depend on the machine, so they are reported rather than checked
+        print(f"{name} derivative for 75 charge states: {1e6 * elapsed / number_of_calls:.1f} us per call")
+
+    np.testing.assert_allclose(results["vectorised"], results["reference"], rtol=1e-12, atol=1e-12 * np.abs(results["reference"]).max())
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_jacobian_matches_derivative(rates, sparse):
+    from radas.time_evolution import calculate_jacobian
+
+    jacobian = calculate_jacobian(*rates, 1e20, 5e16, sparse=sparse)
+    jacobian = jacobian.toarray() if sparse else jacobian
+
+    # The derivative is affine in the charge-state fractions, so each column is a difference of derivatives
+    offset = calculate_derivative(0.0, np.zeros(75), *rates, 1e20, 5e16)
+    expected = np.stack([calculate_derivative(0.0, unit_vector, *rates, 1e20, 5e16) - offset for unit_vector in np.eye(75)], axis=1)
+
+    np.testing.assert_allclose(jacobian, expected, rtol=1e-12, atol=1e-12 * np.abs(expected).max())
+    assert np.count_nonzero(jacobian) <= 3 * 75
+
+
+@pytest.mark.slow
+def test_jacobian_benchmark(rates):
+    from scipy.integrate import solve_ivp
+    from radas.time_evolution import calculate_jacobian
+
+    evaluation_times = np.logspace(-8, 2)
+    initial_state = np.zeros(75)
+    initial_state[0] = 1.0
+    args = (*rates, 1e20, 5e16)
+
+    results = dict()
+    for name, jacobian in [
+        ("finite-difference", None),
+        ("analytic dense", calculate_jacobian(*args)),
+        ("analytic sparse", calculate_jacobian(*args, sparse=True)),
+    ]:
+        start = time.perf_counter()
+        results[name] = solve_ivp(
+            calculate_derivative, y0=initial_state, t_span=[evaluation_times[0], evaluation_times[-1]],
+            t_eval=evaluation_times, args=args, method="Radau", jac=jacobian, rtol=1e-3, atol=1e-12,
+        )
+        elapsed = time.perf_counter() - start
+        assert results[name].success
+
+        # The timings depend on the machine, so they are reported rather than checked
+        print(
+            f"{name} Jacobian for 75 charge states: {1e3 * elapsed:.1f} ms, "
+            f"nfev={results[name].nfev}, njev={results[name].njev}, nlu={results[name].nlu}"
+        )
+
+    np.testing.assert_allclose(results["analytic dense"].y, results["finite-difference"].y, rtol=1e-2, atol=1e-6)
+    np.testing.assert_allclose(results["analytic sparse"].y, results["analytic dense"].y, rtol=1e-10, atol=1e-14)
+    # The analytic Jacobian is passed as a constant, so it is never re-evaluated, and the solver does no more
+    # work than with finite differences
+    for name in ["analytic dense", "analytic sparse"]:
+        assert results[name].njev == 0
+        assert results[name].nfev <= results["finite-difference"].nfev
+        assert results[name].nlu <= results["finite-difference"].nlu
+
+
+@pytest.mark.parametrize("ne_tau", [np.inf, 5e16])
+def test_eigendecomposition_matches_radau(ne_tau, monkeypatch):
+    import radas.time_evolution
+    from radas.time_evolution import time_evolve_by_eigendecomposition, time_evolve_with_radau
+
+    # Count the points which fall back to Radau
+    fallback_points = []
+    def counted_radau(*args, **kwargs):
+        fallback_points.append(args)
+        return time_evolve_with_radau(*args, **kwargs)
+    monkeypatch.setattr(radas.time_evolution, "time_evolve_with_radau", counted_radau)
+
+    # Tungsten-like rates over a range of temperatures, including points where the eigendecomposition
+    # falls back to Radau (at high temperature)
+    charge_state = np.arange(75)
+    electron_temp = np.logspace(0, 4, 12)[:, np.newaxis]
+    effective_ionisation = 1e-14 * np.exp(-13.6 * (charge_state + 1) ** 1.5 / electron_temp) / np.sqrt(electron_temp) + 1e-18
+    effective_recombination = 1e-18 * (charge_state + 1) ** 2 / np.sqrt(electron_temp) * np.ones((12, 75))
+    effective_ionisation[:, -1] = 0.0
+    effective_recombination[:, -1] = 0.0
+    evaluation_times = np.logspace(-8, 2)
+
+    result = time_evolve_by_eigendecomposition(effective_ionisation, effective_recombination, 1e20, ne_tau, evaluation_times)
+    assert result.shape == (12, 75, 50)
+    assert 0 < len(fallback_points) < 12
+
+    for i in range(12):
+        reference = time_evolve_with_radau(effective_ionisation[i], effective_recombination[i], 1e20, ne_tau, evaluation_times)
+        np.testing.assert_allclose(result[i], reference, atol=1e-3)
+    np.testing.assert_allclose(result.sum(axis=1), 1.0, atol=1e-9)
+
+    # With a tolerance which every error estimate exceeds, every point is integrated with Radau
+    fallback_points.clear()
+    result = time_evolve_by_eigendecomposition(
+        effective_ionisation, effective_recombination, 1e20, ne_tau, evaluation_times, tolerance=0.0
+    )
+    assert len(fallback_points) == 12
+    for i in range(12):
+        reference = time_evolve_with_radau(effective_ionisation[i], effective_recombination[i], 1e20, ne_tau, evaluation_times)
+        np.testing.assert_array_equal(result[i], reference)
+
+
+def test_time_evolution_methods_match(reduced_helium_dataset):
+    from radas import calculate_time_evolution
+
+    dataset = reduced_helium_dataset
+
+    results = dict()
+    for method in ["radau", "eigendecomposition"]:
+        dataset["time_evolution_method"] = method
+        results[method] = calculate_time_evolution(dataset)
+
+    assert results["radau"].dims == results["eigendecomposition"].dims
+    np.testing.assert_allclose(
+        results["eigendecomposition"].pint.magnitude, results["radau"].pint.magnitude, atol=1e-3
+    )
+
+    dataset["time_evolution_method"] = "euler"
+    with pytest.raises(NotImplementedError):
+        calculate_time_evolution(dataset)
+
+
+def test_missing_globals_take_their_defaults(read_synthetic_dataset):
+    from radas import calculate_time_evolution
+    from radas.shared import default_config_file, open_yaml_file
+
+    # A config written before these globals were added
+    configuration = open_yaml_file(default_config_file)
+    for key in [
+        "time_evolution_method",
+        "number_of_evolution_times",
+        "time_evolution_output",
+        "stop_at_steady_state",
+        "steady_state_tolerance",
+        "charge_state_bundle_size",
+    ]:
+        del configuration["globals"][key]
+    dataset = read_synthetic_dataset("helium", configuration).isel(
+        dim_electron_temp=slice(None, None, 10), dim_electron_density=slice(None, None, 7)
+    )
+
+    assert dataset.time_evolution_method == "radau"
+    assert dataset.charge_state_bundle_size == 1
+    evolution = calculate_time_evolution(dataset)
+    assert evolution.name == "charge_state_evolution"
+    assert "time_evolution_stop_time" not in evolution.coords
+    np.testing.assert_allclose(evolution.dim_time, np.logspace(-8, 2))
+
+
+def test_time_evolution_on_pool(reduced_helium_dataset):
+    import multiprocessing as mp
+    from radas import calculate_time_evolution
+
+    dataset = reduced_helium_dataset
+
+    serial = calculate_time_evolution(dataset)
+    with mp.Pool(2) as pool:
+        # Split into chunks of a single electron temperature
+        chunked = calculate_time_evolution(dataset, pool=pool, points_per_chunk=1)
+
+    assert chunked.dims == serial.dims
+    np.testing.assert_array_equal(chunked.dim_electron_temp, serial.dim_electron_temp)
+    np.testing.assert_array_equal(chunked.pint.magnitude, serial.pint.magnitude)
+
+
+def test_time_evolution_outputs(reduced_helium_dataset):
+    import xarray as xr
+    from radas import calculate_time_evolution
+    from radas.unit_handling import Quantity
+
+    dataset = reduced_helium_dataset
+    dataset["time_evolution_method"] = "eigendecomposition"
+
+    full = calculate_time_evolution(dataset)
+    assert full.name == "charge_state_evolution"
+    assert full.sizes["dim_time"] == dataset.number_of_evolution_times
+
+    dataset["time_evolution_output"] = "final_state"
+    final_state = calculate_time_evolution(dataset)
+    assert final_state.name == "charge_state_evolution"
+    xr.testing.assert_identical(final_state, full.isel(dim_time=[-1]))
+
+    dataset["time_evolution_output"] = "mean_charge_state"
+    mean_charge_state = calculate_time_evolution(dataset)
+    assert mean_charge_state.name == "mean_charge_state_evolution"
+    assert "dim_charge_state" not in mean_charge_state.dims
+    np.testing.assert_allclose(
+        mean_charge_state.pint.magnitude, (full * full.dim_charge_state).sum(dim="dim_charge_state").pint.magnitude
+    )
+
+    # Listing the times gives the same result at those times, still starting from evolution_start
+    dataset["time_evolution_output"] = "full"
+    listed_times = full.dim_time.values[[10, 30, 49]]
+    dataset["evolution_times"] = xr.DataArray(Quantity(listed_times, "s"), coords={"dim_evolution_times": listed_times})
+    listed = calculate_time_evolution(dataset)
+    np.testing.assert_array_equal(listed.dim_time, listed_times)
+    np.testing.assert_allclose(listed.pint.magnitude, full.isel(dim_time=[10, 30, 49]).pint.magnitude, atol=1e-9)
+
+    dataset = dataset.drop_vars(["evolution_times", "dim_evolution_times"])
+    dataset["evolution_times"] = xr.DataArray(Quantity([1e-9, 1.0], "s"), coords={"dim_evolution_times": [1e-9, 1.0]})
+    with pytest.raises(ValueError):
+        calculate_time_evolution(dataset)
+
+
+@pytest.mark.parametrize("ne_tau", [np.inf, 5e16])
+def test_stop_at_steady_state(rates, ne_tau):
+    from radas.time_evolution import time_evolve_with_radau
+
+    evaluation_times = np.logspace(-8, 2)
+    full = time_evolve_with_radau(*rates, 1e20, ne_tau, evaluation_times)
+    stopped, stop_time = time_evolve_with_radau(*rates, 1e20, ne_tau, evaluation_times, steady_state_tolerance=1e-6)
+
+    assert stopped.shape == full.shape
+    assert evaluation_times[0] < stop_time < evaluation_times[-1]
+    np.testing.assert_allclose(stopped, full, atol=1e-5)
+    # The times after the integration stopped are filled with the final state
+    after_stop = evaluation_times > stop_time
+    np.testing.assert_array_equal(stopped[:, after_stop], stopped[:, [-1]] * np.ones(np.count_nonzero(after_stop)))
+
+    # Without ionisation, the neutral state is already at steady state
+    no_ionisation = np.zeros_like(rates[0])
+    stopped, stop_time = time_evolve_with_radau(
+        no_ionisation, rates[1], 1e20, np.inf, evaluation_times, steady_state_tolerance=1e-6
+    )
+    assert stop_time == evaluation_times[0]
+    np.testing.assert_array_equal(stopped[0], 1.0)
+
+
+def test_time_evolution_stop_times(reduced_helium_dataset, tmp_path, capsys):
+    import xarray as xr
+    from radas import calculate_time_evolution
+    from radas.pipeline import run_radas_computation
+
+    dataset = reduced_helium_dataset
+    full = calculate_time_evolution(dataset)
+
+    dataset["stop_at_steady_state"] = True
+    stopped = calculate_time_evolution(dataset)
+    assert stopped.time_evolution_stop_time.dims == ("dim_electron_temp", "dim_electron_density", "dim_ne_tau")
+    assert (stopped.time_evolution_stop_time.pint.magnitude < full.dim_time.values[-1]).any()
+    np.testing.assert_allclose(stopped.pint.magnitude, full.pint.magnitude, atol=1e-5)
+
+    run_radas_computation(dataset, tmp_path, verbose=1)
+    assert "reached steady state at" in capsys.readouterr().out
+    with xr.open_dataset(tmp_path / "helium.nc") as output:
+        assert output.time_evolution_stop_time.attrs["units"] == output.residence_time.attrs["units"]
+        assert "time_evolution_stop_time" not in output.charge_state_evolution.coords